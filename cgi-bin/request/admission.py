@@ -0,0 +1,259 @@
+"""Admission control for our download services.
+
+Bulk scrapers can easily overwhelm the database, so our exporters call
+`check_load()` prior to doing any work.  This previously polled
+pg_stat_activity, which itself cost a database round trip per request.  Now
+concurrency is tracked locally with `flock`ed slot files, which the kernel
+releases for us when a CGI process exits (even on a crash):
+
+  - Each remote client may hold at most `per_client` slots within a pool, so
+    one scraper can not starve everybody else.  Clients are hashed into a
+    fixed table of CLIENT_BUCKETS, so the lock files do not grow with the
+    number of clients seen (clients sharing a bucket share its slots).
+  - Requests holding a client slot then wait in a FIFO queue for one of the
+    `capacity` pool slots.
+  - A request not admitted within `max_wait` seconds gets a 503 with a
+    `Retry-After` hint scaled by the current queue depth.
+"""
+import os
+import sys
+import time
+import fcntl
+import hashlib
+
+from pyiem.util import ssw
+
+BASEDIR = "/tmp/iem_admission"
+# number of hashed client buckets within a pool
+CLIENT_BUCKETS = 1024
+# proxies whose X-Forwarded-For we trust to identify the client
+TRUSTED_PROXIES = ['127.0.0.1', '::1']
+# seconds between attempts while queued
+POLL_INTERVAL = 0.2
+# bounds on the Retry-After hint (seconds)
+RETRY_MIN = 5
+RETRY_MAX = 120
+
+# File handles that hold our locks, which must live as long as the process
+_HELD = []
+
+
+def _makedirs(path):
+    """Ensure the directory exists"""
+    try:
+        os.makedirs(path)
+    except OSError:
+        if not os.path.isdir(path):
+            raise
+
+
+def _trylock(path):
+    """Attempt a non-blocking exclusive lock, returning the handle or None"""
+    fh = open(path, 'a')
+    try:
+        fcntl.flock(fh, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except (IOError, OSError):
+        fh.close()
+        return None
+    return fh
+
+
+def _acquire_any(paths):
+    """Attempt to lock any one of the provided paths"""
+    for path in paths:
+        fh = _trylock(path)
+        if fh is not None:
+            return fh
+    return None
+
+
+def client_key(environ=None):
+    """Identify the remote client as its bucket number
+
+    X-Forwarded-For is set by whoever makes the request, so it is only used
+    when the request came via one of our proxies, which appends the address
+    it saw to the header.
+    """
+    environ = os.environ if environ is None else environ
+    addr = environ.get('REMOTE_ADDR') or 'unknown'
+    xff = environ.get('HTTP_X_FORWARDED_FOR')
+    if xff and addr in TRUSTED_PROXIES:
+        addr = xff.split(",")[-1].strip() or addr
+    digest = hashlib.md5(addr.encode('utf-8')).hexdigest()
+    return int(digest[:8], 16) % CLIENT_BUCKETS
+
+
+class Queue(object):
+    """A FIFO queue of waiters, each represented by a locked file."""
+
+    def __init__(self, pooldir):
+        """Constructor"""
+        self.qdir = os.path.join(pooldir, 'queue')
+        _makedirs(self.qdir)
+        self.fn = None
+        self.fh = None
+
+    def live_entries(self):
+        """Return sorted queue entries whose owners are still alive"""
+        res = []
+        for fn in sorted(os.listdir(self.qdir)):
+            path = os.path.join(self.qdir, fn)
+            if path == self.fn:
+                res.append(fn)
+                continue
+            # An entry we can lock has been abandoned by a dead process
+            fh = _trylock(path)
+            if fh is None:
+                res.append(fn)
+                continue
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+            fh.close()
+        return res
+
+    def depth(self):
+        """How many requests are waiting"""
+        return len(self.live_entries())
+
+    def join(self):
+        """Enter the queue"""
+        self.fn = os.path.join(self.qdir, "%.6f_%s" % (time.time(),
+                                                       os.getpid()))
+        self.fh = _trylock(self.fn)
+
+    def position(self):
+        """Our zero based position within the queue"""
+        entries = self.live_entries()
+        name = os.path.basename(self.fn)
+        if name not in entries:
+            # somebody reaped our entry prior to us locking it, rejoin
+            self.leave()
+            self.join()
+            return self.position()
+        return entries.index(name)
+
+    def leave(self):
+        """Exit the queue"""
+        if self.fn is None:
+            return
+        try:
+            os.unlink(self.fn)
+        except OSError:
+            pass
+        if self.fh is not None:
+            self.fh.close()
+        self.fn = None
+        self.fh = None
+
+
+def get_queue_depth(pool):
+    """Return the number of requests waiting on this pool"""
+    return Queue(os.path.join(BASEDIR, pool)).depth()
+
+
+def retry_after(depth):
+    """Suggest how long a rejected client should wait prior to retrying"""
+    return int(min(RETRY_MAX, RETRY_MIN + 2 * depth))
+
+
+def reject(pool, depth, script=None):
+    """Emit a 503 response with a Retry-After hint and exit"""
+    script = os.environ.get('SCRIPT_NAME', '') if script is None else script
+    sys.stderr.write(("[client: %s] %s over capacity pool: %s queue: %s\n"
+                      ) % (os.environ.get('REMOTE_ADDR'), script, pool,
+                           depth))
+    ssw("Content-type: text/plain \n")
+    ssw("Retry-After: %s\n" % (retry_after(depth), ))
+    ssw('Status: 503 Service Unavailable\n\n')
+    ssw("ERROR: server over capacity, please try later")
+    sys.exit(0)
+
+
+def acquire(pool, capacity, per_client=4, max_wait=15, environ=None):
+    """Attempt to gain admission to a pool.
+
+    Args:
+      pool (str): name of the shared resource, ie the database name
+      capacity (int): number of concurrent requests we allow within the pool,
+        callers sharing a pool may use differing capacities
+      per_client (int): concurrent requests allowed per remote client
+      max_wait (float): seconds to wait prior to giving up
+
+    Returns:
+      int queue depth when we gave up or None when admitted
+    """
+    pooldir = os.path.join(BASEDIR, pool)
+    cdir = os.path.join(pooldir, 'clients')
+    _makedirs(cdir)
+    deadline = time.time() + max_wait
+    ckey = client_key(environ)
+    cpaths = [os.path.join(cdir, "%04i_%02i.lock" % (ckey, i))
+              for i in range(per_client)]
+    spaths = [os.path.join(pooldir, "slot%03i.lock" % (i, ))
+              for i in range(capacity)]
+    queue = Queue(pooldir)
+    # A client first needs one of its own slots
+    cfh = _acquire_any(cpaths)
+    while cfh is None:
+        if time.time() > deadline:
+            return queue.depth()
+        time.sleep(POLL_INTERVAL)
+        cfh = _acquire_any(cpaths)
+    # Then waits its turn in line for a pool slot
+    queue.join()
+    try:
+        while True:
+            if queue.position() == 0:
+                sfh = _acquire_any(spaths)
+                if sfh is not None:
+                    _HELD.extend([cfh, sfh])
+                    return None
+            if time.time() > deadline:
+                cfh.close()
+                queue.leave()
+                return queue.depth()
+            time.sleep(POLL_INTERVAL)
+    finally:
+        queue.leave()
+
+
+def check_load(pool, capacity, per_client=4, max_wait=15):
+    """Block until admitted to the pool or respond with a 503 and exit."""
+    if os.environ.get('REQUEST_METHOD') == 'OPTIONS':
+        ssw("Allow: GET,POST,OPTIONS\n\n")
+        sys.exit()
+    depth = acquire(pool, capacity, per_client, max_wait)
+    if depth is not None:
+        reject(pool, depth)
+
+
+def test_admission(tmpdir):
+    """Can we take slots and get turned away once they are gone?"""
+    global BASEDIR
+    saved = BASEDIR
+    BASEDIR = str(tmpdir)
+    try:
+        environ = {'REMOTE_ADDR': '10.0.0.1'}
+        assert acquire('test', 2, per_client=3, max_wait=0,
+                       environ=environ) is None
+        assert acquire('test', 2, per_client=3, max_wait=0,
+                       environ=environ) is None
+        # pool exhausted, but another client may still queue
+        assert acquire('test', 2, per_client=3, max_wait=0,
+                       environ={'REMOTE_ADDR': '10.0.0.2'}) == 0
+        assert get_queue_depth('test') == 0
+        assert retry_after(100) == RETRY_MAX
+    finally:
+        BASEDIR = saved
+
+
+def test_client_key():
+    """Do we only trust X-Forwarded-For from our proxies?"""
+    direct = client_key({'REMOTE_ADDR': '10.0.0.1'})
+    assert client_key({'REMOTE_ADDR': '10.0.0.1',
+                       'HTTP_X_FORWARDED_FOR': '10.9.9.9'}) == direct
+    assert client_key({'REMOTE_ADDR': '127.0.0.1',
+                       'HTTP_X_FORWARDED_FOR': '1.2.3.4, 10.0.0.1'}) == direct
+    assert 0 <= direct < CLIENT_BUCKETS
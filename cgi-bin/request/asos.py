@@ -2,7 +2,6 @@
 """
 Download interface for ASOS/AWOS data from the asos database
 """
-import time
 import cgi
 import os
 import sys
@@ -11,6 +10,8 @@ import datetime
 import pytz
 from pyiem.util import get_dbconn, ssw
 
+import admission
+
 NULLS = {
     "M": "M",
     "null": "null",
@@ -56,6 +57,8 @@ CONV_COLS = {
     'sped': 'sknt * 1.15 as sped',
     'gust_mph': 'gust * 1.15 as gust_mph',
 }
+# bytes per read when streaming COPY output to the client
+COPY_CHUNK = 65536
 
 
 def fmt_trace(val, missing, trace):
@@ -96,29 +99,7 @@ def dance(val):
 
 def check_load():
     """Prevent automation from overwhelming the server"""
-    if os.environ['REQUEST_METHOD'] == 'OPTIONS':
-        ssw("Allow: GET,POST,OPTIONS\n\n")
-        sys.exit()
-    for i in range(5):
-        pgconn = get_dbconn('mesosite')
-        mcursor = pgconn.cursor()
-        mcursor.execute("""
-        select pid from pg_stat_activity where query ~* 'FETCH'
-        and datname = 'asos'""")
-        if mcursor.rowcount < 30:
-            return
-        pgconn.close()
-        if i == 4:
-            sys.stderr.write(("[client: %s] "
-                              "/cgi-bin/request/asos.py over capacity: %s\n"
-                              ) % (os.environ.get('REMOTE_ADDR'),
-                                   mcursor.rowcount))
-        else:
-            time.sleep(3)
-    ssw("Content-type: text/plain \n")
-    ssw('Status: 503 Service Unavailable\n\n')
-    ssw("ERROR: server over capacity, please try later")
-    sys.exit(0)
+    admission.check_load('asos', 30)
 
 
 def get_stations(form):
@@ -197,6 +178,147 @@ def build_gisextra(form, dbstations, rD):
     return res
 
 
+def get_formatters(querycols):
+    """Python formatters for each of our query columns."""
+    ff = {
+        'wxcodes': fmt_wxcodes,
+        'metar': fmt_simple,
+        'skyc1': fmt_simple,
+        'skyc2': fmt_simple,
+        'skyc3': fmt_simple,
+        'skyc4': fmt_simple,
+        'p01i': fmt_trace,
+        'p01i * 25.4 as p01m': fmt_trace,
+        'ice_accretion_1hr': fmt_trace,
+        'ice_accretion_3hr': fmt_trace,
+        'ice_accretion_6hr': fmt_trace,
+    }
+    # The default is the %.2f formatter
+    return [ff.get(col, fmt_f2) for col in querycols]
+
+
+def sql_formatter(col, func, missing, trace):
+    """Build SQL that formats a column exactly like its python formatter.
+
+    Floats go through text and float8 so that to_char sees the same double
+    that psycopg2 would have handed to python's %.2f.
+
+    Returns:
+      str SQL expression, list of parameters
+    """
+    expr = "(%s)" % (col.split(" as ")[0], )
+    if func is fmt_wxcodes:
+        return "coalesce(array_to_string(%s, ' '), %%s)" % (expr, ), [missing]
+    if func is fmt_simple:
+        if col.startswith('skyc'):
+            # psycopg2 gets the char(3) padding, casting to text drops it
+            expr = "rpad(%s::text, 3)" % (expr, )
+        return ("coalesce(translate(regexp_replace(%s, '[^[:ascii:]]', '', "
+                "'g'), E',\\n', '  '), %%s)") % (expr, ), [missing]
+    dbl = "%s::text::float8" % (expr, )
+    f2 = "to_char(%s, 'FM999999999990.00')" % (dbl, )
+    if func is fmt_trace:
+        return ("CASE WHEN %s is null THEN %%s "
+                "WHEN %s < 0.009999 and %s > 0 THEN %%s ELSE %s END"
+                ) % (expr, dbl, dbl, f2), [missing, trace]
+    return "coalesce(%s, %%s)" % (f2, ), [missing]
+
+
+def fetch_rows(acursor, querycols, tzinfo, rD, gisextra, gtxt, missing,
+               trace):
+    """Format each row from a server side cursor in python.
+
+    This is the reference implementation that `copy_rows` must match.
+    """
+    formatters = get_formatters(querycols)
+    gismiss = "%s%s%s%s" % (missing, rD, missing, rD)
+    for row in acursor:
+        ssw(row[0] + rD)
+        ssw((row[1].astimezone(tzinfo)).strftime("%Y-%m-%d %H:%M") + rD)
+        if gisextra:
+            ssw(gtxt.get(row[0], gismiss))
+        ssw(rD.join(
+            [func(val, missing, trace)
+             for func, val in zip(formatters, row[2:])]) + "\n")
+
+
+def build_copy_sql(querycols, tzinfo, rD, gisextra, gtxt, missing, trace,
+                   rlimiter):
+    """Build the SELECT that formats each output line within the database.
+
+    Returns:
+      str SQL, list of parameters less the time bounds and stations
+    """
+    params = [rD, tzinfo.zone, rD]
+    line = ("station || %s || "
+            "to_char(valid at time zone %s, 'YYYY-MM-DD HH24:MI') || %s")
+    if gisextra:
+        gismiss = "%s%s%s%s" % (missing, rD, missing, rD)
+        if gtxt:
+            line += " || (CASE station %s ELSE %%s END)" % (
+                " ".join(["WHEN %s THEN %s"] * len(gtxt)), )
+            for sid in gtxt:
+                params.extend([sid, gtxt[sid]])
+        else:
+            line += " || %s"
+        params.append(gismiss)
+    for i, (col, func) in enumerate(zip(querycols,
+                                        get_formatters(querycols))):
+        sql, args = sql_formatter(col, func, missing, trace)
+        if i > 0:
+            line += " || %s"
+            params.append(rD)
+        line += " || " + sql
+        params.extend(args)
+    return """
+        SELECT """ + line + """ from alldata
+        WHERE valid >= %s and valid < %s and station in %s """+rlimiter+"""
+        ORDER by valid ASC
+    """, params
+
+
+def copy_rows(pgconn, sql, params):
+    """Stream formatted lines straight from the database to the client."""
+    cursor = pgconn.cursor()
+    sql = cursor.mogrify(sql, params)
+    if not isinstance(sql, str):
+        sql = sql.decode('utf-8')
+    # csv format with delimiter and quote characters that never show up in
+    # our lines, so that each line comes through verbatim
+    cursor.copy_expert(
+        ("COPY (%s) TO STDOUT WITH (FORMAT csv, DELIMITER E'\\x01', "
+         "QUOTE E'\\x02')") % (sql, ),
+        getattr(sys.stdout, 'buffer', sys.stdout), size=COPY_CHUNK)
+    cursor.close()
+
+
+def do_columnar(form, pgconn, fmt, tzinfo):
+    """Stream typed parquet or arrow output direct from the cursor.
+
+    The formatting options (missing, trace, latlon) do not apply here, nulls
+    remain nulls and values are not rounded.
+    """
+    # pyarrow is slow to import, so only do so when needed
+    import columnar
+    stations = get_stations(form)
+    columnar.send_headers(
+        fmt, stations[0] if len(stations) == 1 else "asos")
+    if len(stations) == 1:
+        stations.append('XYZXYZ')
+    sts, ets = get_time_bounds(form, tzinfo)
+    report_type = [int(a) for a in form.getlist('report_type')]
+    rlimiter = ""
+    if report_type:
+        rlimiter = " and report_type in %s" % (tuple(report_type + [-1]), )
+    acursor = pgconn.cursor('mystream')
+    acursor.execute("""
+        SELECT station, valid, """ + ",".join(build_querycols(form)) + """
+        from alldata WHERE valid >= %s and valid < %s and station in %s
+        """ + rlimiter + """ ORDER by valid ASC
+    """, (sts, ets, tuple(stations)))
+    columnar.stream_cursor(acursor, fmt, tzname=tzinfo.zone)
+
+
 def main(form):
     """ Go main Go """
     check_load()
@@ -208,7 +330,10 @@ def main(form):
         sys.stderr.write("asos.py invalid tz: %s\n" % (exp, ))
         sys.exit()
     pgconn = get_dbconn('asos')
-    acursor = pgconn.cursor('mystream')
+    delim = form.getfirst("format", "onlycomma")
+    if delim in ['parquet', 'arrow']:
+        do_columnar(form, pgconn, delim, tzinfo)
+        return
 
     # Save direct to disk or view in browser
     direct = (form.getfirst('direct', 'no') == 'yes')
@@ -230,7 +355,6 @@ def main(form):
 
     sts, ets = get_time_bounds(form, tzinfo)
 
-    delim = form.getfirst("format", "onlycomma")
     # How should null values be represented
     missing = NULLS.get(form.getfirst('missing'), "M")
     # How should trace values be represented
@@ -252,12 +376,8 @@ def main(form):
     elif len(report_type) > 1:
         rlimiter = (" and report_type in %s"
                     ) % (tuple([int(a) for a in report_type]), )
-    sqlcols = ",".join(querycols)
-    acursor.execute("""
-        SELECT station, valid, """ + sqlcols + """ from alldata
-        WHERE valid >= %s and valid < %s and station in %s """+rlimiter+"""
-        ORDER by valid ASC
-    """, (sts, ets, tuple(dbstations)))
+    sql, params = build_copy_sql(querycols, tzinfo, rD, gisextra, gtxt,
+                                 missing, trace, rlimiter)
 
     if delim not in ['onlytdf', 'onlycomma']:
         ssw("#DEBUG: Format Typ    -> %s\n" % (delim,))
@@ -265,38 +385,15 @@ def main(form):
         ssw("#DEBUG: Time Zone     -> %s\n" % (tzinfo,))
         ssw(("#DEBUG: Data Contact   -> daryl herzmann "
              "akrherz@iastate.edu 515-294-5978\n"))
-        ssw("#DEBUG: Entries Found -> %s\n" % (acursor.rowcount,))
+        # The count is not known prior to streaming, this is what the
+        # previous server side cursor reported as well
+        ssw("#DEBUG: Entries Found -> %s\n" % (-1,))
     ssw("station"+rD+"valid"+rD)
     if gisextra:
         ssw("lon%slat%s" % (rD, rD))
     # hack to convert tmpf as tmpc to tmpc
     ssw("%s\n" % (rD.join([c.split(" as ")[-1] for c in querycols]), ))
-
-    ff = {
-        'wxcodes': fmt_wxcodes,
-        'metar': fmt_simple,
-        'skyc1': fmt_simple,
-        'skyc2': fmt_simple,
-        'skyc3': fmt_simple,
-        'skyc4': fmt_simple,
-        'p01i': fmt_trace,
-        'p01i * 25.4 as p01m': fmt_trace,
-        'ice_accretion_1hr': fmt_trace,
-        'ice_accretion_3hr': fmt_trace,
-        'ice_accretion_6hr': fmt_trace,
-    }
-    # The default is the %.2f formatter
-    formatters = [ff.get(col, fmt_f2) for col in querycols]
-
-    gismiss = "%s%s%s%s" % (missing, rD, missing, rD)
-    for row in acursor:
-        ssw(row[0] + rD)
-        ssw((row[1].astimezone(tzinfo)).strftime("%Y-%m-%d %H:%M") + rD)
-        if gisextra:
-            ssw(gtxt.get(row[0], gismiss))
-        ssw(rD.join(
-            [func(val, missing, trace)
-             for func, val in zip(formatters, row[2:])]) + "\n")
+    copy_rows(pgconn, sql, params + [sts, ets, tuple(dbstations)])
 
 
 if __name__ == '__main__':
@@ -317,3 +414,32 @@ def test_basic(capfd):
     out, err = capfd.readouterr()
     assert err == ''
     assert "tmpf" in out
+
+
+def test_copy_matches_fetch(capfd):
+    """Is the COPY output identical to the python formatted output?"""
+    tzinfo = pytz.timezone("America/Chicago")
+    sts = tzinfo.localize(datetime.datetime(2018, 1, 1))
+    ets = tzinfo.localize(datetime.datetime(2019, 1, 1))
+    stations = ('DSM', 'AMW')
+    querycols = AVAILABLE + list(CONV_COLS.values())
+    pgconn = get_dbconn('asos')
+    for rD in [',', '\t']:
+        for trace in TRACE_OPTS.values():
+            for missing in NULLS.values():
+                gtxt = {'DSM': "-93.6500%s41.5300%s" % (rD, rD)}
+                sql, params = build_copy_sql(
+                    querycols, tzinfo, rD, True, gtxt, missing, trace, '')
+                copy_rows(pgconn, sql, params + [sts, ets, stations])
+                out1, _ = capfd.readouterr()
+                acursor = pgconn.cursor('teststream')
+                acursor.execute("""
+                    SELECT station, valid, """ + ",".join(querycols) + """
+                    from alldata WHERE valid >= %s and valid < %s and
+                    station in %s ORDER by valid ASC
+                """, (sts, ets, stations))
+                fetch_rows(acursor, querycols, tzinfo, rD, True, gtxt,
+                           missing, trace)
+                acursor.close()
+                out2, _ = capfd.readouterr()
+                assert out1 == out2
@@ -0,0 +1,175 @@
+"""Columnar (Parquet and Arrow IPC stream) output for our download services.
+
+Rows are pulled from a database cursor or DataFrame in chunks, each chunk
+becomes one parquet row group or arrow record batch, and the bytes are written
+to stdout as they are produced.
+"""
+import sys
+from decimal import Decimal
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+from pyiem.util import ssw
+
+# format -> (content type, file extension)
+FORMATS = {
+    'parquet': ('application/octet-stream', 'parquet'),
+    'arrow': ('application/vnd.apache.arrow.stream', 'arrow'),
+}
+# rows per parquet row group / arrow record batch
+CHUNKSIZE = 50000
+COMPRESSION = 'snappy'
+# postgresql type oid -> arrow type
+OID2ARROW = {
+    16: pa.bool_(),
+    20: pa.int64(),
+    21: pa.int16(),
+    23: pa.int32(),
+    700: pa.float32(),
+    701: pa.float64(),
+    1700: pa.float64(),
+    1082: pa.date32(),
+    1114: pa.timestamp('us'),
+    1184: pa.timestamp('us', tz='UTC'),
+    1015: pa.list_(pa.string()),
+    1009: pa.list_(pa.string()),
+}
+
+
+class StdoutSink(object):
+    """Write only, position tracking wrapper around stdout."""
+
+    def __init__(self):
+        """Constructor"""
+        self.fh = getattr(sys.stdout, 'buffer', sys.stdout)
+        self.pos = 0
+        self.closed = False
+
+    def write(self, data):
+        """Write bytes"""
+        data = bytes(data)
+        self.fh.write(data)
+        self.pos += len(data)
+        return len(data)
+
+    def tell(self):
+        """Where we are at"""
+        return self.pos
+
+    def flush(self):
+        """Flush"""
+        self.fh.flush()
+
+    def close(self):
+        """We don't close stdout, just mark as such"""
+        self.flush()
+        self.closed = True
+
+
+def send_headers(fmt, basename):
+    """Write the CGI headers for this format."""
+    ctype, ext = FORMATS[fmt]
+    ssw("Content-type: %s\n" % (ctype, ))
+    ssw("Content-Disposition: attachment; filename=%s.%s\n\n" % (
+        basename, ext))
+
+
+def build_schema(description, tzname=None):
+    """Convert a psycopg2 cursor.description into an arrow schema.
+
+    Args:
+      description (list): cursor.description
+      tzname (str, optional): timezone to label timestamptz columns with
+
+    Returns:
+      pyarrow.Schema
+    """
+    fields = []
+    for col in description:
+        dtype = OID2ARROW.get(col[1], pa.string())
+        if tzname is not None and col[1] == 1184:
+            dtype = pa.timestamp('us', tz=tzname)
+        fields.append(pa.field(col[0], dtype))
+    return pa.schema(fields)
+
+
+def _rows2batch(rows, schema):
+    """Convert a list of row tuples to a RecordBatch."""
+    arrays = []
+    for i, field in enumerate(schema):
+        vals = [row[i] for row in rows]
+        if pa.types.is_floating(field.type):
+            # numeric columns come back as Decimal
+            vals = [float(v) if isinstance(v, Decimal) else v for v in vals]
+        elif pa.types.is_string(field.type):
+            vals = [v if v is None else str(v) for v in vals]
+        arrays.append(pa.array(vals, type=field.type))
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+def get_writer(fmt, sink, schema):
+    """Return a writer with a write_batch-ish interface."""
+    if fmt == 'parquet':
+        return pq.ParquetWriter(sink, schema, compression=COMPRESSION)
+    return pa.ipc.new_stream(sink, schema)
+
+
+def _write(writer, fmt, batch):
+    """Write one chunk as a row group or record batch."""
+    if fmt == 'parquet':
+        writer.write_table(pa.Table.from_batches([batch]))
+    else:
+        writer.write_batch(batch)
+
+
+def stream_cursor(cursor, fmt, tzname=None, chunksize=CHUNKSIZE):
+    """Stream the results of an executed cursor to stdout.
+
+    Args:
+      cursor: psycopg2 cursor (ideally server side) with a query executed
+      fmt (str): parquet or arrow
+      tzname (str, optional): timezone label for timestamptz columns
+      chunksize (int): rows per row group / record batch
+
+    Returns:
+      int number of rows written
+    """
+    sink = StdoutSink()
+    # the description is not populated for server side cursors until a fetch
+    rows = cursor.fetchmany(chunksize)
+    schema = build_schema(cursor.description, tzname)
+    writer = get_writer(fmt, sink, schema)
+    total = 0
+    while rows:
+        _write(writer, fmt, _rows2batch(rows, schema))
+        total += len(rows)
+        rows = cursor.fetchmany(chunksize)
+    writer.close()
+    sink.flush()
+    return total
+
+
+def stream_dataframe(df, fmt, chunksize=CHUNKSIZE):
+    """Stream a DataFrame to stdout.
+
+    Args:
+      df (pandas.DataFrame): data, the index is not written
+      fmt (str): parquet or arrow
+      chunksize (int): rows per row group / record batch
+    """
+    df = df.reset_index(drop=True)
+    for col in df.columns:
+        if df[col].dtype != object:
+            continue
+        sample = df[col].dropna()
+        if not sample.empty and isinstance(sample.iloc[0], Decimal):
+            df[col] = df[col].astype(float)
+    sink = StdoutSink()
+    schema = pa.Schema.from_pandas(df, preserve_index=False)
+    writer = get_writer(fmt, sink, schema)
+    for i in range(0, len(df.index), chunksize):
+        batch = pa.RecordBatch.from_pandas(
+            df.iloc[i:i + chunksize], schema=schema, preserve_index=False)
+        _write(writer, fmt, batch)
+    writer.close()
+    sink.flush()
@@ -19,6 +19,8 @@ from pyiem.network import Table as NetworkTable
 from pyiem.datatypes import temperature, distance
 from pyiem.util import get_dbconn, ssw
 
+import admission
+
 
 def get_scenario_period(ctx):
     """ Compute the inclusive start and end dates to fetch scenario data for
@@ -453,7 +455,7 @@ def do_simple(ctx):
 
     cols = cols + ctx['myvars']
 
-    if ctx['what'] == 'excel':
+    if ctx['what'] in ['excel', 'parquet', 'arrow']:
         # Do the excel logic
         df = pd.read_sql(sql, dbconn, params=args)
         # Convert day into a python date type
@@ -466,6 +468,12 @@ def do_simple(ctx):
         if 'lat' in cols:
             df['lat'] = [_gs(x, 'lat') for x in df['station']]
             df['lon'] = [_gs(x, 'lon') for x in df['station']]
+        if ctx['what'] != 'excel':
+            # pyarrow is slow to import, so only do so when needed
+            import columnar
+            columnar.send_headers(ctx['what'], "nwscoop")
+            columnar.stream_dataframe(df[cols], ctx['what'])
+            return
         ssw("Content-type: application/vnd.ms-excel\n")
         ssw("Content-Disposition: attachment;Filename=nwscoop.xls\n\n")
         df.to_excel('/tmp/ss.xls', columns=cols, index=False)
@@ -694,6 +702,7 @@ def do_swat(ctx):
 
 def main():
     """ go main go """
+    admission.check_load('coop', 20)
     form = cgi.FieldStorage()
     ctx = {}
     ctx['stations'] = get_cgi_stations(form)
@@ -716,7 +725,8 @@ def main():
     # TODO: this code stinks and is likely buggy
     if "apsim" in ctx['myvars']:
         ssw("Content-type: text/plain\n\n")
-    elif "dndc" not in ctx['myvars'] and ctx['what'] != 'excel':
+    elif ("dndc" not in ctx['myvars'] and
+          ctx['what'] not in ['excel', 'parquet', 'arrow']):
         if ctx['what'] == 'download':
             ssw("Content-type: application/octet-stream\n")
             dlfn = "changeme.txt"
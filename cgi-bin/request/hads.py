@@ -11,6 +11,8 @@ import pandas as pd
 from pandas.io.sql import read_sql
 from pyiem.util import get_dbconn, utc, ssw
 
+import admission
+
 PGCONN = get_dbconn('hads')
 DELIMITERS = {'comma': ',', 'space': ' ', 'tab': '\t'}
 
@@ -80,6 +82,7 @@ def error(msg):
 
 def main():
     """ Go do something """
+    admission.check_load('hads', 10)
     form = cgi.FieldStorage()
     # network = form.getfirst('network')
     delimiter = DELIMITERS.get(form.getfirst('delim', 'comma'))
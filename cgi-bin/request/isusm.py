@@ -11,6 +11,8 @@ import psycopg2.extras
 from pyiem.datatypes import temperature, distance
 from pyiem.util import get_dbconn, ssw
 
+import admission
+
 
 def get_stations(form):
     ''' Figure out which stations were requested '''
@@ -327,6 +329,7 @@ def fetch_hourly(form, cols):
 
 def main():
     """Do things"""
+    admission.check_load('isuag', 10)
     form = cgi.FieldStorage()
     mode = form.getfirst('mode', 'hourly')
     cols = form.getlist('vars')
@@ -353,6 +356,13 @@ def main():
         os.unlink('/tmp/ss.xlsx')
         return
 
+    if fmt in ['parquet', 'arrow']:
+        # pyarrow is slow to import, so only do so when needed
+        import columnar
+        columnar.send_headers(fmt, "isusm")
+        columnar.stream_dataframe(df[cols], fmt)
+        return
+
     delim = "," if fmt == 'comma' else '\t'
     buf = StringIO()
     df.to_csv(buf, index=False, columns=cols, sep=delim)
@@ -5,32 +5,19 @@
 """
 
 import cgi
-import sys
 import datetime
 
 import pytz
 from pyiem.util import get_dbconn, ssw
 
-
-def check_load(cursor):
-    """A crude check that aborts this script if there is too much
-    demand at the moment"""
-    cursor.execute("""
-    select pid from pg_stat_activity where query ~* 'FETCH'
-    and datname = 'asos'""")
-    if cursor.rowcount > 9:
-        sys.stderr.write(("/cgi-bin/request/metars.py over capacity: %s"
-                          ) % (cursor.rowcount,))
-        ssw("Content-type: text/plain\n")
-        ssw('Status: 503 Service Unavailable\n\n')
-        ssw("ERROR: server over capacity, please try later")
-        sys.exit(0)
+import admission
 
 
 def main():
     """Do Something"""
+    # shares the asos pool, but is allowed less of it
+    admission.check_load('asos', 10)
     pgconn = get_dbconn('asos', user='nobody')
-    check_load(pgconn.cursor())
     acursor = pgconn.cursor("streamer")
     ssw("Content-type: text/plain\n\n")
     form = cgi.FieldStorage()
@@ -5,7 +5,7 @@ CREATE EXTENSION postgis;
 CREATE TABLE iem_schema_manager_version(
 	version int,
 	updated timestamptz);
-INSERT into iem_schema_manager_version values (18, now());
+INSERT into iem_schema_manager_version values (19, now());
 
 --- ==== TABLES TO investigate deleting
 --- counties
@@ -419,7 +419,17 @@ CREATE TABLE autoplot_timing(
 	valid timestamptz NOT NULL,
 	timing real NOT NULL,
 	uri varchar,
-	hostname varchar(24) NOT NULL);
+	hostname varchar(24) NOT NULL,
+	-- how the request was answered: miss, bypass, local, memcache, wait
+	cache varchar(8),
+	-- seconds spent within each phase of the request
+	import_secs real,
+	context_secs real,
+	sql_secs real,
+	queries smallint,
+	app_secs real,
+	render_secs real,
+	cache_secs real);
 GRANT SELECT on autoplot_timing to nobody,apache;
 CREATE INDEX autoplot_timing_idx on autoplot_timing(appid);
 
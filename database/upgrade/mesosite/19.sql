@@ -0,0 +1,9 @@
+-- Per phase timing of autoplot requests, from the autoplot.wsgi spans
+ALTER TABLE autoplot_timing ADD cache varchar(8);
+ALTER TABLE autoplot_timing ADD import_secs real;
+ALTER TABLE autoplot_timing ADD context_secs real;
+ALTER TABLE autoplot_timing ADD sql_secs real;
+ALTER TABLE autoplot_timing ADD queries smallint;
+ALTER TABLE autoplot_timing ADD app_secs real;
+ALTER TABLE autoplot_timing ADD render_secs real;
+ALTER TABLE autoplot_timing ADD cache_secs real;
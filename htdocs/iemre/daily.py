@@ -10,6 +10,8 @@ import numpy as np
 from pyiem import iemre, datatypes
 from pyiem.util import ncopen, ssw
 import pyiem.prism as prismutil
+sys.path.insert(0, '/opt/iem/include/python/')
+from pointseries import open_series  # noqa: E402
 
 
 def myrounder(val, precision):
@@ -48,7 +50,8 @@ def main():
         return
 
     if ts.year > 1980:
-        nc = ncopen("/mesonet/data/prism/%s_daily.nc" % (ts.year, ))
+        nc = open_series("/mesonet/data/prism/%s_daily.nc" % (ts.year, ),
+                         slice(offset, offset + 1))
         i2, j2 = prismutil.find_ij(lon, lat)
         prism_precip = nc.variables['ppt'][offset, j2, i2] / 25.4
         nc.close()
@@ -56,7 +59,8 @@ def main():
         prism_precip = None
 
     if ts.year > 2010:
-        nc = ncopen(iemre.get_daily_mrms_ncname(ts.year))
+        nc = open_series(iemre.get_daily_mrms_ncname(ts.year),
+                         slice(offset, offset + 1))
         j2 = int((lat - iemre.SOUTH) * 100.0)
         i2 = int((lon - iemre.WEST) * 100.0)
         mrms_precip = nc.variables['p01d'][offset, j2, i2] / 25.4
@@ -64,7 +68,7 @@ def main():
     else:
         mrms_precip = None
 
-    nc = ncopen(fn)
+    nc = open_series(fn, slice(offset, offset + 1))
 
     c2000 = ts.replace(year=2000)
     coffset = iemre.daily_offset(c2000)
@@ -1,5 +1,5 @@
 #!/usr/bin/env python
-"""Provide multiday values for IEMRE and friends"""
+"""Provide multiday values for IEMRE and friends, the range may span years"""
 import sys
 import cgi
 import datetime
@@ -11,6 +11,8 @@ import numpy as np
 from pyiem import iemre, datatypes
 from pyiem.util import ncopen, ssw
 import pyiem.prism as prismutil
+sys.path.insert(0, '/opt/iem/include/python/')
+from pointseries import read_daily  # noqa: E402
 
 warnings.simplefilter("ignore", UserWarning)
 encoder.FLOAT_REPR = lambda o: format(o, '.2f')
@@ -38,8 +40,6 @@ def main():
     ts2 = datetime.datetime.strptime(form.getfirst("date2"), "%Y-%m-%d")
     if ts1 > ts2:
         send_error("date1 larger than date2")
-    if ts1.year != ts2.year:
-        send_error("multi-year query not supported yet...")
     # Make sure we aren't in the future
     tsend = datetime.date.today()
     if ts2.date() > tsend:
@@ -55,65 +55,50 @@ def main():
                                                               iemre.NORTH))
     # fmt = form["format"][0]
 
+    sts = ts1.date()
+    ets = ts2.date()
     i, j = iemre.find_ij(lon, lat)
-    offset1 = iemre.daily_offset(ts1)
-    offset2 = iemre.daily_offset(ts2) + 1
 
-    # Get our netCDF vars
-    nc = ncopen(iemre.get_daily_ncname(ts1.year))
-    hightemp = datatypes.temperature(nc.variables['high_tmpk'][offset1:offset2,
-                                                               j, i],
+    # Get our netCDF vars, one read per variable per yearly file
+    data = read_daily(iemre.get_daily_ncname,
+                      ['high_tmpk', 'high_tmpk_12z', 'low_tmpk',
+                       'low_tmpk_12z', 'p01d', 'p01d_12z'], sts, ets, i, j)
+    hightemp = datatypes.temperature(data['high_tmpk'][:, 0],
                                      'K').value("F")
-    high12temp = datatypes.temperature(
-        nc.variables['high_tmpk_12z'][offset1:offset2, j, i],
-        'K'
-    ).value("F")
-    lowtemp = datatypes.temperature(nc.variables['low_tmpk'][offset1:offset2,
-                                                             j, i],
-                                    'K').value("F")
-    low12temp = datatypes.temperature(
-        nc.variables['low_tmpk_12z'][offset1:offset2, j, i],
-        'K'
-    ).value("F")
-    precip = nc.variables['p01d'][offset1:offset2, j, i] / 25.4
-    precip12 = nc.variables['p01d_12z'][offset1:offset2, j, i] / 25.4
-    nc.close()
+    high12temp = datatypes.temperature(data['high_tmpk_12z'][:, 0],
+                                       'K').value("F")
+    lowtemp = datatypes.temperature(data['low_tmpk'][:, 0], 'K').value("F")
+    low12temp = datatypes.temperature(data['low_tmpk_12z'][:, 0],
+                                      'K').value("F")
+    precip = data['p01d'][:, 0] / 25.4
+    precip12 = data['p01d_12z'][:, 0] / 25.4
 
     # Get our climatology vars
-    c2000 = ts1.replace(year=2000)
-    coffset1 = iemre.daily_offset(c2000)
-    c2000 = ts2.replace(year=2000)
-    coffset2 = iemre.daily_offset(c2000) + 1
+    days = (ets - sts).days + 1
+    coffsets = [iemre.daily_offset((sts + datetime.timedelta(days=d)
+                                    ).replace(year=2000))
+                for d in range(days)]
     cnc = ncopen(iemre.get_dailyc_ncname())
-    chigh = datatypes.temperature(cnc.variables['high_tmpk'][coffset1:coffset2,
-                                                             j, i],
-                                  'K').value("F")
-    clow = datatypes.temperature(cnc.variables['low_tmpk'][coffset1:coffset2,
-                                                           j, i],
-                                 'K').value("F")
-    cprecip = cnc.variables['p01d'][coffset1:coffset2, j, i] / 25.4
+    chigh = datatypes.temperature(cnc.variables['high_tmpk'][:, j, i],
+                                  'K').value("F")[coffsets]
+    clow = datatypes.temperature(cnc.variables['low_tmpk'][:, j, i],
+                                 'K').value("F")[coffsets]
+    cprecip = (cnc.variables['p01d'][:, j, i] / 25.4)[coffsets]
     cnc.close()
 
-    if ts1.year > 1980:
-        nc = ncopen("/mesonet/data/prism/%s_daily.nc" % (ts1.year, ))
-        i2, j2 = prismutil.find_ij(lon, lat)
-        prism_precip = nc.variables['ppt'][offset1:offset2, j2, i2] / 25.4
-        nc.close()
-    else:
-        prism_precip = [None]*(offset2-offset1)
-
-    if ts1.year > 2010:
-        nc = ncopen(iemre.get_daily_mrms_ncname(ts1.year))
-        j2 = int((lat - iemre.SOUTH) * 100.0)
-        i2 = int((lon - iemre.WEST) * 100.0)
-        mrms_precip = nc.variables['p01d'][offset1:offset2, j2, i2] / 25.4
-        nc.close()
-    else:
-        mrms_precip = [None]*(offset2-offset1)
+    i2, j2 = prismutil.find_ij(lon, lat)
+    prism_precip = read_daily(
+        lambda year: "/mesonet/data/prism/%s_daily.nc" % (year, ), ['ppt'],
+        sts, ets, i2, j2, minyear=1981)['ppt'][:, 0] / 25.4
+
+    j2 = int((lat - iemre.SOUTH) * 100.0)
+    i2 = int((lon - iemre.WEST) * 100.0)
+    mrms_precip = read_daily(iemre.get_daily_mrms_ncname, ['p01d'], sts,
+                             ets, i2, j2, minyear=2011)['p01d'][:, 0] / 25.4
 
     res = {'data': [], }
 
-    for i in range(0, offset2 - offset1):
+    for i in range(0, days):
         now = ts1 + datetime.timedelta(days=i)
         res['data'].append({'date': now.strftime("%Y-%m-%d"),
                             'mrms_precip_in': clean(mrms_precip[i]),
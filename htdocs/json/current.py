@@ -1,5 +1,16 @@
 #!/usr/bin/env python
-"""Current Observation for a station and network"""
+"""Current Observation for a station and network
+
+    /json/current.py?network=IA_ASOS&station=AMW
+
+The `stations` parameter (comma delimited, all of the network's stations
+when omitted with `fmt`) returns many stations at once, with `fmt` of json
+(default) or geojson.  All requests are served from one snapshot of the
+network's current obs, computed with one query and cached for everybody.
+The snapshot is split into memcache items of about SNAPSHOT_CHUNK bytes, as
+a large network (ie COOP) exceeds the 1MB limit of an item, so a single
+station request only fetches the item holding its station.
+"""
 import cgi
 import json
 import datetime
@@ -8,30 +19,15 @@ import memcache
 import psycopg2.extras
 from pyiem.util import get_dbconn, ssw
 
+# seconds a network snapshot is cached for
+SNAPSHOT_TTL = 60
+# bytes of serialized obs per memcache item, well within its 1MB limit
+SNAPSHOT_CHUNK = 400000
 
-def run(network, station):
-    """Get last ob!"""
-    pgconn = get_dbconn('iem')
-    cursor = pgconn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-    cursor.execute("""
-    WITH mystation as (SELECT * from stations where id = %s and network = %s),
-    lastob as (select *, m.iemid as miemid,
-        valid at time zone 'UTC' as utctime,
-        valid at time zone m.tzname as localtime
-        from current c JOIN mystation m on (c.iemid = m.iemid)),
-    summ as (SELECT * from summary s JOIN lastob o on (s.iemid = o.miemid and
-    s.day = date(o.localtime)))
-    select * from summ
-    """, (station, network))
-    if cursor.rowcount == 0:
-        return "{}"
-    row = cursor.fetchone()
-    data = dict()
-    data['server_gentime'] = datetime.datetime.utcnow(
-        ).strftime("%Y-%m-%dT%H:%M:%SZ")
-    data['id'] = station
-    data['network'] = network
-    ob = data.setdefault('last_ob', dict())
+
+def make_ob(row):
+    """Convert a database row into our last_ob dict"""
+    ob = dict()
     ob['local_valid'] = row['localtime'].strftime("%Y-%m-%d %H:%M")
     ob['utc_valid'] = row['utctime'].strftime("%Y-%m-%dT%H:%M:00Z")
     ob['airtemp[F]'] = row['tmpf']
@@ -50,7 +46,134 @@ def run(network, station):
     ob['raw'] = row['raw']
     ob['presentwx'] = ([] if row['wxcodes'] is None
                        else row['wxcodes'])
-    return json.dumps(data)
+    return ob
+
+
+def run(network):
+    """Get the last ob for each station in a network
+
+    Returns:
+      dict of the generation time and station id -> (json, geojson feature)
+      serialized fragments
+    """
+    pgconn = get_dbconn('iem')
+    cursor = pgconn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+    cursor.execute("""
+    SELECT t.id, t.name, ST_x(t.geom) as lon, ST_y(t.geom) as lat,
+    c.valid at time zone 'UTC' as utctime,
+    c.valid at time zone t.tzname as localtime,
+    c.tmpf, c.dwpf, c.sknt, c.drct, c.alti, c.mslp, c.vsby, c.raw, c.wxcodes,
+    c.skyc1, c.skyc2, c.skyc3, c.skyc4, c.skyl1, c.skyl2, c.skyl3, c.skyl4,
+    s.max_tmpf, s.min_tmpf
+    from current c JOIN stations t on (c.iemid = t.iemid)
+    JOIN summary s on (s.iemid = c.iemid and
+        s.day = date(c.valid at time zone t.tzname))
+    WHERE t.network = %s ORDER by t.id ASC
+    """, (network, ))
+    res = {'gentime': datetime.datetime.utcnow(
+        ).strftime("%Y-%m-%dT%H:%M:%SZ"), 'stations': dict()}
+    for row in cursor:
+        ob = make_ob(row)
+        props = dict(ob)
+        props['id'] = row['id']
+        props['name'] = row['name']
+        props['network'] = network
+        res['stations'][row['id']] = (
+            json.dumps({'id': row['id'], 'network': network,
+                        'last_ob': ob}),
+            json.dumps({'type': 'Feature', 'id': row['id'],
+                        'properties': props,
+                        'geometry': {'type': 'Point',
+                                     'coordinates': [row['lon'],
+                                                     row['lat']]}}))
+    return res
+
+
+def split_snapshot(snapshot, chunksize=SNAPSHOT_CHUNK):
+    """Split a snapshot into pieces for memcache
+
+    Returns:
+      (index dict with the generation time and station id -> piece, list of
+      station id -> fragments dicts)
+    """
+    index = {'gentime': snapshot['gentime'], 'where': dict()}
+    pieces = [dict()]
+    size = 0
+    for sid in sorted(snapshot['stations']):
+        frags = snapshot['stations'][sid]
+        fragsize = len(sid) + sum([len(frag) for frag in frags])
+        if pieces[-1] and size + fragsize > chunksize:
+            pieces.append(dict())
+            size = 0
+        pieces[-1][sid] = frags
+        size += fragsize
+        index['where'][sid] = len(pieces) - 1
+    return index, pieces
+
+
+def get_snapshot(network, stations=None):
+    """Get the network snapshot, from memcache if possible
+
+    Args:
+      network (str): the network
+      stations (list, optional): the station ids needed, default all
+
+    Returns:
+      snapshot dict, with at least the stations needed
+    """
+    mckey = "/json/current/snapshot/%s" % (network, )
+    mc = memcache.Client(['iem-memcached:11211'], debug=0)
+    index = mc.get(mckey)
+    if index:
+        wanted = set(index['where'].values())
+        if stations is not None:
+            wanted = set([index['where'][sid] for sid in stations
+                          if sid in index['where']])
+        keys = ["%s/%s" % (mckey, i) for i in wanted]
+        pieces = mc.get_multi(keys) if keys else {}
+        # a piece may have been evicted
+        if len(pieces) == len(keys):
+            res = {'gentime': index['gentime'], 'stations': dict()}
+            for piece in pieces.values():
+                res['stations'].update(piece)
+            return res
+    res = run(network)
+    (index, pieces) = split_snapshot(res)
+    failed = mc.set_multi(dict(("%s/%s" % (mckey, i), piece)
+                               for i, piece in enumerate(pieces)),
+                          SNAPSHOT_TTL)
+    # the index is only useful when all of the pieces were stored
+    if not failed:
+        mc.set(mckey, index, SNAPSHOT_TTL)
+    return res
+
+
+def slice_snapshot(snapshot, network, stations, fmt):
+    """Generate the response for some stations from the snapshot
+
+    Args:
+      stations (list): station ids or None for all of them
+      fmt (str): json or geojson
+    """
+    if stations is None:
+        stations = sorted(snapshot['stations'].keys())
+    idx = 1 if fmt == 'geojson' else 0
+    frags = ",".join([snapshot['stations'][sid][idx] for sid in stations
+                      if sid in snapshot['stations']])
+    if fmt == 'geojson':
+        return ('{"type": "FeatureCollection", "generation_time": "%s", '
+                '"features": [%s]}') % (snapshot['gentime'], frags)
+    return ('{"server_gentime": "%s", "network": %s, "stations": [%s]}'
+            ) % (snapshot['gentime'], json.dumps(network), frags)
+
+
+def slice_station(snapshot, station):
+    """Generate the response for a single station, as it always has been"""
+    if station not in snapshot['stations']:
+        return "{}"
+    # splice the generation time into the station's serialized object
+    return '{"server_gentime": "%s", %s' % (
+        snapshot['gentime'], snapshot['stations'][station][0][1:])
 
 
 def main():
@@ -60,14 +183,18 @@ def main():
     form = cgi.FieldStorage()
     network = form.getfirst('network', 'IA_ASOS')[:10].upper()
     station = form.getfirst('station', 'AMW')[:10].upper()
+    stations = form.getfirst('stations')
+    fmt = form.getfirst('fmt')
     cb = form.getfirst('callback', None)
 
-    mckey = "/json/current/%s/%s" % (network, station)
-    mc = memcache.Client(['iem-memcached:11211'], debug=0)
-    res = mc.get(mckey)
-    if not res:
-        res = run(network, station)
-        mc.set(mckey, res, 60)
+    if stations is None and fmt is None:
+        res = slice_station(get_snapshot(network, [station]), station)
+    else:
+        if stations is not None:
+            stations = [s.strip()[:10].upper() for s in stations.split(",")]
+        snapshot = get_snapshot(network, stations)
+        res = slice_snapshot(snapshot, network, stations,
+                             'geojson' if fmt == 'geojson' else 'json')
 
     if cb is None:
         ssw(res)
@@ -75,5 +202,26 @@ def main():
         ssw("%s(%s)" % (cb, res))
 
 
+def test_slice():
+    """Do we splice together the fragments properly?"""
+    snapshot = {'gentime': '2018-01-01T00:00:00Z',
+                'stations': {'AMW': ('{"id": "AMW"}', '{"id": "AMW"}'),
+                             'DSM': ('{"id": "DSM"}', '{"id": "DSM"}')}}
+    res = json.loads(slice_snapshot(snapshot, 'IA_ASOS', ['DSM', 'XXX'],
+                                    'json'))
+    assert [s['id'] for s in res['stations']] == ['DSM']
+    res = json.loads(slice_snapshot(snapshot, 'IA_ASOS', None, 'geojson'))
+    assert len(res['features']) == 2
+    res = json.loads(slice_station(snapshot, 'AMW'))
+    assert res['server_gentime'] == '2018-01-01T00:00:00Z'
+    assert res['id'] == 'AMW'
+    assert slice_station(snapshot, 'XXX') == "{}"
+    (index, pieces) = split_snapshot(snapshot, 20)
+    assert len(pieces) == 2
+    assert list(pieces[index['where']['DSM']]) == ['DSM']
+    (index, pieces) = split_snapshot(snapshot)
+    assert len(pieces) == 1
+
+
 if __name__ == '__main__':
     main()
@@ -1,6 +1,7 @@
 #!/usr/bin/env python
 """ JSON service providing PRISM data for a given point """
 import os
+import sys
 import datetime
 import json
 import cgi
@@ -8,7 +9,9 @@ import cgi
 import numpy as np
 import memcache
 from pyiem import prism, datatypes
-from pyiem.util import ncopen, ssw
+from pyiem.util import ssw
+sys.path.insert(0, '/opt/iem/include/python/')
+from pointseries import open_series  # noqa: E402
 
 
 def myrounder(val, precision):
@@ -67,7 +70,7 @@ def dowork(form):
         ncfn = "/mesonet/data/prism/%s_daily.nc" % (sts.year, )
         if not os.path.isfile(ncfn):
             continue
-        nc = ncopen(ncfn)
+        nc = open_series(ncfn, slice(sidx, eidx))
 
         tmax = nc.variables['tmax'][sidx:eidx, j, i]
         tmin = nc.variables['tmin'][sidx:eidx, j, i]
@@ -1,33 +1,28 @@
 #!/usr/bin/env python
 """
 Get storm based warnings by lat lon point
+
+The lookup is done against cached polygons, see `pointindex.find_sbws()`
 """
 import cgi
 import json
+import sys
 
 from pyiem.util import get_dbconn, ssw
+sys.path.insert(0, '/opt/iem/include/python/')
+from pointindex import find_sbws  # noqa: E402
 
 
 def get_events(lon, lat):
     """ Get Events """
     pgconn = get_dbconn('postgis')
     cursor = pgconn.cursor()
-    cursor.execute("""SET TIME ZONE 'UTC'""")
-    cursor.execute("""
-  select wfo, significance, phenomena, issue, expire, eventid from sbw
-  where status = 'NEW' and
-  ST_Contains(geom, ST_SetSRID(ST_GeomFromEWKT('POINT(%s %s)'),4326))
-  and phenomena in ('SV', 'TO', 'FF', 'FL', 'MA', 'FA') and
-  issue > '2005-10-01'
-  ORDER by issue ASC
-    """, (lon, lat))
     data = {'sbws': []}
-    for row in cursor:
+    for row in find_sbws(cursor, lon, lat):
         data['sbws'].append({
-                             'phenomena': row[2], 'eventid': row[5],
-                             'significance': row[1], 'wfo': row[0],
-                             'issue': row[3].strftime("%Y-%m-%dT%H:%MZ"),
-                             'expire': row[4].strftime("%Y-%m-%dT%H:%MZ")
+                             'phenomena': row[3], 'eventid': row[2],
+                             'significance': row[4], 'wfo': row[5],
+                             'issue': row[0], 'expire': row[1]
                              })
     return data
 
@@ -1,15 +1,28 @@
 #!/usr/bin/env python
-""" JSON service providing hourly Stage IV data for a given point """
+""" JSON service providing hourly Stage IV data for a given point
+
+The lat and lon parameters may be comma delimited lists of points, and the
+optional valid2 parameter is an inclusive end date for multi-day requests.
+"""
 
 import datetime
 import json
 import cgi
 import os
+import hashlib
+import sys
 
 import numpy as np
 import memcache
 from pyiem import iemre, datatypes
-from pyiem.util import utc, ncopen, ssw
+from pyiem.util import utc, ssw
+sys.path.insert(0, '/opt/iem/include/python/')
+from gridlocator import get_locator, sample  # noqa: E402
+from pointseries import open_series  # noqa: E402
+
+# Limits on the request size
+MAXPOINTS = 20
+MAXDAYS = 366
 
 
 def myrounder(val, precision):
@@ -19,43 +32,63 @@ def myrounder(val, precision):
     return round(val, precision)
 
 
+def get_points(form):
+    """Parse the comma delimited lon and lat values"""
+    lons = [float(x) for x in form.getfirst("lon").split(",")]
+    lats = [float(x) for x in form.getfirst("lat").split(",")]
+    if len(lons) != len(lats):
+        raise ValueError("lon and lat lists must have the same length")
+    if len(lons) > MAXPOINTS:
+        raise ValueError("At most %s points are allowed" % (MAXPOINTS, ))
+    return lons, lats
+
+
 def dowork(form):
     """Do work!"""
     date = datetime.datetime.strptime(form.getfirst('valid'), '%Y-%m-%d')
-    lat = float(form.getfirst("lat"))
-    lon = float(form.getfirst("lon"))
+    date2 = datetime.datetime.strptime(
+        form.getfirst('valid2', form.getfirst('valid')), '%Y-%m-%d')
+    date2 = min(date2, date + datetime.timedelta(days=MAXDAYS - 1))
+    lons, lats = get_points(form)
 
     # We want data for the UTC date and timestamps are in the rears, so from
     # 1z through 1z
     sts = utc(date.year, date.month, date.day, 1)
-    ets = sts + datetime.timedelta(hours=24)
-    sidx = iemre.hourly_offset(sts)
-    eidx = iemre.hourly_offset(ets)
-
-    ncfn = "/mesonet/data/stage4/%s_stage4_hourly.nc" % (date.year, )
-    res = {'gridi': -1, 'gridj': -1, 'data': []}
-    if not os.path.isfile(ncfn):
-        return json.dumps(res)
-    nc = ncopen(ncfn)
-
-    dist = ((nc.variables['lon'][:] - lon)**2 +
-            (nc.variables['lat'][:] - lat)**2)**0.5
-    (j, i) = np.unravel_index(dist.argmin(), dist.shape)
-    res['gridi'] = int(i)
-    res['gridj'] = int(j)
-
-    ppt = nc.variables['p01m'][sidx:eidx, j, i]
-    nc.close()
-
-    for tx, pt in enumerate(ppt):
-        valid = sts + datetime.timedelta(hours=tx)
-        res['data'].append({
-            'end_valid': valid.strftime("%Y-%m-%dT%H:00:00Z"),
-            'precip_in': myrounder(
+    ets = utc(date2.year, date2.month, date2.day, 1) + datetime.timedelta(
+        hours=24)
+
+    points = [{'gridi': -1, 'gridj': -1, 'data': []} for _ in lons]
+    for year in range(sts.year, ets.year + 1):
+        ncfn = "/mesonet/data/stage4/%s_stage4_hourly.nc" % (year, )
+        if not os.path.isfile(ncfn):
+            continue
+        ysts = max(sts, utc(year, 1, 1))
+        yets = min(ets, utc(year + 1, 1, 1))
+        if ysts >= yets:
+            continue
+        sidx = iemre.hourly_offset(ysts)
+        eidx = sidx + int((yets - ysts).total_seconds() / 3600)
+        nc = open_series(ncfn, slice(sidx, eidx))
+        (i, j) = get_locator(nc).find(lons, lats)
+        ppt = sample(nc, 'p01m', slice(sidx, eidx), i, j)
+        nc.close()
+        for idx, res in enumerate(points):
+            res['gridi'] = int(i[idx])
+            res['gridj'] = int(j[idx])
+            for tx, pt in enumerate(ppt[:, idx]):
+                valid = ysts + datetime.timedelta(hours=tx)
+                res['data'].append({
+                    'end_valid': valid.strftime("%Y-%m-%dT%H:00:00Z"),
+                    'precip_in': myrounder(
                         datatypes.distance(pt, 'MM').value('IN'), 2)
-            })
+                    })
 
-    return json.dumps(res)
+    if len(points) == 1:
+        return json.dumps(points[0])
+    for lon, lat, res in zip(lons, lats, points):
+        res['lon'] = lon
+        res['lat'] = lat
+    return json.dumps({'points': points})
 
 
 def main():
@@ -63,12 +96,21 @@ def main():
     ssw("Content-type: application/json\n\n")
 
     form = cgi.FieldStorage()
-    lat = float(form.getfirst('lat'))
-    lon = float(form.getfirst('lon'))
+    try:
+        lons, lats = get_points(form)
+    except ValueError as exp:
+        ssw(json.dumps({'error': str(exp)}))
+        return
     valid = form.getfirst('valid')
+    valid2 = form.getfirst('valid2', valid)
     cb = form.getfirst('callback', None)
 
-    mckey = "/json/stage4/%.2f/%.2f/%s?callback=%s" % (lon, lat, valid, cb)
+    mckey = "/json/stage4/%s/%s/%s/%s?callback=%s" % (
+        ",".join(["%.2f" % (x, ) for x in lons]),
+        ",".join(["%.2f" % (x, ) for x in lats]), valid, valid2, cb)
+    if len(mckey) > 200:
+        mckey = "/json/stage4/%s" % (hashlib.md5(
+            mckey.encode('utf-8')).hexdigest(), )
     mc = memcache.Client(['iem-memcached:11211'], debug=0)
     res = mc.get(mckey)
     if not res:
@@ -1,10 +1,18 @@
 #!/usr/bin/env python
-""" Find VTEC events by a given Lat / Lon pair """
+""" Find VTEC events by a given Lat / Lon pair
+
+The UGCs containing the point and their events come from the caches in
+`pointindex`, rather than a `ST_Contains` query against all of the UGCs.
+"""
 import cgi
 import json
 import datetime
+import sys
 
+import memcache
 from pyiem.util import get_dbconn, ssw
+sys.path.insert(0, '/opt/iem/include/python/')
+from pointindex import find_ugc_gids, get_gid_events  # noqa: E402
 
 
 def run(lon, lat, sdate, edate):
@@ -16,22 +24,13 @@ def run(lon, lat, sdate, edate):
     """
     pgconn = get_dbconn('postgis')
     cursor = pgconn.cursor()
+    mc = memcache.Client(['iem-memcached:11211'], debug=0)
 
-    cursor.execute("""
-    WITH myugcs as (
-        select gid from ugcs where
-        ST_Contains(geom, ST_SetSRID(ST_GeomFromEWKT('POINT(%s %s)'),4326))
-    )
-    SELECT
-    to_char(issue at time zone 'UTC', 'YYYY-MM-DDThh24:MI:SSZ') as iso_issued,
-  to_char(expire at time zone 'UTC', 'YYYY-MM-DDThh24:MI:SSZ') as iso_expired,
-    eventid, phenomena, significance, wfo
-    from warnings w JOIN myugcs u on (w.gid = u.gid) WHERE
-    issue > %s and issue < %s ORDER by issue ASC
-    """, (lon, lat, sdate, edate))
-
+    sts = sdate.strftime("%Y-%m-%dT%H:%M:%SZ")
+    ets = edate.strftime("%Y-%m-%dT%H:%M:%SZ")
+    events = get_gid_events(cursor, find_ugc_gids(cursor, lon, lat), mc)
     res = {'events': []}
-    for row in cursor:
+    for row in [row for row in events if sts < row[0] < ets]:
         res['events'].append({'issue': row[0],
                               'expire': row[1],
                               'eventid': row[2],
@@ -0,0 +1,204 @@
+"""Two tier result cache used by autoplot.wsgi
+
+The first tier is a size bounded LRU living within the mod_wsgi process and
+the second tier is our shared memcached.  A short lived memcache lock keyed
+on the result key provides single-flight semantics, so that when a popular
+plot expires only one process renders it while the others wait for the
+result to show up.
+
+Apps declare their caching policy within `get_description()`:
+
+    desc['cache'] = 86400  # seconds to keep the result in memcache
+    desc['cache_local'] = 600  # seconds within the process LRU, 0 disables
+
+The process LRU TTL defaults to the lesser of DEFAULT_LOCAL_TTL and `cache`.
+"""
+import sys
+import time
+import threading
+from collections import OrderedDict
+
+# Default memcache TTL when an app does not declare one
+DEFAULT_TTL = 43200
+# Default process LRU TTL, kept short as each process holds its own copy
+DEFAULT_LOCAL_TTL = 300
+# Bytes of content the process LRU is allowed to hold
+LOCAL_MAXBYTES = 64 * 1024 * 1024
+# Results larger than this are only placed into memcache
+LOCAL_MAXITEM = 4 * 1024 * 1024
+# How long a render lock is held before we consider the renderer dead
+LOCK_TIMEOUT = 120
+# How long a waiter polls for somebody else's result before rendering itself
+WAIT_TIMEOUT = 60
+WAIT_INTERVAL = 0.25
+
+
+def get_policy(meta):
+    """Return (memcache ttl, local ttl) for this app's description."""
+    ttl = int(meta.get('cache', DEFAULT_TTL))
+    local_ttl = int(meta.get('cache_local', DEFAULT_LOCAL_TTL))
+    return ttl, min(ttl, local_ttl)
+
+
+class LocalLRU(object):
+    """A size bounded, thread safe LRU with per entry expiration."""
+
+    def __init__(self, maxbytes=LOCAL_MAXBYTES, maxitem=LOCAL_MAXITEM):
+        """Constructor"""
+        self.maxbytes = maxbytes
+        self.maxitem = maxitem
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key):
+        """Return the cached content or None"""
+        with self._lock:
+            entry = self._data.pop(key, None)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires, content = entry
+            if expires < time.time():
+                self.nbytes -= len(content)
+                self.misses += 1
+                return None
+            # re-insert to mark as most recently used
+            self._data[key] = entry
+            self.hits += 1
+            return content
+
+    def set(self, key, content, ttl):
+        """Store content for ttl seconds, evicting old entries as needed."""
+        size = len(content)
+        if ttl <= 0 or size > self.maxitem:
+            return
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self.nbytes -= len(old[1])
+            self._data[key] = (time.time() + ttl, content)
+            self.nbytes += size
+            while self.nbytes > self.maxbytes and self._data:
+                _, (_, evicted) = self._data.popitem(last=False)
+                self.nbytes -= len(evicted)
+
+    def clear(self):
+        """Drop everything"""
+        with self._lock:
+            self._data.clear()
+            self.nbytes = 0
+
+
+# One per process
+LOCAL = LocalLRU()
+
+
+class TwoTierCache(object):
+    """Local LRU in front of a memcache client."""
+
+    def __init__(self, mc, local=None):
+        """Constructor
+
+        Args:
+          mc (memcache.Client): the shared second tier
+          local (LocalLRU, optional): defaults to the process wide instance
+        """
+        self.mc = mc
+        self.local = LOCAL if local is None else local
+
+    def get(self, key, local_ttl):
+        """Fetch from the local tier and then memcache.
+
+        Returns:
+          content or None, and the tier that answered ('local', 'memcache')
+        """
+        res = self.local.get(key)
+        if res is not None:
+            return res, 'local'
+        try:
+            res = self.mc.get(key)
+        except Exception as exp:
+            sys.stderr.write("apcache get %s failed: %s\n" % (key, exp))
+            res = None
+        if res:
+            self.local.set(key, res, local_ttl)
+            return res, 'memcache'
+        return None, None
+
+    def set(self, key, content, ttl, local_ttl):
+        """Save into both tiers."""
+        self.local.set(key, content, local_ttl)
+        try:
+            self.mc.set(key, content, ttl)
+        except Exception as exp:
+            sys.stderr.write("Exception while writting key: %s\n%s\n" % (
+                key, exp))
+
+    def acquire(self, key):
+        """Attempt to become the one renderer of this key.
+
+        Returns:
+          bool, True if we got the lock or the lock could not be evaluated
+        """
+        try:
+            return bool(self.mc.add(key + "/lock", 1, LOCK_TIMEOUT))
+        except Exception as exp:
+            sys.stderr.write("apcache lock %s failed: %s\n" % (key, exp))
+            return True
+
+    def release(self, key):
+        """Release our render lock."""
+        try:
+            self.mc.delete(key + "/lock")
+        except Exception as exp:
+            sys.stderr.write("apcache unlock %s failed: %s\n" % (key, exp))
+
+    def wait(self, key, local_ttl, timeout=WAIT_TIMEOUT):
+        """Wait for another process to render this key.
+
+        Returns:
+          content or None if the wait timed out or the lock went away
+        """
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            time.sleep(WAIT_INTERVAL)
+            res, _ = self.get(key, local_ttl)
+            if res is not None:
+                return res
+            try:
+                if self.mc.get(key + "/lock") is None:
+                    # renderer gave up (error) without storing a result
+                    return None
+            except Exception:
+                return None
+        return None
+
+
+def test_lru_eviction():
+    """Do we evict the least recently used entries by size?"""
+    lru = LocalLRU(maxbytes=10, maxitem=6)
+    lru.set('a', b'12345', 60)
+    lru.set('b', b'12345', 60)
+    assert lru.get('a') == b'12345'
+    lru.set('c', b'12345', 60)
+    assert lru.get('b') is None
+    assert lru.get('a') == b'12345'
+    lru.set('d', b'1234567', 60)
+    assert lru.get('d') is None
+    lru.set('e', b'1', -1)
+    assert lru.get('e') is None
+
+
+def test_policy():
+    """Do we honor the declared policy?"""
+    assert get_policy({}) == (DEFAULT_TTL, DEFAULT_LOCAL_TTL)
+    assert get_policy({'cache': 600}) == (600, DEFAULT_LOCAL_TTL)
+    assert get_policy({'cache': 60}) == (60, 60)
+    assert get_policy({'cache': 600, 'cache_local': 0}) == (600, 0)
+    assert get_policy({'cache': 60, 'cache_local': 600}) == (60, 60)
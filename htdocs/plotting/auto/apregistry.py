@@ -0,0 +1,128 @@
+"""Per-process registry of loaded autoplot modules.
+
+Our autoplot scripts were previously found and loaded with `imp` on each and
+every request, which re-ran the module top-levels (pandas, geopandas, MapPlot
+and friends) each time.  This registry loads a given app once per process and
+hands back the cached module object for subsequent requests.
+
+Optionally, `preload()` can be called at process start (ie via
+`WSGIImportScript` or prior to a fork) to import every app up front.
+"""
+import sys
+import os
+import glob
+import imp
+import threading
+import datetime
+
+BASEDIR = os.path.dirname(os.path.abspath(__file__))
+if BASEDIR not in sys.path:
+    sys.path.insert(0, BASEDIR)
+
+# appid -> loaded module
+_MODULES = {}
+# appid -> seconds spent importing the module
+_IMPORT_TIMING = {}
+_LOCK = threading.Lock()
+
+
+def get_script_name(pidx):
+    """Return where this script resides, so we can load it!"""
+    if pidx >= 200:
+        name = 'scripts200/p%s' % (pidx, )
+    elif pidx >= 100:
+        name = 'scripts100/p%s' % (pidx, )
+    else:
+        name = 'scripts/p%s' % (pidx,)
+    return name
+
+
+def app_exists(pidx):
+    """Does this autoplot app exist on disk?"""
+    return os.path.isfile('%s/%s.py' % (BASEDIR, get_script_name(pidx)))
+
+
+def _load(pidx):
+    """Actually import the module, recording how long it took."""
+    name = get_script_name(pidx)
+    sts = datetime.datetime.utcnow()
+    fp, pathname, description = imp.find_module(name)
+    try:
+        app = imp.load_module(name, fp, pathname, description)
+    finally:
+        if fp is not None:
+            fp.close()
+    _IMPORT_TIMING[pidx] = (
+        datetime.datetime.utcnow() - sts).total_seconds()
+    return app
+
+
+def get_app(pidx):
+    """Return the loaded module for this autoplot app.
+
+    Args:
+      pidx (int): the autoplot app number
+
+    Returns:
+      module
+    """
+    app = _MODULES.get(pidx)
+    if app is not None:
+        return app
+    with _LOCK:
+        # Another thread may have beat us to it
+        app = _MODULES.get(pidx)
+        if app is None:
+            app = _load(pidx)
+            _MODULES[pidx] = app
+    return app
+
+
+def list_apps():
+    """Return a sorted list of autoplot app numbers found on disk."""
+    res = []
+    for fn in glob.glob("%s/scripts*/p*.py" % (BASEDIR, )):
+        token = os.path.basename(fn)[1:-3]
+        if token.isdigit():
+            res.append(int(token))
+    return sorted(res)
+
+
+def preload(apps=None):
+    """Import autoplot apps ahead of time.
+
+    Failures are logged to stderr and do not prevent the remaining apps from
+    being loaded.
+
+    Args:
+      apps (list, optional): app numbers to load, defaults to all of them
+
+    Returns:
+      dict of appid -> import seconds for the apps that loaded
+    """
+    for pidx in (list_apps() if apps is None else apps):
+        try:
+            get_app(pidx)
+        except Exception as exp:
+            sys.stderr.write("apregistry preload of %s failed: %s\n" % (
+                pidx, exp))
+    return get_import_timing()
+
+
+def get_import_timing(pidx=None):
+    """Return the import cost in seconds for one app or a dict for all."""
+    if pidx is not None:
+        return _IMPORT_TIMING.get(pidx)
+    return dict(_IMPORT_TIMING)
+
+
+def is_loaded(pidx):
+    """Has this app already been imported by this process?"""
+    return pidx in _MODULES
+
+
+def test_script_name():
+    """Do we map app numbers to folders properly?"""
+    assert get_script_name(43) == 'scripts/p43'
+    assert get_script_name(143) == 'scripts100/p143'
+    assert get_script_name(201) == 'scripts200/p201'
@@ -0,0 +1,244 @@
+"""Per request timing spans of autoplot.wsgi
+
+Each autoplot request records named spans (module import, cache get/set,
+`get_autoplot_context`, each database query, the app's plotter, savefig...)
+and, once answered, appends one JSON line describing the request to
+SPANS_TARGET, which `scripts/dbutil/mine_autoplot.py` loads into the
+database.  So we can tell if a slow app is SQL bound or render bound.
+
+    rec = apspans.start(appid, fmt, key)
+    with apspans.span('cache_get') as flags:
+        res, flags['tier'] = cache.get(key, ttl)
+        flags['hit'] = res is not None
+    apspans.finish(cache='miss', status=200)
+
+Spans nest, `totals` of the record sums the time of each span name exclusive
+of the spans within it (ie the `app` total does not include its SQL), so the
+totals add up to no more than the request's total.  `install()` wraps
+psycopg2 connections and `pyiem.util.get_autoplot_context`, and needs to be
+called prior to the apps being imported.
+
+SPANS_TARGET is set via the IEM_AUTOPLOT_SPANS environment variable as either
+a file path or `udp://host:port`, an empty value disables the records.
+"""
+import os
+import sys
+import json
+import time
+import socket
+import datetime
+import threading
+from contextlib import contextmanager
+
+SPANS_TARGET = os.environ.get('IEM_AUTOPLOT_SPANS',
+                              '/var/log/mesonet/autoplot_spans.log')
+# Spans listed in a record, beyond this only the totals are kept
+MAXSPANS = 200
+# Characters of a query's SQL kept within its span
+SQLCHARS = 60
+HOSTNAME = socket.gethostname().split(".")[0]
+# The recorder of the request being answered by this thread
+_LOCAL = threading.local()
+
+
+class Spans(object):
+    """The spans recorded for one request."""
+
+    def __init__(self, appid, fmt, key):
+        """Constructor"""
+        self.appid = appid
+        self.fmt = fmt
+        self.key = key
+        self.valid = datetime.datetime.utcnow()
+        self.sts = time.time()
+        self.spans = []
+        self.dropped = 0
+        self.totals = {}
+        self.counts = {}
+        # time spent within the children of each open span
+        self._stack = []
+
+    def enter(self):
+        """A span has started"""
+        self._stack.append(0.)
+
+    def leave(self, name, secs, **flags):
+        """A span has ended after secs, flags are extra attributes"""
+        inner = self._stack.pop() if self._stack else 0.
+        if self._stack:
+            self._stack[-1] += secs
+        self.totals[name] = self.totals.get(name, 0.) + secs - inner
+        self.counts[name] = self.counts.get(name, 0) + 1
+        if len(self.spans) >= MAXSPANS:
+            self.dropped += 1
+            return
+        entry = dict(name=name, start=round(time.time() - secs - self.sts, 4),
+                     secs=round(secs, 4))
+        entry.update(flags)
+        self.spans.append(entry)
+
+    def to_dict(self, **kwargs):
+        """The record of this request, kwargs are extra attributes"""
+        res = dict(valid=self.valid.strftime("%Y-%m-%dT%H:%M:%S.%fZ"),
+                   hostname=HOSTNAME, appid=self.appid, fmt=self.fmt,
+                   key=self.key, total=round(time.time() - self.sts, 4),
+                   spans=self.spans, dropped=self.dropped,
+                   totals=dict((k, round(v, 4))
+                               for k, v in self.totals.items()),
+                   counts=self.counts)
+        res.update(kwargs)
+        return res
+
+
+def start(appid, fmt, key):
+    """Start recording the spans of a request within this thread"""
+    _LOCAL.current = Spans(appid, fmt, key)
+    return _LOCAL.current
+
+
+def current():
+    """The recorder of this thread's request, if any"""
+    return getattr(_LOCAL, 'current', None)
+
+
+@contextmanager
+def span(name, **flags):
+    """Time a span of the current request
+
+    The yielded dict of flags may be updated within the block, ie to set a
+    cache hit flag.  Without a current request, this does nothing.
+    """
+    rec = current()
+    if rec is None:
+        yield flags
+        return
+    rec.enter()
+    sts = time.time()
+    try:
+        yield flags
+    finally:
+        rec.leave(name, time.time() - sts, **flags)
+
+
+def finish(**kwargs):
+    """Emit the current request's record, kwargs are extra attributes"""
+    rec = current()
+    _LOCAL.current = None
+    if rec is None:
+        return None
+    record = rec.to_dict(**kwargs)
+    emit(record)
+    return record
+
+
+def emit(record, target=None):
+    """Append a record as a line of JSON to the target"""
+    target = SPANS_TARGET if target is None else target
+    if not target:
+        return
+    line = (json.dumps(record, sort_keys=True) + "\n").encode('utf-8')
+    try:
+        if target.startswith("udp://"):
+            (host, port) = target[6:].rsplit(":", 1)
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            try:
+                sock.sendto(line, (host, int(port)))
+            finally:
+                sock.close()
+            return
+        # a single O_APPEND write keeps the lines of processes intact
+        fd = os.open(target, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, line)
+        finally:
+            os.close(fd)
+    except (IOError, OSError) as exp:
+        sys.stderr.write("apspans emit to %s failed: %s\n" % (target, exp))
+
+
+def timed_cursor(base):
+    """Create a cursor class adding a span for each query"""
+
+    class TimedCursor(base):
+        """A cursor recording its queries"""
+
+        def execute(self, query, args=None):
+            with span('sql', sql=sql_head(query)):
+                return super(TimedCursor, self).execute(query, args)
+
+        def executemany(self, query, args_list):
+            with span('sql', sql=sql_head(query)):
+                return super(TimedCursor, self).executemany(query, args_list)
+
+    return TimedCursor
+
+
+def sql_head(query):
+    """The leading bit of the query, for telling the queries apart"""
+    if isinstance(query, bytes):
+        query = query.decode('utf-8', 'ignore')
+    return " ".join(("%s" % (query, )).split())[:SQLCHARS]
+
+
+def install():
+    """Record the database queries and context building of our apps"""
+    import psycopg2
+    import psycopg2.extensions
+    import pyiem.util
+    if getattr(psycopg2.connect, 'apspans', False):
+        return
+    classes = {}
+
+    class TimedConnection(psycopg2.extensions.connection):
+        """A connection handing out timed cursors"""
+
+        def cursor(self, *args, **kwargs):
+            base = (kwargs.pop('cursor_factory', None) or
+                    self.cursor_factory or psycopg2.extensions.cursor)
+            if base not in classes:
+                classes[base] = timed_cursor(base)
+            kwargs['cursor_factory'] = classes[base]
+            return super(TimedConnection, self).cursor(*args, **kwargs)
+
+    _connect = psycopg2.connect
+
+    def connect(*args, **kwargs):
+        if 'connection_factory' not in kwargs:
+            kwargs['connection_factory'] = TimedConnection
+        with span('connect'):
+            return _connect(*args, **kwargs)
+
+    connect.apspans = True
+    psycopg2.connect = connect
+
+    _get_autoplot_context = pyiem.util.get_autoplot_context
+
+    def get_autoplot_context(*args, **kwargs):
+        with span('context'):
+            return _get_autoplot_context(*args, **kwargs)
+
+    pyiem.util.get_autoplot_context = get_autoplot_context
+
+
+def test_spans():
+    """Do the totals exclude the nested spans?"""
+    start(1, 'png', 'key')
+    with span('app'):
+        with span('sql', sql='SELECT 1'):
+            time.sleep(0.02)
+        time.sleep(0.01)
+    with span('cache_set') as flags:
+        flags['hit'] = False
+    rec = _LOCAL.current
+    assert [s['name'] for s in rec.spans] == ['sql', 'app', 'cache_set']
+    assert rec.spans[2]['hit'] is False
+    assert rec.totals['sql'] >= 0.02
+    assert 0.01 <= rec.totals['app'] < rec.spans[1]['secs']
+    record = rec.to_dict(cache='miss')
+    assert record['counts'] == {'app': 1, 'sql': 1, 'cache_set': 1}
+    assert record['cache'] == 'miss'
+    _LOCAL.current = None
+    # without a request, nothing is recorded
+    with span('sql'):
+        pass
+    assert finish() is None
@@ -1,6 +1,7 @@
 """Precip estimates"""
 import datetime
 import os
+import sys
 from collections import OrderedDict
 
 import numpy as np
@@ -10,6 +11,8 @@ from pyiem.plot.use_agg import plt
 from pyiem.plot.geoplot import MapPlot
 from pyiem.plot.colormaps import nwsprecip
 from pyiem.reference import state_bounds
+sys.path.insert(0, '/opt/iem/include/python/')
+from precipsum import period_total  # noqa: E402
 
 PDICT2 = {'c': 'Contour Plot',
           'g': 'Grid Cell Mesh'}
@@ -131,21 +134,9 @@ def plotter(fdict):
                                           state_bounds[state])
     lats = nc.variables['lat'][y0:y1]
     lons = nc.variables['lon'][x0:x1]
-    if (idx1 - idx0) < 32:
-        p01d = distance(np.sum(nc.variables[ncvar][idx0:idx1, y0:y1, x0:x1],
-                               0),
-                        'MM').value('IN')
-    else:
-        # Too much data can overwhelm this app, need to chunk it
-        for i in range(idx0, idx1, 10):
-            i2 = min([i+10, idx1])
-            if idx0 == i:
-                p01d = distance(np.sum(nc.variables[ncvar][i:i2, y0:y1, x0:x1],
-                                       0),
-                                'MM').value('IN')
-            else:
-                p01d += distance(
-                    np.sum(nc.variables[ncvar][i:i2, y0:y1, x0:x1], 0),
+    jslice = slice(y0, y1)
+    islice = slice(x0, x1)
+    p01d = distance(period_total(nc, ncvar, idx0, idx1, jslice, islice),
                     'MM').value('IN')
     nc.close()
     if np.ma.is_masked(np.max(p01d)):
@@ -154,16 +145,16 @@ def plotter(fdict):
     if opt == 'dep':
         # Do departure work now
         nc = util.ncopen(clncfn)
-        climo = distance(np.sum(nc.variables[ncvar][idx0:idx1, y0:y1, x0:x1],
-                                0), 'MM').value('IN')
+        climo = distance(period_total(nc, ncvar, idx0, idx1, jslice, islice),
+                         'MM').value('IN')
         p01d = p01d - climo
         cmap = plt.get_cmap('RdBu')
         [maxv] = np.percentile(np.abs(p01d), [99, ])
         clevs = np.around(np.linspace(0 - maxv, maxv, 11), decimals=2)
     elif opt == 'per':
         nc = util.ncopen(clncfn)
-        climo = distance(np.sum(nc.variables[ncvar][idx0:idx1, y0:y1, x0:x1],
-                                0), 'MM').value('IN')
+        climo = distance(period_total(nc, ncvar, idx0, idx1, jslice, islice),
+                         'MM').value('IN')
         p01d = p01d / climo * 100.
         cmap = plt.get_cmap('RdBu')
         cmap.set_under('white')
@@ -1,15 +1,16 @@
 """iemre stuff"""
 import datetime
+import sys
 
 import numpy as np
 import matplotlib.dates as mdates
 import pandas as pd
-import geopandas as gpd
 from metpy.units import units
 from pyiem import iemre, reference
-from pyiem.grid.zs import CachingZonalStats
-from pyiem.util import get_autoplot_context, get_dbconn, ncopen
+from pyiem.util import get_autoplot_context, ncopen
 from pyiem.plot.use_agg import plt
+sys.path.insert(0, '/opt/iem/include/python/')
+from zonemasks import get_zonemasks  # noqa: E402
 
 
 def get_description():
@@ -60,26 +61,12 @@ def do_date(ctx, now, precip, daythres, trailthres):
 
 def get_data(ctx):
     """Do the processing work, please"""
-    pgconn = get_dbconn('postgis')
-    states = gpd.GeoDataFrame.from_postgis("""
-    SELECT the_geom, state_abbr from states where state_abbr = %s
-    """, pgconn, params=(ctx['state'], ), index_col='state_abbr',
-                                           geom_col='the_geom')
-
     nc = ncopen(iemre.get_daily_ncname(ctx['year']))
 
     precip = nc.variables['p01d']
-    czs = CachingZonalStats(iemre.AFFINE)
-    hasdata = np.zeros((nc.dimensions['lat'].size,
-                        nc.dimensions['lon'].size))
-    czs.gen_stats(hasdata, states['the_geom'])
-    for nav in czs.gridnav:
-        grid = np.ones((nav.ysz, nav.xsz))
-        grid[nav.mask] = 0.
-        jslice = slice(nav.y0, nav.y0 + nav.ysz)
-        islice = slice(nav.x0, nav.x0 + nav.xsz)
-        hasdata[jslice, islice] = np.where(
-            grid > 0, 1, hasdata[jslice, islice])
+    shape = (nc.dimensions['lat'].size, nc.dimensions['lon'].size)
+    hasdata = get_zonemasks(iemre.AFFINE, shape, 'states').grid_mask(
+        ctx['state'], shape)
     ctx['iowa'] = np.flipud(hasdata)
     ctx['iowapts'] = float(np.sum(np.where(hasdata > 0, 1, 0)))
 
@@ -3,17 +3,18 @@
 TODO: the database has this now as the 0000 sites
 """
 import datetime
+import sys
 
 import numpy as np
 import pandas as pd
-import geopandas as gpd
 import matplotlib.dates as mdates
 from pyiem import iemre
 from pyiem.plot.use_agg import plt
-from pyiem.grid.zs import CachingZonalStats
 from pyiem.datatypes import distance
-from pyiem.util import get_autoplot_context, get_dbconn, ncopen
+from pyiem.util import get_autoplot_context, ncopen
 from pyiem import reference
+sys.path.insert(0, '/opt/iem/include/python/')
+from zonemasks import get_zonemasks  # noqa: E402
 
 
 def get_description():
@@ -57,25 +58,11 @@ def plotter(fdict):
     ets = datetime.datetime(year + 1, 5, 1)
     rows = []
 
-    pgconn = get_dbconn('postgis')
-    states = gpd.GeoDataFrame.from_postgis("""
-    SELECT the_geom, state_abbr from states where state_abbr = %s
-    """, pgconn, params=(state, ), index_col='state_abbr',
-                                           geom_col='the_geom')
-
     sidx = iemre.daily_offset(sts)
     nc = ncopen(iemre.get_daily_ncname(sts.year))
-    czs = CachingZonalStats(iemre.AFFINE)
-    hasdata = np.zeros((nc.dimensions['lat'].size,
-                        nc.dimensions['lon'].size))
-    czs.gen_stats(hasdata, states['the_geom'])
-    for nav in czs.gridnav:
-        grid = np.ones((nav.ysz, nav.xsz))
-        grid[nav.mask] = 0.
-        jslice = slice(nav.y0, nav.y0 + nav.ysz)
-        islice = slice(nav.x0, nav.x0 + nav.xsz)
-        hasdata[jslice, islice] = np.where(grid > 0, 1,
-                                           hasdata[jslice, islice])
+    shape = (nc.dimensions['lat'].size, nc.dimensions['lon'].size)
+    hasdata = get_zonemasks(iemre.AFFINE, shape, 'states').grid_mask(
+        state, shape)
     st = np.flipud(hasdata)
     stpts = np.sum(np.where(hasdata > 0, 1, 0))
 
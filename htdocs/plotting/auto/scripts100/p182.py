@@ -1,14 +1,16 @@
 """Precip estimates"""
 import datetime
 import os
+import sys
 
 import numpy as np
-import geopandas as gpd
 from pyiem import iemre, util
 from pyiem.plot.use_agg import plt
 from pyiem.reference import state_names
-from pyiem.grid.zs import CachingZonalStats
 from pyiem.datatypes import distance
+sys.path.insert(0, '/opt/iem/include/python/')
+from precipsum import period_total  # noqa: E402
+from zonemasks import get_zonemasks  # noqa: E402
 
 
 def get_description():
@@ -60,64 +62,29 @@ def plotter(fdict):
         raise ValueError("No data for that year, sorry.")
     nc = util.ncopen(ncfn)
     # Get the state weight
-    df = gpd.GeoDataFrame.from_postgis("""
-    SELECT the_geom from states where state_abbr = %s
-    """, util.get_dbconn('postgis'), params=(sector, ), index_col=None,
-                                       geom_col='the_geom')
-    czs = CachingZonalStats(iemre.MRMS_AFFINE)
-    czs.gen_stats(np.zeros((nc.variables['lat'].size,
-                            nc.variables['lon'].size)), df['the_geom'])
-    hasdata = None
-    jslice = None
-    islice = None
-    for nav in czs.gridnav:
-        hasdata = np.ones((nav.ysz, nav.xsz))
-        hasdata[nav.mask] = 0.
-        # careful here as y is flipped in this context
-        jslice = slice(nc.variables['lat'].size - (nav.y0 + nav.ysz),
-                       nc.variables['lat'].size - nav.y0)
-        islice = slice(nav.x0, nav.x0 + nav.xsz)
+    nav = get_zonemasks(iemre.MRMS_AFFINE, (nc.variables['lat'].size,
+                                            nc.variables['lon'].size),
+                        'states').gridnav(sector)
+    if nav is None:
+        raise ValueError("Sorry, no data for that state.")
+    hasdata = np.ones((nav.ysz, nav.xsz))
+    hasdata[nav.mask] = 0.
+    # careful here as y is flipped in this context
+    jslice = slice(nc.variables['lat'].size - (nav.y0 + nav.ysz),
+                   nc.variables['lat'].size - nav.y0)
+    islice = slice(nav.x0, nav.x0 + nav.xsz)
     hasdata = np.flipud(hasdata)
 
     today = distance(nc.variables[ncvar][idx1, jslice, islice],
                      'MM').value('IN')
-    if (idx1 - idx0) < 32:
-        p01d = distance(np.sum(
-            nc.variables[ncvar][idx0:idx1, jslice, islice], 0),
-                        'MM').value('IN')
-    else:
-        # Too much data can overwhelm this app, need to chunk it
-        for i in range(idx0, idx1, 10):
-            i2 = min([i+10, idx1])
-            if idx0 == i:
-                p01d = distance(np.sum(
-                    nc.variables[ncvar][i:i2, jslice, islice], 0),
-                                'MM').value('IN')
-            else:
-                p01d += distance(np.sum(
-                    nc.variables[ncvar][i:i2, jslice, islice], 0),
-                                 'MM').value('IN')
+    p01d = distance(period_total(nc, ncvar, idx0, idx1, jslice, islice),
+                    'MM').value('IN')
     nc.close()
 
     # Get climatology
     nc = util.ncopen(iemre.get_dailyc_mrms_ncname())
-    if (idx1 - idx0) < 32:
-        c_p01d = distance(np.sum(
-            nc.variables[ncvar][idx0:idx1, jslice, islice], 0),
-                          'MM').value('IN')
-    else:
-        # Too much data can overwhelm this app, need to chunk it
-        for i in range(idx0, idx1, 10):
-            i2 = min([i+10, idx1])
-            if idx0 == i:
-                c_p01d = distance(
-                    np.sum(nc.variables[ncvar][i:i2, jslice, islice], 0),
-                    'MM').value('IN')
-            else:
-                c_p01d += distance(
-                    np.sum(nc.variables[ncvar][i:i2, jslice, islice], 0),
-                    'MM').value('IN')
-
+    c_p01d = distance(period_total(nc, ncvar, idx0, idx1, jslice, islice),
+                      'MM').value('IN')
     nc.close()
 
     # we actually don't care about weights at this fine of scale
@@ -1,13 +1,15 @@
 """Precip days to accumulate"""
 import datetime
+import sys
 
 import numpy as np
-import geopandas as gpd
 from pyiem import iemre, util
 from pyiem.plot.use_agg import plt
 from pyiem.plot.geoplot import MapPlot
-from pyiem.grid.zs import CachingZonalStats
 from pyiem.datatypes import distance
+sys.path.insert(0, '/opt/iem/include/python/')
+from precipsum import trailing_totals  # noqa: E402
+from zonemasks import get_zonemasks  # noqa: E402
 
 
 def get_description():
@@ -53,27 +55,21 @@ def plotter(fdict):
         raise ValueError("No data for that year, sorry.")
 
     # Get the state weight
-    df = gpd.GeoDataFrame.from_postgis("""
-    SELECT the_geom from states where state_abbr = %s
-    """, util.get_dbconn('postgis'), params=(sector, ), index_col=None,
-                                       geom_col='the_geom')
-    czs = CachingZonalStats(iemre.MRMS_AFFINE)
-    czs.gen_stats(np.zeros((nc.variables['lat'].size,
-                            nc.variables['lon'].size)), df['the_geom'])
-    jslice = None
-    islice = None
-    for nav in czs.gridnav:
-        # careful here as y is flipped in this context
-        jslice = slice(nc.variables['lat'].size - (nav.y0 + nav.ysz),
-                       nc.variables['lat'].size - nav.y0)
-        islice = slice(nav.x0, nav.x0 + nav.xsz)
+    nav = get_zonemasks(iemre.MRMS_AFFINE, (nc.variables['lat'].size,
+                                            nc.variables['lon'].size),
+                        'states').gridnav(sector)
+    if nav is None:
+        raise ValueError("Sorry, no data for that state.")
+    # careful here as y is flipped in this context
+    jslice = slice(nc.variables['lat'].size - (nav.y0 + nav.ysz),
+                   nc.variables['lat'].size - nav.y0)
+    islice = slice(nav.x0, nav.x0 + nav.xsz)
 
     grid = np.zeros((jslice.stop - jslice.start,
                      islice.stop - islice.start))
-    total = np.zeros((jslice.stop - jslice.start,
-                      islice.stop - islice.start))
-    for i, idx in enumerate(range(idx1, idx1-90, -1)):
-        total += nc.variables[ncvar][idx, jslice, islice]
+    # totals for the trailing 0 through 89 days prior to the date
+    totals = trailing_totals(nc, ncvar, idx1, 90, jslice, islice).filled(0)
+    for i, total in enumerate(totals):
         grid = np.where(np.logical_and(grid == 0,
                                        total > threshold_mm), i, grid)
     lon = nc.variables['lon'][islice]
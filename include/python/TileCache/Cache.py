@@ -8,10 +8,13 @@ class Cache(object):
     """Base Cache"""
 
     def __init__(self, timeout=30.0, stale_interval=300.0, readonly=False,
-                 expire=False, sendfile=False, **kwargs):
+                 expire=False, sendfile=False, lock_timeout=30.0, **kwargs):
         """Constructor"""
         self.stale = float(stale_interval)
         self.timeout = float(timeout)
+        # seconds a render lock is held for at most, which is also how long
+        # we wait on somebody else's lock prior to rendering ourselves
+        self.lock_timeout = float(lock_timeout)
         self.readonly = readonly
         self.expire = expire
         self.sendfile = sendfile and sendfile.lower() in YESVALS
@@ -19,7 +22,12 @@ class Cache(object):
             self.expire = float(expire)
 
     def lock(self, tile, blocking=True):
-        """locking"""
+        """locking
+
+        Returns:
+          bool, False when not blocking and the lock is held, or when the
+          lock was still held by somebody else after lock_timeout
+        """
         start_time = time.time()
         result = self.attemptLock(tile)
         if result:
@@ -27,10 +35,8 @@ class Cache(object):
         elif not blocking:
             return False
         while result is not True:
-            if time.time() - start_time > self.timeout:
-                raise Exception(("You appear to have a stuck lock. You may "
-                                 "wish to remove the lock named:\n%s"
-                                 ) % (self.getLockName(tile), )) 
+            if time.time() - start_time > self.lock_timeout:
+                return False
             time.sleep(0.25)
             result = self.attemptLock(tile)
         return True
@@ -0,0 +1,205 @@
+"""Disk Caching Provider
+BSD Licensed, Copyright (c) 2006-2010 TileCache Contributors
+
+Tiles are stored under `base` in a hashed directory layout, so that no one
+directory gets too large, ie base/ab/cd/abcd....png.  Writes go to a temporary
+file within the same directory that is then renamed into place, so readers
+never see a partial tile.  The access time of a tile is bumped when it is
+read, which lets `prune()` remove the least recently used tiles once the
+cache grows past `max_size` megabytes.  Pruning walks the whole cache, so it
+is done by a cron job (scripts/cache/prune_tilecache.py) and not while
+serving requests.
+"""
+import os
+import time
+import errno
+import hashlib
+import tempfile
+
+from TileCache.Cache import Cache
+
+
+class Disk(Cache):
+    """Implements a filesystem cache"""
+
+    def __init__(self, base='/tmp/tilecache', max_size=0, ttl=0,
+                 umask='002', **kwargs):
+        """Constructor
+
+        Args:
+          base (str): directory to store tiles within
+          max_size (int): megabytes to allow the cache to grow to, 0 for
+            unlimited
+          ttl (int): seconds a tile is valid for, 0 for forever
+          umask (str): octal umask used when creating files
+        """
+        Cache.__init__(self, **kwargs)
+        self.base = base
+        self.max_size = int(max_size) * 1024 * 1024
+        self.ttl = int(ttl)
+        self.umask = int(umask, 8) if isinstance(umask, str) else umask
+
+    def getName(self, tile):
+        """Get the unhashed name of this tile"""
+        return "/".join(map(str, [tile.layer.name, tile.x, tile.y, tile.z]))
+
+    def getKey(self, tile):
+        """Get the path for this tile"""
+        return self.getPath(self.getName(tile), tile.layer.extension)
+
+    def getPath(self, key, extension):
+        """Convert a key into its hashed filesystem location"""
+        digest = hashlib.md5(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.base, digest[:2], digest[2:4],
+                            "%s.%s" % (digest, extension))
+
+    def getLockName(self, tile):
+        """Locks live alongside the tiles"""
+        return self.getPath(self.getName(tile), 'lck')
+
+    def _makedirs(self, path):
+        """Ensure a directory exists"""
+        try:
+            os.makedirs(path)
+        except OSError as exp:
+            if exp.errno != errno.EEXIST:
+                raise
+
+    def get(self, tile):
+        """Get the cache data"""
+        path = self.getKey(tile)
+        tile.data = None
+        try:
+            stat = os.stat(path)
+            if self.ttl > 0 and (time.time() - stat.st_mtime) > self.ttl:
+                return None
+            with open(path, 'rb') as fh:
+                tile.data = fh.read()
+            # the access time is our LRU clock, set it explicitly as noatime
+            # mounts would otherwise never update it
+            os.utime(path, (time.time(), stat.st_mtime))
+        except (IOError, OSError):
+            pass
+        return tile.data
+
+    def set(self, tile, data):
+        """Set the cache data"""
+        if self.readonly:
+            return data
+        path = self.getKey(tile)
+        dirname = os.path.dirname(path)
+        self._makedirs(dirname)
+        oldmask = os.umask(self.umask)
+        try:
+            (fd, tmpfn) = tempfile.mkstemp(dir=dirname, prefix='.tmp')
+            with os.fdopen(fd, 'wb') as fh:
+                fh.write(data)
+            os.chmod(tmpfn, 0o666 & ~self.umask)
+            os.rename(tmpfn, path)
+        finally:
+            os.umask(oldmask)
+        return data
+
+    def delete(self, tile):
+        """Delete a tile from the cache"""
+        try:
+            os.unlink(self.getKey(tile))
+        except OSError:
+            pass
+
+    def attemptLock(self, tile):
+        """Attempt to lock the cache for a tile
+
+        The lock is a file created exclusively, a lock older than
+        lock_timeout is presumed to belong to a dead renderer and is taken
+        over.
+        """
+        name = self.getLockName(tile)
+        self._makedirs(os.path.dirname(name))
+        try:
+            fd = os.open(name, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except OSError as exp:
+            if exp.errno != errno.EEXIST:
+                raise
+            try:
+                age = time.time() - os.stat(name).st_mtime
+            except OSError:
+                # released while we looked, try again next time around
+                return False
+            if age < self.lock_timeout:
+                return False
+            # only one process wins renaming the stale lock out of the way
+            stale = "%s.%s.lck" % (name[:-4], os.getpid())
+            try:
+                os.rename(name, stale)
+            except OSError:
+                return False
+            os.unlink(stale)
+            return self.attemptLock(tile)
+        os.close(fd)
+        return True
+
+    def unlock(self, tile):
+        """Release the lock for a tile"""
+        try:
+            os.unlink(self.getLockName(tile))
+        except OSError:
+            pass
+
+    def prune(self, target=0.9):
+        """Remove the least recently used tiles
+
+        Args:
+          target (float): fraction of max_size to prune the cache down to
+
+        Returns:
+          int number of tiles removed
+        """
+        if self.max_size <= 0:
+            return 0
+        entries = []
+        total = 0
+        for root, _dirs, files in os.walk(self.base):
+            for fn in files:
+                if fn.startswith('.') or fn.endswith('.lck'):
+                    continue
+                path = os.path.join(root, fn)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                total += stat.st_size
+                entries.append((stat.st_atime, stat.st_size, path))
+        if total <= self.max_size:
+            return 0
+        removed = 0
+        entries.sort()
+        for (_atime, size, path) in entries:
+            if total <= self.max_size * target:
+                break
+            try:
+                os.unlink(path)
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+        return removed
+
+
+def test_disk(tmpdir):
+    """Can we set, get, lock and prune?"""
+    from TileCache.Layer import Layer, Tile
+    cache = Disk(base=str(tmpdir), max_size=1)
+    layer = Layer("test")
+    tile = Tile(layer, 1, 2, 3)
+    assert cache.get(tile) is None
+    cache.set(tile, b"PNG")
+    assert cache.get(Tile(layer, 1, 2, 3)) == b"PNG"
+    assert cache.attemptLock(tile)
+    assert not cache.attemptLock(tile)
+    cache.unlock(tile)
+    assert cache.attemptLock(tile)
+    cache.unlock(tile)
+    for i in range(12):
+        cache.set(Tile(layer, i, 0, 0), b"0" * 100000)
+    assert cache.prune() > 0
@@ -1,8 +1,6 @@
 """Memcached Caching Provider
 BSD Licensed, Copyright (c) 2006-2010 TileCache Contributors
 """
-import time
-
 from six import string_types
 import memcache
 from TileCache.Cache import Cache
@@ -43,9 +41,13 @@ class Memcached(Cache):
         self.cache.delete(key)
 
     def attemptLock(self, tile):
-        """Attempt to lock the cache for a tile"""
+        """Attempt to lock the cache for a tile
+
+        memcache expiration times are relative seconds, so the lock clears
+        itself should the renderer die while holding it.
+        """
         return self.cache.add(self.getLockName(tile), "0",
-                              time.time() + self.timeout)
+                              max(1, int(self.lock_timeout)))
 
     def unlock(self, tile):
         """Attempt to unlock the cache for a tile"""
@@ -0,0 +1,61 @@
+"""Memcached backed by Disk Caching Provider
+BSD Licensed, Copyright (c) 2006-2010 TileCache Contributors
+
+memcache is the first level, but evicts tiles whenever it is under pressure.
+The disk cache is the second level, so an evicted tile is copied back into
+memcache from disk rather than rendered again.  Render locks are taken in
+memcache, as they need to be seen by every node of the webfarm.
+"""
+from TileCache.Cache import Cache
+from TileCache.Caches.Disk import Disk
+from TileCache.Caches.Memcached import Memcached
+
+# options that only apply to the disk cache
+DISK_OPTIONS = ['base', 'max_size', 'ttl', 'umask']
+
+
+class Tiered(Cache):
+    """Implements a two level cache"""
+
+    def __init__(self, **kwargs):
+        """Constructor, see Memcached and Disk for the options"""
+        Cache.__init__(self, **dict((k, v) for k, v in kwargs.items()
+                                    if k not in DISK_OPTIONS))
+        self.memory = Memcached(**dict((k, v) for k, v in kwargs.items()
+                                       if k not in DISK_OPTIONS))
+        self.disk = Disk(**dict((k, v) for k, v in kwargs.items()
+                                if k != 'servers'))
+
+    def getKey(self, tile):
+        """Get the key for this tile"""
+        return self.memory.getKey(tile)
+
+    def get(self, tile):
+        """Get the cache data"""
+        data = self.memory.get(tile)
+        if data:
+            return data
+        data = self.disk.get(tile)
+        if data and not self.readonly:
+            self.memory.set(tile, data)
+        return data
+
+    def set(self, tile, data):
+        """Set the cache data"""
+        if self.readonly:
+            return data
+        self.disk.set(tile, data)
+        return self.memory.set(tile, data)
+
+    def delete(self, tile):
+        """Delete a tile from the cache"""
+        self.memory.delete(tile)
+        self.disk.delete(tile)
+
+    def attemptLock(self, tile):
+        """Attempt to lock the cache for a tile"""
+        return self.memory.attemptLock(tile)
+
+    def unlock(self, tile):
+        """Attempt to unlock the cache for a tile"""
+        self.memory.unlock(tile)
@@ -133,11 +133,23 @@ class Service(object):
         if not force:
             image = self.cache.get(tile)
         if not image:
-            data = layer.render(tile, force=force)
-            if data:
-                image = self.cache.set(tile, data)
-            else:
-                raise Exception("Zero length data returned from layer.")
+            # Only one request renders the tile, others wait and then find
+            # the result within the cache, or render it themselves should
+            # the wait exceed the cache's lock_timeout
+            locked = self.cache.lock(tile)
+            try:
+                if not force:
+                    image = self.cache.get(tile)
+                if not image:
+                    data = layer.render(tile, force=force)
+                    if data:
+                        image = self.cache.set(tile, data)
+                    else:
+                        raise Exception(
+                            "Zero length data returned from layer.")
+            finally:
+                if locked:
+                    self.cache.unlock(tile)
             if layer.debug:
                 sys.stderr.write(("Cache miss: %s, Tile: x: %s, y: %s, z: %s, "
                                   "time: %s\n"
@@ -0,0 +1,71 @@
+"""Where our processes share their on-disk caches.
+
+The web processes load these caches, so they can only live where our own
+accounts are able to write.  CACHEROOT is provisioned by hand, owned by root
+and shared by apache and the cron jobs via its group, ie
+
+    install -d -m 2775 -o root -g apache /mesonet/data/cache
+
+Unlike tempfile.gettempdir(), it is also the same directory for apache (which
+has a PrivateTmp) and our scripts, and is not subject to tmp cleanups.  A
+cache directory that is world writable, or not owned by us or root, is not
+used.
+"""
+import os
+import stat
+
+CACHEROOT = "/mesonet/data/cache"
+
+
+def is_trusted(path):
+    """Can we trust the content of a directory?"""
+    try:
+        res = os.stat(path)
+    except OSError:
+        return False
+    if not stat.S_ISDIR(res.st_mode) or res.st_mode & stat.S_IWOTH:
+        return False
+    return res.st_uid in [0, os.getuid()]
+
+
+def get_cachedir(name, root=None):
+    """Get the directory for a cache, creating it as need be
+
+    Args:
+      name (str): the cache's subdirectory
+      root (str, optional): defaults to CACHEROOT
+
+    Returns:
+      str path or None when there is no trusted directory to use
+    """
+    root = CACHEROOT if root is None else root
+    if not is_trusted(root):
+        return None
+    path = os.path.join(root, name)
+    if not os.path.isdir(path):
+        try:
+            os.mkdir(path)
+            # group writable and inheriting the group, as root is
+            os.chmod(path, 0o2775)
+        except OSError:
+            pass
+    # the subdirectory may be owned by another of our accounts
+    try:
+        if os.stat(path).st_mode & stat.S_IWOTH:
+            return None
+    except OSError:
+        return None
+    return path
+
+
+def test_cachedir(tmpdir):
+    """Do we refuse world writable directories?"""
+    root = str(tmpdir)
+    os.chmod(root, 0o755)
+    path = get_cachedir('test', root)
+    assert path == os.path.join(root, 'test')
+    os.chmod(path, 0o777)
+    assert get_cachedir('test', root) is None
+    os.chmod(root, 0o777)
+    assert get_cachedir('test2', root) is None
+    assert not os.path.isdir(os.path.join(root, 'test2'))
@@ -0,0 +1,252 @@
+"""Locate points within our gridded netCDF archives.
+
+Finding the grid cell nearest to a point on a curvilinear grid (Stage IV)
+by comparing against every cell is slow for a web request.  Here the grid's
+lon/lat arrays are saved to CACHEDIR (as a plain .npy array, never pickles)
+and memory mapped by later processes (ie CGI requests), which search every
+STRIDE'th cell and then the cells around the nearest of those, so only a
+small part of the arrays is ever read.  Regular lon/lat grids (IEMRE) are
+located with simple arithmetic.
+
+    nc = ncopen(ncfn)
+    locator = get_locator(nc)
+    i, j = locator.find([-93.6, -95.2], [41.9, 42.1])
+    data = sample(nc, 'p01m', slice(0, 24), i, j)
+"""
+import os
+import hashlib
+import tempfile
+
+import numpy as np
+from cachedir import get_cachedir
+
+CACHEDIR = get_cachedir("gridlocator")
+# the coarse search considers every STRIDE'th cell of each dimension
+STRIDE = 8
+# Per process cache of grid definition key -> locator
+_LOCATORS = {}
+
+
+class AffineLocator(object):
+    """Locate points on a regular lon/lat grid."""
+
+    def __init__(self, west, south, dx, dy, nx, ny):
+        """Constructor
+
+        Args:
+          west, south (float): the lower left grid cell, as iemre.XAXIS
+          dx, dy (float): grid spacing in degrees
+          nx, ny (int): grid size
+        """
+        self.west = west
+        self.south = south
+        self.dx = dx
+        self.dy = dy
+        self.nx = nx
+        self.ny = ny
+
+    def find(self, lons, lats):
+        """Find the grid cells the points reside within, like iemre.find_ij
+
+        Returns:
+          (i, j) integer arrays, -1 for points outside of the grid
+        """
+        i = np.floor((np.asarray(lons, float) - self.west) / self.dx)
+        j = np.floor((np.asarray(lats, float) - self.south) / self.dy)
+        outside = (i < 0) | (i >= self.nx) | (j < 0) | (j >= self.ny)
+        i[outside] = -1
+        j[outside] = -1
+        return i.astype(int), j.astype(int)
+
+
+class WindowLocator(object):
+    """Locate points on a 2D lon/lat grid via a coarse then a local search."""
+
+    def __init__(self, lons, lats, stride=STRIDE):
+        """Constructor
+
+        Args:
+          lons (2d array): grid cell longitudes, may be memory mapped
+          lats (2d array): grid cell latitudes, may be memory mapped
+          stride (int): the coarse search considers every stride'th cell
+        """
+        self.lons = lons
+        self.lats = lats
+        self.shape = lons.shape
+        self.stride = stride
+        self.clons = np.asarray(lons[::stride, ::stride], float)
+        self.clats = np.asarray(lats[::stride, ::stride], float)
+
+    @staticmethod
+    def _nearest(lons, lats, lon, lat):
+        """The (j, i) of the cell nearest to a point, in lon/lat degrees"""
+        dist = (lons - lon) ** 2 + (lats - lat) ** 2
+        dist = np.where(np.isnan(dist), np.inf, dist)
+        return np.unravel_index(np.argmin(dist), dist.shape)
+
+    def find(self, lons, lats):
+        """Find the nearest grid cells, as measured in lon/lat degrees
+
+        Returns:
+          (i, j) integer arrays
+        """
+        lons = np.atleast_1d(np.asarray(lons, float))
+        lats = np.atleast_1d(np.asarray(lats, float))
+        i = np.zeros(lons.size, int)
+        j = np.zeros(lons.size, int)
+        # the nearest coarse cell is within two strides of the nearest cell
+        pad = 2 * self.stride
+        for idx, (lon, lat) in enumerate(zip(lons, lats)):
+            (cj, ci) = self._nearest(self.clons, self.clats, lon, lat)
+            j0 = max(cj * self.stride - pad, 0)
+            i0 = max(ci * self.stride - pad, 0)
+            window = (slice(j0, cj * self.stride + pad + 1),
+                      slice(i0, ci * self.stride + pad + 1))
+            (wj, wi) = self._nearest(np.asarray(self.lons[window], float),
+                                     np.asarray(self.lats[window], float),
+                                     lon, lat)
+            j[idx] = j0 + wj
+            i[idx] = i0 + wi
+        return i, j
+
+
+def grid_key(nc, lonname='lon', latname='lat'):
+    """Compute a key identifying the grid definition of a netCDF file"""
+    lon = nc.variables[lonname]
+    lat = nc.variables[latname]
+    (ny, nx) = lon.shape
+    parts = [lon.shape]
+    for (j, i) in [(0, 0), (0, nx - 1), (ny - 1, 0), (ny - 1, nx - 1),
+                   (ny // 2, nx // 2)]:
+        parts.extend([float(lon[j, i]), float(lat[j, i])])
+    return hashlib.md5(repr(parts).encode('utf-8')).hexdigest()
+
+
+def load_lonlat(fn):
+    """Memory map the saved lon/lat arrays of a grid, None if not usable"""
+    if CACHEDIR is None or not os.path.isfile(fn):
+        return None
+    try:
+        data = np.load(fn, mmap_mode='r', allow_pickle=False)
+    except (IOError, OSError, ValueError):
+        return None
+    if data.ndim != 3 or data.shape[0] != 2 or data.dtype.kind != 'f':
+        return None
+    return data[0], data[1]
+
+
+def save_lonlat(fn, lons, lats):
+    """Atomically save the lon/lat arrays of a grid"""
+    if CACHEDIR is None:
+        return
+    try:
+        (fd, tmpfn) = tempfile.mkstemp(dir=CACHEDIR)
+        with os.fdopen(fd, 'wb') as fh:
+            np.save(fh, np.array([np.ma.filled(lons, np.nan),
+                                  np.ma.filled(lats, np.nan)], 'f8'))
+        os.chmod(tmpfn, 0o644)
+        os.rename(tmpfn, fn)
+    except (IOError, OSError):
+        pass
+
+
+def get_locator(nc, lonname='lon', latname='lat'):
+    """Get a locator for the 2D lon/lat grid of a netCDF file
+
+    The locator is cached within this process and its lon/lat arrays saved
+    to CACHEDIR for other processes to memory map.
+    """
+    key = grid_key(nc, lonname, latname)
+    if key in _LOCATORS:
+        return _LOCATORS[key]
+    fn = os.path.join(CACHEDIR or "", "%s.npy" % (key, ))
+    lonlat = load_lonlat(fn)
+    if lonlat is None:
+        lonlat = (np.ma.filled(nc.variables[lonname][:], np.nan),
+                  np.ma.filled(nc.variables[latname][:], np.nan))
+        save_lonlat(fn, *lonlat)
+    _LOCATORS[key] = WindowLocator(*lonlat)
+    return _LOCATORS[key]
+
+
+def get_iemre_locator():
+    """Get the locator for the IEMRE grid"""
+    from pyiem import iemre
+    return AffineLocator(iemre.XAXIS[0], iemre.YAXIS[0],
+                         iemre.XAXIS[1] - iemre.XAXIS[0],
+                         iemre.YAXIS[1] - iemre.YAXIS[0],
+                         len(iemre.XAXIS), len(iemre.YAXIS))
+
+
+def sample(nc, varname, tslice, i, j):
+    """Read a time series for many points from one open file
+
+    Args:
+      nc: netCDF4 dataset
+      varname (str): variable with (time, y, x) dimensions
+      tslice (slice): time indices to read
+      i, j (arrays): grid indices from a locator
+
+    Returns:
+      masked array of (time, points)
+    """
+    var = nc.variables[varname]
+    i = np.atleast_1d(i)
+    j = np.atleast_1d(j)
+    ok = i >= 0
+    if ok.any():
+        # one read of the window spanning our points, if that is small
+        i0, i1 = i[ok].min(), i[ok].max() + 1
+        j0, j1 = j[ok].min(), j[ok].max() + 1
+        if (i1 - i0) * (j1 - j0) <= 64 * ok.sum():
+            window = var[tslice, j0:j1, i0:i1]
+            res = np.ma.masked_all((window.shape[0], len(i)))
+            res[:, ok] = window[:, j[ok] - j0, i[ok] - i0]
+            return res
+    size = len(range(*tslice.indices(var.shape[0])))
+    res = np.ma.masked_all((size, len(i)))
+    for idx, (ii, jj) in enumerate(zip(i, j)):
+        if ii >= 0:
+            res[:, idx] = var[tslice, jj, ii]
+    return res
+
+
+def test_locators():
+    """Do we match the brute force approach?"""
+    np.random.seed(0)
+    xi, yi = np.meshgrid(np.arange(120), np.arange(90))
+    # a rotated and stretched, so curvilinear, grid
+    lons = -100. + 0.3 * xi + 0.05 * yi + 0.001 * xi * yi
+    lats = 35. + 0.25 * yi - 0.04 * xi
+    locator = WindowLocator(lons, lats, 4)
+    # including points off of the grid
+    plons = np.random.uniform(-102, -50, 200)
+    plats = np.random.uniform(28, 60, 200)
+    i, j = locator.find(plons, plats)
+    for idx, (lon, lat) in enumerate(zip(plons, plats)):
+        dist = ((lons - lon)**2 + (lats - lat)**2)**0.5
+        (j2, i2) = np.unravel_index(dist.argmin(), dist.shape)
+        assert (i[idx], j[idx]) == (i2, j2)
+    locator = AffineLocator(-104., 37., 0.125, 0.125, 488, 256)
+    i, j = locator.find([-104., -93.6, -110.], [37., 41.99, 40.])
+    assert list(i) == [0, 83, -1]
+    assert list(j) == [0, 39, -1]
+
+
+def test_lonlat(tmpdir):
+    """Can we save and load the arrays, without pickles?"""
+    global CACHEDIR
+    saved = CACHEDIR
+    CACHEDIR = str(tmpdir)
+    try:
+        fn = os.path.join(CACHEDIR, "test.npy")
+        lons, lats = np.meshgrid(np.arange(3.), np.arange(2.))
+        save_lonlat(fn, lons, lats)
+        (lon2, lat2) = load_lonlat(fn)
+        assert np.allclose(lon2, lons) and np.allclose(lat2, lats)
+        # a pickled object array is refused
+        with open(fn, 'wb') as fh:
+            np.save(fh, np.array([{}], dtype=object))
+        assert load_lonlat(fn) is None
+    finally:
+        CACHEDIR = saved
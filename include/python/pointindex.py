@@ -0,0 +1,363 @@
+"""Point in polygon lookups against our UGC and storm based warning polygons.
+
+Finding the UGCs or storm based warnings containing a point with
+`ST_Contains` means searching the full `ugcs` and `sbw` tables for each web
+request.  Here the polygons are cut into BUCKET degree cells and each cell's
+polygons are saved to CACHEDIR (as ring arrays and JSON attributes, never
+pickles), so a request only loads the cell its point falls within and tests
+those polygons itself.
+
+UGC polygons rarely change, so a cell is only rebuilt when the `ugcs` table
+has changed, which is checked once every UGC_MAXAGE seconds.  The VTEC events
+for each UGC gid are kept in memcache and brought up to date with the
+warnings `updated` since the last lookup.  Storm based warnings are not
+changed once issued, so their cells are appended to with the warnings issued
+since the last lookup.
+
+    gids = find_ugc_gids(cursor, -93.6, 41.99)
+    events = get_gid_events(cursor, gids, mc)
+    sbws = find_sbws(cursor, -93.6, 41.99)
+"""
+import os
+import json
+import math
+import time
+import tempfile
+
+import numpy as np
+from cachedir import get_cachedir
+
+CACHEDIR = get_cachedir("pointindex")
+# size of a cell in degrees
+BUCKET = 1.
+# seconds between checks that the ugcs table has not changed
+UGC_MAXAGE = 86400
+# seconds of overlap when asking for changes since the last lookup
+OVERLAP = 3600
+# seconds between saves of a storm based warning cell without changes
+SBW_MAXAGE = 86400
+# seconds a gid's event list is kept in memcache
+GID_TTL = 86400 * 7
+SBW_PHENOMENA = ['SV', 'TO', 'FF', 'FL', 'MA', 'FA']
+SBW_START = '2005-10-01'
+
+
+def bucket_key(lon, lat):
+    """The cell containing a point"""
+    return (int(math.floor(lon / BUCKET)), int(math.floor(lat / BUCKET)))
+
+
+def bucket_envelope(key):
+    """The (west, south, east, north) bounds of a cell"""
+    return (key[0] * BUCKET, key[1] * BUCKET, (key[0] + 1) * BUCKET,
+            (key[1] + 1) * BUCKET)
+
+
+def to_rings(geojson):
+    """Convert a GeoJSON (Multi)Polygon into a list of ring arrays"""
+    geom = json.loads(geojson)
+    polys = geom['coordinates']
+    if geom['type'] == 'Polygon':
+        polys = [polys, ]
+    return [np.array(ring, dtype='f8') for poly in polys for ring in poly
+            if len(ring) > 2]
+
+
+def get_bbox(rings):
+    """The (west, south, east, north) bounds of the rings"""
+    pts = np.concatenate(rings)
+    return (pts[:, 0].min(), pts[:, 1].min(), pts[:, 0].max(),
+            pts[:, 1].max())
+
+
+def contains(bbox, rings, lon, lat):
+    """Is the point within the polygon, via even-odd ray casting"""
+    if lon < bbox[0] or lon > bbox[2] or lat < bbox[1] or lat > bbox[3]:
+        return False
+    inside = False
+    for ring in rings:
+        xs = ring[:, 0]
+        ys = ring[:, 1]
+        xj = np.roll(xs, 1)
+        yj = np.roll(ys, 1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            crosses = (((ys > lat) != (yj > lat)) &
+                       (lon < (xj - xs) * (lat - ys) / (yj - ys) + xs))
+        if np.count_nonzero(crosses) % 2 == 1:
+            inside = not inside
+    return inside
+
+
+def _cellfn(prefix, key):
+    """The file of a cell"""
+    return os.path.join(CACHEDIR or "", "%s_%s_%s.npz" % ((prefix, ) + key))
+
+
+def _load(fn):
+    """Load a cell from disk, None if it is not usable
+
+    Returns:
+      (meta dict, list of (attrs tuple, bbox, rings))
+    """
+    if CACHEDIR is None or not os.path.isfile(fn):
+        return None
+    try:
+        with np.load(fn, allow_pickle=False) as data:
+            meta = json.loads(str(data['meta']))
+            rings = np.split(data['coords'], np.cumsum(data['ringlens'])[:-1])
+            polyrings = data['polyrings']
+            bboxes = data['bboxes']
+    except (IOError, OSError, ValueError, KeyError):
+        return None
+    polygons = []
+    start = 0
+    for attrs, count, bbox in zip(meta.pop('attrs'), polyrings, bboxes):
+        polygons.append((tuple(attrs), tuple(bbox),
+                         rings[start:start + count]))
+        start += count
+    return meta, polygons
+
+
+def _save(fn, meta, polygons):
+    """Atomically save a cell to disk
+
+    Args:
+      fn (str): the cell's file
+      meta (dict): JSON serializable attributes of the cell
+      polygons (list): (attrs tuple, bbox, rings)
+    """
+    if CACHEDIR is None:
+        return
+    meta = dict(meta)
+    meta['attrs'] = [attrs for (attrs, _, _) in polygons]
+    rings = [ring for (_, _, _rings) in polygons for ring in _rings]
+    try:
+        (fd, tmpfn) = tempfile.mkstemp(dir=CACHEDIR)
+        with os.fdopen(fd, 'wb') as fh:
+            np.savez(
+                fh, meta=np.array(json.dumps(meta)),
+                coords=(np.concatenate(rings) if rings
+                        else np.zeros((0, 2), 'f8')),
+                ringlens=np.array([len(ring) for ring in rings], 'i4'),
+                polyrings=np.array([len(_rings)
+                                    for (_, _, _rings) in polygons], 'i4'),
+                bboxes=np.array([bbox for (_, bbox, _) in polygons],
+                                'f8').reshape((-1, 4)))
+        os.chmod(tmpfn, 0o644)
+        os.rename(tmpfn, fn)
+    except (IOError, OSError):
+        pass
+
+
+def _cell_polygons(cursor, sql, args, key):
+    """Run a query returning (attrs..., geojson) clipped to a cell
+
+    Returns:
+      list of (attrs tuple, bbox, rings)
+    """
+    cursor.execute(sql, args + bucket_envelope(key) * 2)
+    res = []
+    for row in cursor:
+        rings = to_rings(row[-1])
+        if rings:
+            res.append((tuple(row[:-1]), get_bbox(rings), rings))
+    return res
+
+
+def ugc_signature(cursor):
+    """Something that changes when the ugcs table does"""
+    cursor.execute("""
+        SELECT count(*), max(gid), max(coalesce(end_ts, begin_ts)) from ugcs
+    """)
+    return ["%s" % (val, ) for val in cursor.fetchone()]
+
+
+def find_ugc_gids(cursor, lon, lat):
+    """Find the UGCs containing a point
+
+    Args:
+      cursor: postgis database cursor
+      lon, lat (float): the point
+
+    Returns:
+      list of (gid, ugc) tuples
+    """
+    key = bucket_key(lon, lat)
+    fn = _cellfn("ugc", key)
+    cell = _load(fn)
+    if cell is not None and os.stat(fn).st_mtime < (time.time() - UGC_MAXAGE):
+        (meta, _) = cell
+        if meta['signature'] == ugc_signature(cursor):
+            # still good, check again later
+            try:
+                os.utime(fn, None)
+            except OSError:
+                pass
+        else:
+            cell = None
+    if cell is None:
+        meta = {'signature': ugc_signature(cursor)}
+        polygons = _cell_polygons(cursor, """
+            SELECT gid, ugc, ST_AsGeoJSON(ST_CollectionExtract(
+                ST_Intersection(geom, ST_MakeEnvelope(%s, %s, %s, %s, 4326)),
+                3)) from ugcs
+            WHERE geom && ST_MakeEnvelope(%s, %s, %s, %s, 4326)
+        """, (), key)
+        _save(fn, meta, polygons)
+        cell = (meta, polygons)
+    (_, polygons) = cell
+    return [attrs for (attrs, bbox, rings) in polygons
+            if contains(bbox, rings, lon, lat)]
+
+
+def _gid_rows(cursor, ugcs, gids, updated=None):
+    """Query the warnings for gids, optionally only those updated since"""
+    sql = """
+        SELECT gid,
+        to_char(issue at time zone 'UTC', 'YYYY-MM-DDThh24:MI:SSZ'),
+        to_char(expire at time zone 'UTC', 'YYYY-MM-DDThh24:MI:SSZ'),
+        eventid, phenomena, significance, wfo from warnings
+        WHERE ugc = ANY(%s) and gid = ANY(%s)
+    """
+    args = [ugcs, gids]
+    if updated is not None:
+        sql += " and updated > %s"
+        args.append(updated)
+    cursor.execute(sql, args)
+    return cursor.fetchall()
+
+
+def get_gid_events(cursor, gids, mc):
+    """Get the VTEC events for UGC gids
+
+    Args:
+      cursor: postgis database cursor
+      gids (list): (gid, ugc) tuples from find_ugc_gids
+      mc: memcache client
+
+    Returns:
+      list of (issue, expire, eventid, phenomena, significance, wfo) tuples
+      sorted by issue, times are ISO strings in UTC
+    """
+    if not gids:
+        return []
+    ugcs = list(set([ugc for _, ugc in gids]))
+    mckeys = dict((gid, "/pointindex/gid/%s" % (gid, )) for gid, _ in gids)
+    cached = mc.get_multi(list(mckeys.values()))
+    cells = dict((gid, cached.get(mckeys[gid])) for gid in mckeys)
+    cursor.execute("SELECT now() - '%s seconds'::interval", (OVERLAP, ))
+    through = cursor.fetchone()[0]
+    # gids not cached need everything, the others what has since changed
+    rows = []
+    missing = [gid for gid in cells if cells[gid] is None]
+    if missing:
+        rows.extend(_gid_rows(cursor, ugcs, missing))
+    current = [gid for gid in cells if cells[gid] is not None]
+    if current:
+        rows.extend(_gid_rows(cursor, ugcs, current,
+                              min([cells[gid]['through']
+                                   for gid in current])))
+    for gid in missing:
+        cells[gid] = {'events': {}}
+    for row in rows:
+        # events are unique by year, wfo, phenomena, sig and eventid
+        evkey = (row[1][:4], row[6], row[4], row[5], row[3])
+        cells[row[0]]['events'][evkey] = tuple(row[1:])
+    res = []
+    for gid, cell in cells.items():
+        cell['through'] = through
+        mc.set(mckeys[gid], cell, GID_TTL)
+        res.extend(cell['events'].values())
+    return sorted(res)
+
+
+def sbw_evkey(attrs):
+    """Warnings are unique by year, wfo, phenomena, sig and eventid"""
+    return (attrs[0][:4], attrs[5], attrs[3], attrs[4], attrs[2])
+
+
+def find_sbws(cursor, lon, lat):
+    """Find the storm based warnings containing a point
+
+    Returns:
+      list of (issue, expire, eventid, phenomena, significance, wfo) tuples
+      sorted by issue, times are ISO strings in UTC
+    """
+    key = bucket_key(lon, lat)
+    fn = _cellfn("sbw", key)
+    (meta, polygons) = _load(fn) or ({'through': None}, [])
+    # seconds since the epoch, as stored within the cell's JSON
+    cell = {'through': meta['through'],
+            'polygons': dict((sbw_evkey(attrs), (attrs, bbox, rings))
+                             for (attrs, bbox, rings) in polygons)}
+    cursor.execute("SELECT extract(epoch from now()) - %s", (OVERLAP, ))
+    through = float(cursor.fetchone()[0])
+    cursor.execute("""
+        SELECT to_char(issue at time zone 'UTC', 'YYYY-MM-DDThh24:MIZ'),
+        to_char(expire at time zone 'UTC', 'YYYY-MM-DDThh24:MIZ'),
+        eventid, phenomena, significance, wfo,
+        ST_AsGeoJSON(ST_CollectionExtract(
+            ST_Intersection(geom, ST_MakeEnvelope(%s, %s, %s, %s, 4326)),
+            3)) from sbw
+        WHERE status = 'NEW' and phenomena = ANY(%s)
+        and issue > coalesce(to_timestamp(%s), %s::timestamptz)
+        and geom && ST_MakeEnvelope(%s, %s, %s, %s, 4326)
+    """, bucket_envelope(key) + (SBW_PHENOMENA,
+                                 cell['through'], SBW_START) +
+                   bucket_envelope(key))
+    changed = False
+    for row in cursor:
+        rings = to_rings(row[-1])
+        evkey = sbw_evkey(row[:-1])
+        if rings and evkey not in cell['polygons']:
+            cell['polygons'][evkey] = (tuple(row[:-1]), get_bbox(rings),
+                                       rings)
+            changed = True
+    # save when there is something new, or now and then to move the
+    # start of the next lookup forward
+    if (changed or cell['through'] is None or
+            (through - cell['through']) > SBW_MAXAGE):
+        _save(fn, {'through': through}, list(cell['polygons'].values()))
+    return sorted([attrs for (attrs, bbox, rings) in cell['polygons'].values()
+                   if contains(bbox, rings, lon, lat)])
+
+
+def test_contains():
+    """Do we handle holes and the outside?"""
+    outer = np.array([[0, 0], [4, 0], [4, 4], [0, 4], [0, 0]], dtype='f8')
+    hole = np.array([[1, 1], [2, 1], [2, 2], [1, 2], [1, 1]], dtype='f8')
+    rings = [outer, hole]
+    bbox = get_bbox(rings)
+    assert contains(bbox, rings, 3, 3)
+    assert not contains(bbox, rings, 1.5, 1.5)
+    assert not contains(bbox, rings, 5, 1)
+    assert bucket_key(-93.6, 41.99) == (-94, 41)
+    assert bucket_envelope((-94, 41)) == (-94., 41., -93., 42.)
+
+
+def test_cell(tmpdir):
+    """Can we save and load a cell?"""
+    global CACHEDIR
+    olddir = CACHEDIR
+    CACHEDIR = str(tmpdir)
+    try:
+        fn = _cellfn("sbw", (-94, 41))
+        rings = to_rings(json.dumps({
+            'type': 'MultiPolygon',
+            'coordinates': [[[[0, 0], [4, 0], [4, 4], [0, 0]],
+                             [[1, 1], [2, 1], [2, 2], [1, 1]]],
+                            [[[5, 5], [6, 5], [6, 6], [5, 5]]]]}))
+        attrs = ('2018-05-01T12:00Z', '2018-05-01T13:00Z', 12, 'TO', 'W',
+                 'DMX')
+        polygons = [(attrs, get_bbox(rings), rings),
+                    (('a', ), get_bbox(rings[2:]), rings[2:])]
+        _save(fn, {'through': 1.5}, polygons)
+        (meta, polygons) = _load(fn)
+        assert meta == {'through': 1.5}
+        assert [p[0] for p in polygons] == [attrs, ('a', )]
+        assert polygons[0][1] == (0, 0, 6, 6)
+        assert len(polygons[0][2]) == 3
+        assert np.array_equal(polygons[1][2][0], rings[2])
+        assert sbw_evkey(attrs) == ('2018', 'DMX', 'TO', 'W', 12)
+    finally:
+        CACHEDIR = olddir
@@ -0,0 +1,127 @@
+"""Read point time series spanning our yearly netCDF archives.
+
+Our daily archives are stored one file per year, so a point history over many
+years needs a read from each yearly file.  Here each yearly file is opened
+once and every requested variable is read for all of the requested days and
+points with one slice per variable.
+
+    i, j = get_iemre_locator().find([lon], [lat])
+    data = read_daily(iemre.get_daily_ncname, ['high_tmpk', 'p01d'],
+                      datetime.date(1990, 1, 1), datetime.date(2017, 12, 31),
+                      i, j)
+
+The yearly files are laid out for whole grid writes, so reading one point
+touches every chunk.  `scripts/iemre/rechunk.py` maintains a time-major copy
+alongside each yearly file (ie 2018_iemre_daily_tm.nc) and `open_series()`
+reads from it when the copy covers the requested time steps.  Scripts
+rewriting time steps of a yearly file call `mark_rewritten()`, so that the
+copy is no longer trusted for them until rechunk.py copies them again.
+"""
+import os
+import datetime
+
+import numpy as np
+from pyiem.util import ncopen
+
+from gridlocator import sample
+
+
+def get_mirror_ncname(ncfn):
+    """Return the filename of the time-major copy of a netCDF file"""
+    return ncfn[:-3] + "_tm.nc" if ncfn.endswith(".nc") else ncfn + "_tm"
+
+
+def mark_rewritten(ncfn, t0):
+    """Note that time steps from t0 on of a yearly file were written
+
+    The time-major copy's `valid_through` is lowered to t0 when it was
+    beyond, so readers use the yearly file for those time steps.
+    """
+    mirror = get_mirror_ncname(ncfn)
+    if not os.path.isfile(mirror):
+        return
+    nc = ncopen(mirror, 'a', timeout=300)
+    if nc is None:
+        return
+    if t0 < int(getattr(nc, 'valid_through', 0)):
+        nc.valid_through = t0
+    nc.close()
+
+
+def open_series(ncfn, tslice):
+    """Open a netCDF file for reading time series
+
+    Args:
+      ncfn (str): the yearly netCDF file
+      tslice (slice): the time steps needed
+
+    Returns:
+      netCDF4 dataset, the time-major copy when it is in sync through the
+      end of the time slice
+    """
+    mirror = get_mirror_ncname(ncfn)
+    if os.path.isfile(mirror):
+        nc = ncopen(mirror)
+        if nc is not None:
+            if tslice.stop <= getattr(nc, 'valid_through', 0):
+                return nc
+            nc.close()
+    return ncopen(ncfn)
+
+
+def year_ranges(sts, ets):
+    """Split an inclusive date range into yearly pieces
+
+    Returns:
+      list of (year, first date, last date) tuples
+    """
+    res = []
+    for year in range(sts.year, ets.year + 1):
+        ys = max(sts, datetime.date(year, 1, 1))
+        ye = min(ets, datetime.date(year, 12, 31))
+        res.append((year, ys, ye))
+    return res
+
+
+def read_daily(ncname, varnames, sts, ets, i, j, minyear=None):
+    """Read daily variables for points over an inclusive date range
+
+    Args:
+      ncname (callable): year -> netCDF filename
+      varnames (list): variables to read, all with (time, y, x) dimensions
+      sts, ets (date): inclusive date range
+      i, j (arrays): grid indices of the points
+      minyear (int, optional): years prior to this are not attempted
+
+    Returns:
+      dict of varname -> masked array of (days, points), masked where the
+      data is missing or the yearly file does not exist
+    """
+    i = np.atleast_1d(i)
+    j = np.atleast_1d(j)
+    pieces = dict((v, []) for v in varnames)
+    for (year, ys, ye) in year_ranges(sts, ets):
+        days = (ye - ys).days + 1
+        fn = ncname(year)
+        if (minyear is not None and year < minyear) or not os.path.isfile(fn):
+            for v in varnames:
+                pieces[v].append(np.ma.masked_all((days, len(i))))
+            continue
+        # day of year offset, as iemre.daily_offset does
+        offset = (ys - datetime.date(year, 1, 1)).days
+        tslice = slice(offset, offset + days)
+        nc = open_series(fn, tslice)
+        for v in varnames:
+            pieces[v].append(sample(nc, v, tslice, i, j))
+        nc.close()
+    return dict((v, np.ma.concatenate(pieces[v], axis=0)) for v in varnames)
+
+
+def test_year_ranges():
+    """Do we split up ranges properly?"""
+    res = year_ranges(datetime.date(2016, 12, 30), datetime.date(2018, 1, 2))
+    assert len(res) == 3
+    assert res[0] == (2016, datetime.date(2016, 12, 30),
+                      datetime.date(2016, 12, 31))
+    assert res[1][2] == datetime.date(2017, 12, 31)
+    assert res[2][2] == datetime.date(2018, 1, 2)
@@ -0,0 +1,208 @@
+"""Running total (prefix sum) companions of our daily precipitation grids.
+
+Totaling precipitation over a period means reading every daily grid within
+it, so a 180 day departure map reads 360 grids from the yearly and the
+climatology files.  Here each daily precipitation variable of a yearly or
+climatology file (ie p01d) gets a companion variable (ie p01d_cumsum) holding
+the running total since the first time step, so the total for any period is
+the difference of two grids.
+
+    nc = ncopen(ncfn, 'a')
+    nc.variables['p01d'][offset] = grid
+    update_cumsum(nc, 'p01d', offset)
+
+    total = period_total(nc, 'p01d', idx0, idx1, jslice, islice)
+
+Every script writing one of these variables must call `update_cumsum()`
+after writing a grid.  The companion's `valid_through` attribute records how
+many leading time steps are summed, `period_total()` trusts the running
+totals before it and falls back to summing the daily grids for periods
+beyond that.  Missing values are taken as zero, a running total is only
+missing where no time step through it has data.
+"""
+import numpy as np
+
+# daily precipitation variables having a running total companion
+VARNAMES = ['p01d', 'p01d_12z', 'ppt']
+# number of daily grids read at once when summing them
+CHUNK = 10
+
+
+def get_cumsum_varname(ncvar):
+    """The name of the running total companion of a variable"""
+    return ncvar + "_cumsum"
+
+
+def get_valid_through(nc, ncvar):
+    """The number of leading time steps summed in the companion, 0 if none"""
+    csvar = get_cumsum_varname(ncvar)
+    if csvar not in nc.variables:
+        return 0
+    return int(getattr(nc.variables[csvar], 'valid_through', 0))
+
+
+def create_cumsum(nc, ncvar):
+    """Create the running total companion of a variable"""
+    var = nc.variables[ncvar]
+    kwargs = {}
+    chunking = var.chunking()
+    if chunking != 'contiguous':
+        kwargs['chunksizes'] = chunking
+    csvar = nc.createVariable(get_cumsum_varname(ncvar), np.float32,
+                              var.dimensions, fill_value=1.e20, **kwargs)
+    csvar.units = var.units
+    csvar.long_name = "%s Running Total" % (getattr(var, 'long_name',
+                                                    ncvar), )
+    csvar.description = ("Running total of %s since the first time step"
+                         ) % (ncvar, )
+    csvar.coordinates = "lon lat"
+    csvar.valid_through = 0
+    return csvar
+
+
+def update_cumsum(nc, ncvar, t0, t1=None):
+    """Bring the running total up to date after time steps were written
+
+    Args:
+      nc: netCDF4 dataset opened for writing
+      ncvar (str): the daily precipitation variable
+      t0 (int): the first time step written
+      t1 (int, optional): one past the last time step written, defaults to
+        t0 + 1
+
+    The running totals from the earlier of t0 and the companion's
+    valid_through are recomputed through the later of t1 and valid_through.
+    """
+    t1 = t0 + 1 if t1 is None else t1
+    csname = get_cumsum_varname(ncvar)
+    if csname not in nc.variables:
+        create_cumsum(nc, ncvar)
+    var = nc.variables[ncvar]
+    csvar = nc.variables[csname]
+    valid_through = int(getattr(csvar, 'valid_through', 0))
+    start = min(t0, valid_through)
+    end = min(max(t1, valid_through), var.shape[0])
+    if start > 0:
+        base = np.ma.asarray(csvar[start - 1])
+        running = base.filled(0).astype(np.float64)
+        seen = ~np.ma.getmaskarray(base)
+    else:
+        running = np.zeros(var.shape[1:], np.float64)
+        seen = np.zeros(var.shape[1:], bool)
+    for i in range(start, end, CHUNK):
+        i2 = min(i + CHUNK, end)
+        data = np.ma.asarray(var[i:i2])
+        out = np.ma.masked_all(data.shape, np.float32)
+        for k in range(data.shape[0]):
+            running += data[k].filled(0)
+            seen |= ~np.ma.getmaskarray(data[k])
+            out[k] = np.ma.array(running, mask=~seen)
+        csvar[i:i2] = out
+    csvar.valid_through = max(end, valid_through)
+
+
+def sum_grids(var, t0, t1, jslice, islice):
+    """Sum the daily grids of time steps [t0, t1), a few at a time"""
+    total = None
+    for i in range(t0, t1, CHUNK):
+        i2 = min(i + CHUNK, t1)
+        part = np.sum(var[i:i2, jslice, islice], 0)
+        total = part if total is None else total + part
+    return total
+
+
+def period_total(nc, ncvar, t0, t1, jslice=slice(None), islice=slice(None)):
+    """Total of a daily precipitation variable over time steps [t0, t1)
+
+    Args:
+      nc: netCDF4 dataset
+      ncvar (str): the daily precipitation variable
+      t0, t1 (int): the time steps, t1 exclusive
+      jslice, islice (slice, optional): the portion of the grid wanted
+
+    Returns:
+      masked array of the total, in the variable's units
+    """
+    if t1 <= get_valid_through(nc, ncvar):
+        csvar = nc.variables[get_cumsum_varname(ncvar)]
+        total = csvar[t1 - 1, jslice, islice]
+        if t0 > 0:
+            total = total - csvar[t0 - 1, jslice, islice]
+        return total
+    return sum_grids(nc.variables[ncvar], t0, t1, jslice, islice)
+
+
+def trailing_totals(nc, ncvar, t, days, jslice=slice(None),
+                    islice=slice(None)):
+    """Totals of time steps [t - i, t] for each i in [0, days)
+
+    Returns:
+      masked array with a leading dimension of days, or of t + 1 when the
+      file does not have that many time steps prior to t
+    """
+    t0 = max(t - days + 1, 0)
+    if t < get_valid_through(nc, ncvar):
+        csvar = nc.variables[get_cumsum_varname(ncvar)]
+        block = csvar[max(t0 - 1, 0):t + 1, jslice, islice]
+        if t0 == 0:
+            block = np.ma.concatenate([np.ma.zeros((1, ) + block.shape[1:]),
+                                       block])
+        return (block[-1] - block[:-1])[::-1]
+    return np.ma.cumsum(nc.variables[ncvar][t0:t + 1, jslice, islice][::-1],
+                        axis=0)
+
+
+def test_update_cumsum():
+    """Do our running totals match summing the grids?"""
+
+    class FakeVar(object):
+        """Enough of a netCDF4 variable"""
+
+        def __init__(self, data):
+            self.data = data
+            self.shape = data.shape
+
+        def __getitem__(self, idx):
+            return self.data[idx]
+
+        def __setitem__(self, idx, value):
+            self.data[idx] = value
+
+    class FakeNC(object):
+        """Enough of a netCDF4 dataset"""
+
+        def __init__(self):
+            self.variables = {}
+
+    data = np.ma.array(np.arange(60, dtype='f').reshape(15, 2, 2))
+    data[:, 0, 0] = np.ma.masked
+    data[3, 1, 1] = np.ma.masked
+    nc = FakeNC()
+    nc.variables['p01d'] = FakeVar(data)
+    nc.variables['p01d_cumsum'] = FakeVar(np.ma.masked_all((15, 2, 2)))
+    update_cumsum(nc, 'p01d', 0, 12)
+    assert get_valid_through(nc, 'p01d') == 12
+    # a rewrite of an earlier step carries through to the later ones
+    data[2, 1] = 100.
+    update_cumsum(nc, 'p01d', 2)
+    assert get_valid_through(nc, 'p01d') == 12
+    for (t0, t1) in [(0, 12), (2, 5), (11, 12)]:
+        total = period_total(nc, 'p01d', t0, t1)
+        expected = sum_grids(nc.variables['p01d'], t0, t1, slice(None),
+                             slice(None))
+        assert np.ma.is_masked(total[0, 0])
+        assert np.allclose(total[1:, 1:], expected[1:, 1:])
+    for t0 in [0, 2]:
+        totals = trailing_totals(nc, 'p01d', 6, 7 - t0)
+        assert np.allclose(totals[-1], period_total(nc, 'p01d', t0, 7))
+        assert np.allclose(totals[0], data[6])
+    # more days than the file has prior to t
+    totals = trailing_totals(nc, 'p01d', 5, 90)
+    assert totals.shape == (6, 2, 2)
+    assert np.allclose(totals[-1], period_total(nc, 'p01d', 0, 6))
+    totals = trailing_totals(nc, 'p01d', 13, 90)
+    assert totals.shape == (14, 2, 2)
+    assert np.allclose(totals[-1, 1, 0], np.sum(data[:14, 1, 0]))
+    # beyond valid_through we sum the grids
+    assert np.allclose(period_total(nc, 'p01d', 10, 15)[1, 1],
+                       np.sum(data[10:15, 1, 1]))
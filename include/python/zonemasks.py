@@ -0,0 +1,238 @@
+"""Precomputed grid masks of our state, climate district and county polygons.
+
+`pyiem.grid.zs.CachingZonalStats` rasterizes the polygons, fetched from
+PostGIS, each time it is used, while the masks only depend upon the grid and
+the polygons.  Here the masks for a grid affine, grid shape and set of
+polygons are computed once and saved to CACHEDIR as the indices of the grid
+cells within each polygon, which later processes memory map.
+
+    zm = get_zonemasks(iemre.AFFINE, (ny, nx), 'states')
+    averages = zm.gen_stats(np.flipud(grid), ['IA', 'MN'])
+    nav = zm.gridnav('IA')
+
+As with CachingZonalStats, (0, 0) of the grids is the upper left, so our
+lower left origin grids need a `np.flipud`.  The key of the masks includes a
+signature of the polygons' table (see GEOMSIGS), so they are rebuilt after
+the polygons change.
+"""
+import os
+import time
+import shutil
+import hashlib
+import tempfile
+from collections import namedtuple
+
+import numpy as np
+from cachedir import get_cachedir
+
+CACHEDIR = get_cachedir("zonemasks")
+# set name -> query for the id and geometry of its polygons
+GEOMSETS = {
+    'states': "SELECT state_abbr as id, the_geom as geom from states",
+    'climdiv': "SELECT iemid as id, geom from climdiv",
+    'counties': """
+        SELECT ugc as id, geom from ugcs
+        WHERE substr(ugc, 3, 1) = 'C' and end_ts is null
+    """,
+}
+# set name -> query for something that changes when its polygons do
+GEOMSIGS = {
+    'states': "SELECT count(*), sum(ST_NPoints(the_geom)) from states",
+    'climdiv': "SELECT count(*), sum(ST_NPoints(geom)) from climdiv",
+    'counties': """
+        SELECT count(*), max(gid), max(coalesce(end_ts, begin_ts)) from ugcs
+        WHERE substr(ugc, 3, 1) = 'C'
+    """,
+}
+# seconds a process keeps using a set's signature
+SIG_MAXAGE = 3600
+# as pyiem.grid.zs, the mask is True outside of the polygon
+GRIDINFO = namedtuple("GridInfo", ["x0", "y0", "xsz", "ysz", "mask"])
+# Per process cache of key -> ZoneMasks
+_ZONEMASKS = {}
+# Per process cache of set name -> (time, signature)
+_SIGNATURES = {}
+
+
+class ZoneMasks(object):
+    """The grid cells within each polygon of a set."""
+
+    def __init__(self, ids, navs, offsets, cells):
+        """Constructor
+
+        Args:
+          ids (array): the polygon ids
+          navs (array): (x0, y0, xsz, ysz) window of each polygon, -1 for
+            polygons off of the grid
+          offsets (array): polygon i's cells are cells[offsets[i]:
+            offsets[i + 1]]
+          cells (array): flattened indices of the cells within each window
+        """
+        self.ids = [str(fid) for fid in ids]
+        self.index = dict((fid, i) for i, fid in enumerate(self.ids))
+        self.navs = navs
+        self.offsets = offsets
+        self.cells = cells
+
+    def _cells(self, idx):
+        """The indices of polygon idx's cells within its window"""
+        return self.cells[self.offsets[idx]:self.offsets[idx + 1]]
+
+    def gridnav(self, fid):
+        """The window and mask of a polygon, as CachingZonalStats.gridnav
+
+        Returns:
+          GRIDINFO or None if the polygon is off of the grid or unknown
+        """
+        idx = self.index.get(fid)
+        if idx is None or self.navs[idx][2] < 0:
+            return None
+        (x0, y0, xsz, ysz) = [int(v) for v in self.navs[idx]]
+        mask = np.ones(ysz * xsz, bool)
+        mask[self._cells(idx)] = False
+        return GRIDINFO(x0=x0, y0=y0, xsz=xsz, ysz=ysz,
+                        mask=mask.reshape((ysz, xsz)))
+
+    def grid_mask(self, fid, shape):
+        """A grid of shape that is True within the polygon"""
+        res = np.zeros(shape, bool)
+        nav = self.gridnav(fid)
+        if nav is not None:
+            res[nav.y0:nav.y0 + nav.ysz, nav.x0:nav.x0 + nav.xsz] = ~nav.mask
+        return res
+
+    def gen_stats(self, grid, fids=None, stat=np.ma.mean):
+        """Compute a statistic of the grid within polygons
+
+        Args:
+          grid (array): the grid, upper left origin
+          fids (list, optional): the polygon ids, defaults to all of them
+          stat (function): computed over the masked values within a polygon
+
+        Returns:
+          list of the statistic in the order of fids, None for polygons off
+          of the grid
+        """
+        fids = self.ids if fids is None else fids
+        res = []
+        for fid in fids:
+            idx = self.index.get(fid)
+            if idx is None or self.navs[idx][2] < 0:
+                res.append(None)
+                continue
+            (x0, y0, xsz, ysz) = self.navs[idx]
+            cells = self._cells(idx)
+            if cells.size == 0:
+                res.append(np.ma.masked)
+                continue
+            window = np.ma.asarray(grid[y0:y0 + ysz, x0:x0 + xsz])
+            res.append(stat(window.ravel()[cells]))
+        return res
+
+
+def pack(ids, gridnav):
+    """Convert CachingZonalStats.gridnav into our arrays"""
+    navs = np.full((len(ids), 4), -1, np.int32)
+    offsets = np.zeros(len(ids) + 1, np.int64)
+    cells = []
+    for i, nav in enumerate(gridnav):
+        inside = np.zeros(0, np.int32)
+        if nav is not None:
+            navs[i] = (nav.x0, nav.y0, nav.xsz, nav.ysz)
+            inside = np.flatnonzero(~np.asarray(nav.mask)).astype(np.int32)
+        cells.append(inside)
+        offsets[i + 1] = offsets[i] + inside.size
+    return (np.array(ids, dtype='U'), navs, offsets,
+            np.concatenate(cells) if cells else np.zeros(0, np.int32))
+
+
+def compute(affine, shape, geomset):
+    """Rasterize the polygons of a set, the slow way"""
+    import geopandas as gpd
+    from pyiem.grid.zs import CachingZonalStats
+    from pyiem.util import get_dbconn
+    df = gpd.GeoDataFrame.from_postgis(GEOMSETS[geomset],
+                                       get_dbconn('postgis'),
+                                       index_col='id', geom_col='geom')
+    czs = CachingZonalStats(affine)
+    czs.compute_gridnav(df['geom'], np.zeros(shape))
+    return pack(list(df.index.values), czs.gridnav)
+
+
+def get_signature(geomset):
+    """Something that changes when the polygons of a set do"""
+    now = time.time()
+    if geomset in _SIGNATURES and _SIGNATURES[geomset][0] > now - SIG_MAXAGE:
+        return _SIGNATURES[geomset][1]
+    from pyiem.util import get_dbconn
+    pgconn = get_dbconn('postgis')
+    cursor = pgconn.cursor()
+    cursor.execute(GEOMSIGS[geomset])
+    signature = ["%s" % (val, ) for val in cursor.fetchone()]
+    pgconn.close()
+    _SIGNATURES[geomset] = (now, signature)
+    return signature
+
+
+def zone_key(affine, shape, geomset, signature):
+    """Compute a key identifying the masks"""
+    parts = [tuple(affine)[:6], tuple(shape), geomset, list(signature)]
+    return hashlib.md5(repr(parts).encode('utf-8')).hexdigest()
+
+
+def get_zonemasks(affine, shape, geomset):
+    """Get the masks of a set of polygons for a grid
+
+    Args:
+      affine (Affine): the grid's affine, upper left origin
+      shape (tuple): the grid's (ny, nx)
+      geomset (str): a key of GEOMSETS
+
+    Returns:
+      ZoneMasks, cached within this process and saved to CACHEDIR for other
+      processes to memory map
+    """
+    key = zone_key(affine, shape, geomset, get_signature(geomset))
+    if key in _ZONEMASKS:
+        return _ZONEMASKS[key]
+    dirname = os.path.join(CACHEDIR or "", "%s_%s" % (geomset, key))
+    names = ['ids', 'navs', 'offsets', 'cells']
+    arrays = None
+    if CACHEDIR is not None and os.path.isdir(dirname):
+        try:
+            arrays = [np.load(os.path.join(dirname, "%s.npy" % (name, )),
+                              mmap_mode='r') for name in names]
+        except (IOError, OSError, ValueError):
+            arrays = None
+    if arrays is None:
+        arrays = compute(affine, shape, geomset)
+    if CACHEDIR is not None and not os.path.isdir(dirname):
+        tmpdir = None
+        try:
+            tmpdir = tempfile.mkdtemp(dir=CACHEDIR)
+            # shared by the web server and our scripts
+            os.chmod(tmpdir, 0o755)
+            for name, arr in zip(names, arrays):
+                np.save(os.path.join(tmpdir, "%s.npy" % (name, )), arr)
+            os.rename(tmpdir, dirname)
+        except (IOError, OSError):
+            # likely another process saved it first
+            if tmpdir is not None:
+                shutil.rmtree(tmpdir, ignore_errors=True)
+    _ZONEMASKS[key] = ZoneMasks(*arrays)
+    return _ZONEMASKS[key]
+
+
+def test_zonemasks():
+    """Do we match a masked array mean?"""
+    mask = np.array([[True, False, False], [False, False, True]])
+    nav = GRIDINFO(x0=1, y0=2, xsz=3, ysz=2, mask=mask)
+    zm = ZoneMasks(*pack(['IA', 'MN'], [nav, None]))
+    grid = np.arange(30.).reshape(5, 6)
+    expected = np.ma.array(grid[2:4, 1:4], mask=mask).mean()
+    assert zm.gen_stats(grid) == [expected, None]
+    assert np.array_equal(zm.gridnav('IA').mask, mask)
+    assert zm.gridnav('MN') is None
+    assert zm.grid_mask('IA', grid.shape).sum() == 4
+    key = zone_key(range(6), (5, 6), 'states', ['50', '1000'])
+    assert key != zone_key(range(6), (5, 6), 'states', ['50', '1001'])
@@ -11,7 +11,8 @@ def main():
     cursor = pgconn.cursor()
     cursor.execute("""
         select count(*), avg(timing) from autoplot_timing
-        where valid > now() - '4 hours'::interval
+        where valid > now() - '4 hours'::interval and
+        coalesce(cache, 'miss') in ('miss', 'bypass')
     """)
     (count, speed) = cursor.fetchone()
     speed = 0 if speed is None else speed
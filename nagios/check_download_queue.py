@@ -0,0 +1,47 @@
+"""Report download service admission pools, see cgi-bin/request/admission.py
+
+Must run on the webfarm node being checked, as the pools are host local.
+"""
+from __future__ import print_function
+import os
+import sys
+import fcntl
+
+BASEDIR = "/tmp/iem_admission"
+
+
+def count_locked(dirname, prefix=''):
+    """Count the files within a directory that are held by somebody."""
+    if not os.path.isdir(dirname):
+        return 0
+    count = 0
+    for fn in os.listdir(dirname):
+        if not fn.startswith(prefix):
+            continue
+        with open(os.path.join(dirname, fn), 'a') as fh:
+            try:
+                fcntl.flock(fh, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                fcntl.flock(fh, fcntl.LOCK_UN)
+            except (IOError, OSError):
+                count += 1
+    return count
+
+
+def main():
+    """Go Main Go"""
+    pools = sorted(os.listdir(BASEDIR)) if os.path.isdir(BASEDIR) else []
+    msg = []
+    perf = []
+    for pool in pools:
+        active = count_locked(os.path.join(BASEDIR, pool), 'slot')
+        queued = count_locked(os.path.join(BASEDIR, pool, 'queue'))
+        msg.append("%s %s/%s" % (pool, active, queued))
+        perf.append("%s_active=%s;; %s_queue=%s;;" % (pool, active, pool,
+                                                      queued))
+    print("Download active/queued %s | %s" % (", ".join(msg),
+                                              " ".join(perf)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
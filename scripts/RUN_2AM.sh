@@ -39,6 +39,7 @@ fi
 
 cd ../cache
 python warn_cache.py &
+python prune_tilecache.py &
 
 cd ../dbutil
 python clean_afos.py
@@ -21,3 +21,8 @@ python prism_adjust_stage4.py $(date --date '3 days ago' +'%Y %m %d')
 # Since we have now adjusted the 12z precip 3 days ago, we should rerun
 # iemre for four days ago
 python daily_analysis.py $(date --date '4 days ago' +'%Y %m %d')
+
+# Sync the time-major copies used by the point services
+for KIND in daily hourly stage4 mrms prism; do
+	python rechunk.py $KIND
+done
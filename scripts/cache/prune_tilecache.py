@@ -0,0 +1,34 @@
+"""Prune the least recently used tiles of the TileCache disk cache
+
+The Disk (and Tiered) TileCache caches only ever add tiles, so this removes
+the least recently used ones once the cache grows past its `max_size`.
+
+    python prune_tilecache.py [path to tilecache.cfg]
+
+This is a cron job from RUN_2AM.sh
+"""
+from __future__ import print_function
+import sys
+
+sys.path.insert(0, "../../include/python")
+from TileCache.Service import Service  # noqa
+
+CONFIG = "../../htdocs/c/tilecache.cfg"
+
+
+def main(argv):
+    """Go Main Go"""
+    service = Service.load(argv[1] if len(argv) > 1 else CONFIG)
+    if 'exception' in service.metadata:
+        print("prune_tilecache config error: %s" % (
+            service.metadata['exception'], ))
+        return
+    # the disk level of a Tiered cache
+    cache = getattr(service.cache, 'disk', service.cache)
+    if not hasattr(cache, 'prune'):
+        return
+    cache.prune()
+
+
+if __name__ == '__main__':
+    main(sys.argv)
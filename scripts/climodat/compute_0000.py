@@ -5,14 +5,17 @@ import datetime
 import warnings
 
 import numpy as np
-import geopandas as gpd
 from pyiem import iemre
-from pyiem.grid.zs import CachingZonalStats
 from pyiem.datatypes import temperature, distance
 from pyiem.util import get_dbconn, ncopen
 
+sys.path.insert(0, "../../include/python")
+from zonemasks import get_zonemasks  # noqa
+
 warnings.filterwarnings('ignore', category=FutureWarning)
 COOP = get_dbconn("coop")
+# states and their climate districts we do not compute
+SKIP_STATES = ['AK', 'HI', 'DC']
 ccursor = COOP.cursor()
 
 
@@ -63,20 +66,16 @@ def do_day(valid):
     nc.close()
 
     # build out the state mappers
-    pgconn = get_dbconn('postgis')
-    states = gpd.GeoDataFrame.from_postgis("""
-    SELECT the_geom, state_abbr from states
-    where state_abbr not in ('AK', 'HI', 'DC')
-    """, pgconn, index_col='state_abbr', geom_col='the_geom')
-    czs = CachingZonalStats(iemre.AFFINE)
-    sthigh = czs.gen_stats(np.flipud(high), states['the_geom'])
-    stlow = czs.gen_stats(np.flipud(low), states['the_geom'])
-    stprecip = czs.gen_stats(np.flipud(precip), states['the_geom'])
-    stsnow = czs.gen_stats(np.flipud(snow), states['the_geom'])
-    stsnowd = czs.gen_stats(np.flipud(snowd), states['the_geom'])
+    zm = get_zonemasks(iemre.AFFINE, high.shape, 'states')
+    states = [fid for fid in zm.ids if fid not in SKIP_STATES]
+    sthigh = zm.gen_stats(np.flipud(high), states)
+    stlow = zm.gen_stats(np.flipud(low), states)
+    stprecip = zm.gen_stats(np.flipud(precip), states)
+    stsnow = zm.gen_stats(np.flipud(snow), states)
+    stsnowd = zm.gen_stats(np.flipud(snowd), states)
 
     statedata = {}
-    for i, state in enumerate(states.index.values):
+    for i, state in enumerate(states):
         statedata[state] = dict(
             high=sthigh[i],
             low=stlow[i],
@@ -87,18 +86,15 @@ def do_day(valid):
         update_database(state+"0000", valid, statedata[state])
 
     # build out climate division mappers
-    climdiv = gpd.GeoDataFrame.from_postgis("""
-    SELECT geom, iemid from climdiv
-    where st_abbrv not in ('AK', 'HI', 'DC')
-    """, pgconn, index_col='iemid', geom_col='geom')
-    czs = CachingZonalStats(iemre.AFFINE)
-    sthigh = czs.gen_stats(np.flipud(high), climdiv['geom'])
-    stlow = czs.gen_stats(np.flipud(low), climdiv['geom'])
-    stprecip = czs.gen_stats(np.flipud(precip), climdiv['geom'])
-    stsnow = czs.gen_stats(np.flipud(snow), climdiv['geom'])
-    stsnowd = czs.gen_stats(np.flipud(snowd), climdiv['geom'])
-
-    for i, iemid in enumerate(climdiv.index.values):
+    zm = get_zonemasks(iemre.AFFINE, high.shape, 'climdiv')
+    climdiv = [fid for fid in zm.ids if fid[:2] not in SKIP_STATES]
+    sthigh = zm.gen_stats(np.flipud(high), climdiv)
+    stlow = zm.gen_stats(np.flipud(low), climdiv)
+    stprecip = zm.gen_stats(np.flipud(precip), climdiv)
+    stsnow = zm.gen_stats(np.flipud(snow), climdiv)
+    stsnowd = zm.gen_stats(np.flipud(snowd), climdiv)
+
+    for i, iemid in enumerate(climdiv):
         row = dict(
             high=sthigh[i],
             low=stlow[i],
@@ -5,29 +5,35 @@ from pandas.io.sql import read_sql
 from pyiem.util import get_dbconn
 
 PGCONN = get_dbconn('coop', user='nobody')
+# absolute z-score within a state's day above which a value is suspect
+THRESHOLD = 4
 
 
 def do(state, vname):
     """do"""
     network = "%sCLIMATE" % (state,)
     table = "alldata_%s" % (state,)
+    # the per day statistics are computed by the database, which only sends
+    # back the outliers
     df = read_sql("""
     WITH mystations as (
     SELECT id from stations where network = %s and
     (temp24_hour is null or temp24_hour between 4 and 9) and
     substr(id, 3, 1) != 'C' and substr(id, 3, 4) != '0000'),
-    stats as (
-    SELECT day, avg("""+vname+"""), stddev("""+vname+""") from
-    """ + table + """ o JOIN mystations t on (o.station = t.id) GROUP by day),
     agg as (
-    SELECT o.day, abs((o."""+vname+"""- s.avg) / s.stddev) as zscore,
-    o."""+vname+""", s.avg, s.stddev, o.station from """ + table + """ o,
-    mystations t, stats s WHERE
-    o.day = s.day and t.id = o.station)
-
-    SELECT * from agg where zscore > 4 ORDER by day
-    """, PGCONN, params=(network, ), index_col=None)
+    SELECT o.day, o.station, o.""" + vname + """,
+    avg(o.""" + vname + """) OVER w as avg,
+    stddev(o.""" + vname + """) OVER w as stddev from """ + table + """ o
+    JOIN mystations t on (o.station = t.id)
+    WHERE o.""" + vname + """ is not null WINDOW w as (PARTITION by day))
+
+    SELECT day, abs((""" + vname + """ - avg) / stddev) as zscore,
+    """ + vname + """, avg, stddev, station from agg
+    WHERE stddev > 0 and abs(""" + vname + """ - avg) > %s * stddev
+    ORDER by day
+    """, PGCONN, params=(network, THRESHOLD), index_col=None)
     print(df.groupby('day').count())
+    return df
 
 
 def main(argv):
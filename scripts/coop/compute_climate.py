@@ -1,9 +1,16 @@
-"""Computes the Climatology and fills out the table!"""
+"""Computes the Climatology and fills out the table!
+
+    python compute_climate.py [incremental]
+
+By default, each state's rows are deleted and recomputed.  With `incremental`,
+the averages are computed into a temp table and only the station/dates whose
+values changed, ie with new or corrected observations, are updated and have
+their record years recomputed.
+"""
 from __future__ import print_function
+import sys
 import datetime
-import psycopg2.extras
 
-from tqdm import tqdm
 from pyiem.reference import state_names
 from pyiem.network import Table as NetworkTable
 from pyiem.util import get_dbconn
@@ -21,22 +28,23 @@ META = {
     'climate81': {'sts': datetime.datetime(1981, 1, 1),
                   'ets': datetime.datetime(2011, 1, 1)}
 }
+# The computed columns of the climate tables
+COLS = ['high', 'low', 'max_high', 'min_high', 'max_low', 'min_low',
+        'max_precip', 'precip', 'snow', 'years', 'gdd32', 'gdd41', 'gdd46',
+        'gdd48', 'gdd50', 'gdd51', 'gdd52', 'sdd86', 'hdd65', 'cdd65',
+        'max_range', 'min_range', 'srad']
+# record year column -> (alldata column, climate column) it is the year of
+YEARCOLS = [('max_high_yr', 'high', 'max_high'),
+            ('min_high_yr', 'high', 'min_high'),
+            ('max_low_yr', 'low', 'max_low'),
+            ('min_low_yr', 'low', 'min_low'),
+            ('max_precip_yr', 'precip', 'max_precip')]
 
 
-def daily_averages(table):
-    """
-    Compute and Save the simple daily averages
-    """
-    for st in state_names:
-        if st in ['DC', 'AK', 'HI']:
-            continue
-        nt = NetworkTable("%sCLIMATE" % (st,))
-        print('Computing Daily Averages for state: %s' % (st,))
-        ccursor = COOP.cursor()
-        ccursor.execute("""DELETE from %s WHERE substr(station, 1, 2) = '%s'
-        """ % (table, st))
-        print('    removed %s rows from %s' % (ccursor.rowcount, table))
-        sql = """
+def averages_sql(table, intotable, st):
+    """The INSERT of the daily averages for a state into a table"""
+    nt = NetworkTable("%sCLIMATE" % (st,))
+    return """
     INSERT into %s (station, valid, high, low,
         max_high, min_high,
         max_low, min_low,
@@ -67,78 +75,111 @@ def daily_averages(table):
     precip is not null and high is not null and low is not null
     and station in %s
     GROUP by d, station)
-        """ % (table, st, META[table]['sts'].strftime("%Y-%m-%d"),
-               META[table]['ets'].strftime("%Y-%m-%d"), tuple(nt.sts.keys()))
-        ccursor.execute(sql)
-        print('    added %s rows to %s' % (ccursor.rowcount, table))
-        ccursor.close()
-        COOP.commit()
-
-
-def do_date(ccursor2, table, row, col, agg_col):
-    """Process date"""
-    sql = """
-    SELECT year from alldata_%s where station = '%s' and %s = %s
-    and sday = '%s'
-    and day >= '%s' and day < '%s'
-    ORDER by year ASC
-    """ % (row['station'][:2], row['station'], col, row[agg_col],
-           row['valid'].strftime("%m%d"),
-           META[table]['sts'],
-           META[table]['ets'])
-    ccursor2.execute(sql)
-    row2 = ccursor2.fetchone()
-    if row2 is None:
-        print('None %s %s %s' % (row, col, agg_col))
-        return 'null'
-    return row2[0]
-
-
-def set_daily_extremes(table):
-    """Set the extremes on a given table"""
-    sql = """
-    SELECT * from %s WHERE max_high_yr is null and max_high is not null
-    and min_high_yr is null and min_high is not null
-    and max_low_yr is null and max_low is not null
-    and min_low_yr is null and min_low is not null
-    """ % (table,)
-    ccursor = COOP.cursor(cursor_factory=psycopg2.extras.DictCursor)
-    ccursor.execute(sql)
-    ccursor2 = COOP.cursor()
-    cnt = 0
-    total = ccursor.rowcount
-    for row in tqdm(ccursor, total=total):
-        data = {}
-        data['max_high_yr'] = do_date(ccursor2, table, row, 'high', 'max_high')
-        data['min_high_yr'] = do_date(ccursor2, table, row, 'high', 'min_high')
-        data['max_low_yr'] = do_date(ccursor2, table, row, 'low', 'max_low')
-        data['min_low_yr'] = do_date(ccursor2, table, row, 'low', 'min_low')
-        data['max_precip_yr'] = do_date(ccursor2, table, row,
-                                        'precip', 'max_precip')
-        ccursor2.execute("""
-            UPDATE %s SET max_high_yr = %s, min_high_yr = %s,
-            max_low_yr = %s, min_low_yr = %s, max_precip_yr = %s
-            WHERE station = '%s' and valid = '%s'
-        """ % (table, data['max_high_yr'],
-               data['min_high_yr'], data['max_low_yr'],
-               data['min_low_yr'], data['max_precip_yr'],
-               row['station'], row['valid']))
-        cnt += 1
-        if cnt % 1000 == 0:
-            ccursor2.close()
-            COOP.commit()
-            ccursor2 = COOP.cursor()
-    ccursor2.close()
+    """ % (intotable, st, META[table]['sts'].strftime("%Y-%m-%d"),
+           META[table]['ets'].strftime("%Y-%m-%d"), tuple(nt.sts.keys()))
+
+
+def daily_averages(table, st):
+    """
+    Compute and Save the simple daily averages
+    """
+    ccursor = COOP.cursor()
+    ccursor.execute("""DELETE from %s WHERE substr(station, 1, 2) = '%s'
+    """ % (table, st))
+    print('    removed %s rows from %s' % (ccursor.rowcount, table))
+    ccursor.execute(averages_sql(table, table, st))
+    print('    added %s rows to %s' % (ccursor.rowcount, table))
     ccursor.close()
-    COOP.commit()
 
 
-def main():
+def update_averages(table, st):
+    """
+    Update the daily averages that have changed, clearing their record years
+    """
+    ccursor = COOP.cursor()
+    ccursor.execute("""
+        CREATE TEMP TABLE climo_new (LIKE %s) ON COMMIT DROP
+    """ % (table, ))
+    ccursor.execute(averages_sql(table, 'climo_new', st))
+    ccursor.execute("""
+        DELETE from %s c WHERE substr(c.station, 1, 2) = '%s' and
+        not exists (SELECT 1 from climo_new n
+                    WHERE n.station = c.station and n.valid = c.valid)
+    """ % (table, st))
+    print('    removed %s rows from %s' % (ccursor.rowcount, table))
+    # comparing the new values, as stored, against the old
+    ccursor.execute("""
+        UPDATE %s c SET %s,
+        %s
+        FROM climo_new n WHERE c.station = n.station and c.valid = n.valid
+        and (%s) IS DISTINCT FROM (%s)
+    """ % (table, ", ".join(["%s = n.%s" % (col, col) for col in COLS]),
+           ", ".join(["%s = null" % (col, ) for col, _, _ in YEARCOLS]),
+           ", ".join(["c.%s" % (col, ) for col in COLS]),
+           ", ".join(["n.%s" % (col, ) for col in COLS])))
+    print('    updated %s rows of %s' % (ccursor.rowcount, table))
+    ccursor.execute("""
+        INSERT into %s SELECT n.* from climo_new n
+        LEFT JOIN %s c ON (n.station = c.station and n.valid = c.valid)
+        WHERE c.station is null
+    """ % (table, table))
+    print('    added %s rows to %s' % (ccursor.rowcount, table))
+    ccursor.close()
+
+
+def set_daily_extremes(table, st):
+    """Set the record years for a state's rows lacking them
+
+    The earliest year matching each extreme is found for all of the rows at
+    once, by joining the rows to their sday's observations.
+    """
+    ccursor = COOP.cursor()
+    ccursor.execute("""
+    WITH todo as (
+        SELECT station, valid, to_char(valid, 'mmdd') as sday, max_high,
+        min_high, max_low, min_low, max_precip from %s
+        WHERE substr(station, 1, 2) = '%s'
+        and max_high_yr is null and max_high is not null
+        and min_high_yr is null and min_high is not null
+        and max_low_yr is null and max_low is not null
+        and min_low_yr is null and min_low is not null
+    ), yrs as (
+        SELECT t.station, t.valid, %s
+        from todo t JOIN alldata_%s o ON
+            (o.station = t.station and o.sday = t.sday)
+        WHERE o.day >= '%s' and o.day < '%s'
+        GROUP by t.station, t.valid
+    )
+    UPDATE %s c SET %s
+    FROM yrs y WHERE c.station = y.station and c.valid = y.valid
+    """ % (table, st,
+           ", ".join([("min(o.year) FILTER (WHERE o.%s = t.%s) as %s"
+                       ) % (obcol, aggcol, col)
+                      for col, obcol, aggcol in YEARCOLS]),
+           st, META[table]['sts'].strftime("%Y-%m-%d"),
+           META[table]['ets'].strftime("%Y-%m-%d"),
+           table, ", ".join(["%s = y.%s" % (col, col)
+                             for col, _, _ in YEARCOLS])))
+    print('    set record years for %s rows of %s' % (
+        ccursor.rowcount, table))
+    ccursor.close()
+
+
+def main(argv):
     """Go Main Go"""
+    incremental = 'incremental' in argv
     for table in META:
-        daily_averages(table)
-        set_daily_extremes(table)
+        for st in state_names:
+            if st in ['DC', 'AK', 'HI']:
+                continue
+            print('Computing %s for state: %s' % (table, st))
+            if incremental:
+                update_averages(table, st)
+            else:
+                daily_averages(table, st)
+            set_daily_extremes(table, st)
+            COOP.commit()
 
 
 if __name__ == '__main__':
-    main()
+    main(sys.argv)
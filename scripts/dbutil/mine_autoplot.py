@@ -1,64 +1,105 @@
-"""Database found apache log entries of autoplot generation timing
+"""Database the per request timing spans written by autoplot.wsgi
+
+autoplot.wsgi appends a line of JSON for each request to a local file, see
+`htdocs/plotting/auto/apspans.py`, which we sum into the phases of the
+request stored within `autoplot_timing`.  The file is renamed prior to being
+read, the writers then start a new one, and removed once databased.  A
+renamed file left by a failed run is loaded by the next one.
 
 Run from RUN_10_AFTER.sh
 """
 from __future__ import print_function
+import os
+import json
+import time
 import datetime
-import re
 
+import pytz
 from pyiem.util import get_dbconn
 
-LOGRE = re.compile(r"Autoplot\[\s*(\d+)\] Timing:\s*(\d+\.\d+)s Key: ([^\s]*)")
-LOGFN = '/var/log/mesonet/error_log'
+SPANSFN = os.environ.get('IEM_AUTOPLOT_SPANS',
+                         '/var/log/mesonet/autoplot_spans.log')
+# autoplot_timing column -> span names whose exclusive time it sums
+PHASES = {
+    'import_secs': ['import'],
+    'context_secs': ['context'],
+    'sql_secs': ['sql', 'connect'],
+    'app_secs': ['app'],
+    'render_secs': ['encode', 'savefig'],
+    'cache_secs': ['cache_get', 'cache_wait', 'cache_set'],
+}
 
 
-def get_dbendts(cursor):
-    """Figure out when we have data until"""
-    cursor.execute("""SELECT max(valid) from autoplot_timing""")
-    ts = cursor.fetchone()[0]
-    if ts is None:
-        ts = datetime.datetime.now() - datetime.timedelta(days=1)
-    else:
-        ts = ts.replace(tzinfo=None)
-    return ts
+def to_row(record):
+    """Convert a spans record into the autoplot_timing columns"""
+    totals = record['totals']
+    row = dict(
+        appid=record['appid'], timing=record['total'], uri=record['key'],
+        hostname=record['hostname'], cache=record['cache'],
+        queries=record['counts'].get('sql', 0),
+        valid=datetime.datetime.strptime(
+            record['valid'], "%Y-%m-%dT%H:%M:%S.%fZ").replace(
+                tzinfo=pytz.utc))
+    for col, names in PHASES.items():
+        row[col] = sum([totals.get(name, 0) for name in names])
+    return row
 
 
-def find_and_save(cursor, dbendts):
+def find_and_save(cursor, fn):
     """Do work please"""
-    now = datetime.datetime.now()
-    thisyear = now.year
     inserts = 0
-    for line in open(LOGFN, 'rb'):
-        line = line.decode('utf-8', 'ignore')
-        tokens = LOGRE.findall(line)
-        if len(tokens) != 1:
-            continue
-        (appid, timing, uri) = tokens[0]
-        valid = datetime.datetime.strptime("%s %s" % (thisyear, line[:15]),
-                                           '%Y %b %d %H:%M:%S')
-        if valid > now or valid <= dbendts:
+    for line in open(fn, 'rb'):
+        try:
+            row = to_row(json.loads(line.decode('utf-8', 'ignore')))
+        except (ValueError, KeyError) as exp:
+            # likely a partial line
+            print("mine_autoplot: bad line %s" % (exp, ))
             continue
-        hostname = line.split()[3]
         cursor.execute("""
-        INSERT into autoplot_timing (appid, valid, timing, uri, hostname)
-        VALUES (%s, %s, %s, %s, %s)
-        """, (appid, valid, timing, uri, hostname))
+        INSERT into autoplot_timing (appid, valid, timing, uri, hostname,
+        cache, import_secs, context_secs, sql_secs, queries, app_secs,
+        render_secs, cache_secs)
+        VALUES (%(appid)s, %(valid)s, %(timing)s, %(uri)s, %(hostname)s,
+        %(cache)s, %(import_secs)s, %(context_secs)s, %(sql_secs)s,
+        %(queries)s, %(app_secs)s, %(render_secs)s, %(cache_secs)s)
+        """, row)
         inserts += 1
     # Don't complain during the early morning hours
-    if inserts == 0 and now.hour > 5:
-        print(("mine_autoplot: no new entries found for databasing "
-               "since %s"
-               ) % (dbendts))
+    if inserts == 0 and datetime.datetime.now().hour > 5:
+        print("mine_autoplot: no new entries found for databasing")
 
 
 def main():
     """Go Main Go!"""
+    procfn = SPANSFN + ".processing"
+    if not os.path.isfile(procfn) and os.path.isfile(SPANSFN):
+        os.rename(SPANSFN, procfn)
+        # let a write to the file opened prior to the rename land
+        time.sleep(1)
+    if not os.path.isfile(procfn):
+        print("mine_autoplot: %s not found" % (SPANSFN, ))
+        return
     mesosite = get_dbconn('mesosite')
     cursor = mesosite.cursor()
-    dbendts = get_dbendts(cursor)
-    find_and_save(cursor, dbendts)
+    find_and_save(cursor, procfn)
     cursor.close()
     mesosite.commit()
+    os.unlink(procfn)
+
+
+def test_to_row():
+    """Do we sum the phases?"""
+    record = {"appid": 84, "cache": "miss", "counts": {"sql": 2},
+              "hostname": "iemvs100", "key": "/plotting/auto/plot/84/.png",
+              "total": 2.5, "valid": "2018-05-01T12:00:00.123456Z",
+              "totals": {"sql": 1.0, "connect": 0.1, "app": 0.5,
+                         "encode": 0.1, "savefig": 0.6, "cache_set": 0.01}}
+    row = to_row(record)
+    assert row['queries'] == 2
+    assert abs(row['sql_secs'] - 1.1) < 0.001
+    assert abs(row['render_secs'] - 0.7) < 0.001
+    assert row['import_secs'] == 0
+    assert row['valid'].tzinfo is not None
 
 
 if __name__ == '__main__':
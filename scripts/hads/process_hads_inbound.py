@@ -1,17 +1,54 @@
 """The pyWWA shef_parser dumps raw data into the raw_inbound table, this
 script sorts through that mess and files it away into the longterm storage
 tables.
+
+The staged rows are moved with one set based INSERT ... SELECT per monthly
+raw%Y_%m table, rather than one INSERT per row.
 """
 from __future__ import print_function
+import time
+import datetime
+
+from pyiem.util import get_dbconn, utc, logger
+
+LOG = logger()
+
+
+def get_partitions(cursor):
+    """Figure out which monthly tables the staged data belongs to
+
+    Returns:
+      list of (table, sts, ets, count) tuples
+    """
+    cursor.execute("""
+        SELECT date_trunc('month', valid at time zone 'UTC') as month,
+        count(*) from raw_inbound_tmp GROUP by month ORDER by month
+    """)
+    res = []
+    for row in cursor:
+        sts = utc(row[0].year, row[0].month, 1)
+        ets = (sts + datetime.timedelta(days=32)).replace(day=1)
+        res.append(("raw%s" % (sts.strftime("%Y_%m"), ), sts, ets, row[1]))
+    return res
+
 
-import pytz
-from pyiem.util import get_dbconn
+def route(cursor, table, sts, ets):
+    """Move the staged rows for one month into its table
+
+    Returns:
+      int number of rows inserted
+    """
+    cursor.execute("""
+        INSERT into """ + table + """ (station, valid, key, value)
+        SELECT station, valid, key, value from raw_inbound_tmp
+        WHERE valid >= %s and valid < %s
+    """, (sts, ets))
+    return cursor.rowcount
 
 
 def main():
     """ Do things """
     pgconn = get_dbconn('hads')
-    cursor2 = pgconn.cursor()
     cursor = pgconn.cursor()
     cursor.execute("""
         INSERT into raw_inbound_tmp
@@ -22,21 +59,17 @@ def main():
     cursor.close()
     pgconn.commit()
     cursor = pgconn.cursor()
-    cursor.execute("""
-        SELECT station, valid at time zone 'UTC',
-        key, value from raw_inbound_tmp
-    """)
-    for row in cursor:
-        table = "raw%s" % (row[1].strftime("%Y_%m"), )
-        ts = row[1].replace(tzinfo=pytz.utc)
-        cursor2.execute("""
-            INSERT into """ + table + """
-            (station, valid, key, value) VALUES (%s, %s, %s, %s)
-        """, [row[0], ts, row[2], row[3]])
-    if cursor.rowcount == 0:
+    total = 0
+    for (table, sts, ets, count) in get_partitions(cursor):
+        start = time.time()
+        inserted = route(cursor, table, sts, ets)
+        total += inserted
+        LOG.info("%s staged: %s inserted: %s in %.2fs", table, count,
+                 inserted, time.time() - start)
+    if total == 0:
         print("process_hads_inbound.py found no data to insert...")
     cursor.execute("TRUNCATE raw_inbound_tmp")
-    cursor2.close()
+    cursor.close()
     pgconn.commit()
     pgconn.close()
 
@@ -0,0 +1,203 @@
+"""Process parallel backfill of the IEMRE analyses.
+
+Running `daily_analysis.py` et al from a shell loop does one timestamp at a
+time and reopens the yearly netCDF file for each variable written.  Here the
+timestamps are farmed out to a pool of worker processes, which only compute
+their grids and hand them back.  The parent process is the sole writer and
+batches the writes for each yearly file, so the workers never contend for the
+netCDF file lock.
+
+    python backfill.py daily 2018-01-01 2018-12-31 [--workers 16]
+    python backfill.py hourly 2018-01-01 2018-12-31
+    python backfill.py rsds 2018-01-01 2018-12-31
+"""
+from __future__ import print_function
+import os
+import sys
+import argparse
+import datetime
+import importlib
+import subprocess
+import traceback
+import multiprocessing
+
+import numpy as np
+import pytz
+from pyiem import iemre
+from pyiem.util import ncopen, utc
+
+sys.path.insert(0, "../../include/python")
+from precipsum import VARNAMES as CUMSUM_VARNAMES, update_cumsum  # noqa
+from pointseries import mark_rewritten  # noqa
+
+# mode -> (module, netcdf filename func, offset func, init script)
+MODES = {
+    'daily': ('daily_analysis', iemre.get_daily_ncname, iemre.daily_offset,
+              'init_daily.py'),
+    'hourly': ('hourly_analysis', iemre.get_hourly_ncname,
+               iemre.hourly_offset, 'init_hourly.py'),
+    'rsds': ('grid_rsds', iemre.get_daily_ncname, iemre.daily_offset,
+             'init_daily.py'),
+}
+# number of grids to accumulate for a yearly file prior to writing
+BATCHSIZE = 240
+
+# Per worker process state, set by init_worker
+WORKER = {}
+
+
+def init_worker(mode, domains):
+    """Setup a worker process.
+
+    The analysis module is imported here, so that each worker gets its own
+    database connections rather than ones inherited from the parent.
+    """
+    WORKER['mode'] = mode
+    WORKER['module'] = importlib.import_module(MODES[mode][0])
+    WORKER['domains'] = domains
+
+
+def compute(ts):
+    """Compute the analysis for one timestamp within a worker
+
+    Returns:
+      list of (valid, vname, grid, cells) tuples or a str traceback
+    """
+    res = []
+
+    def collector(valid, vname, grid, cells=None):
+        """Retain a grid rather than writing it."""
+        # unit aware arrays do not survive the trip back to the parent
+        grid = getattr(grid, 'magnitude', grid)
+        res.append((valid, vname, grid, cells))
+
+    mod = WORKER['module']
+    domain = WORKER['domains'][ts.year]
+    try:
+        if WORKER['mode'] == 'daily':
+            mod.workflow(ts, False, False, domain, writer=collector)
+        elif WORKER['mode'] == 'hourly':
+            mod.grid_hour(ts, domain, writer=collector)
+        elif ts.year >= 2014:
+            mod.do_hrrr(ts, domain, writer=collector)
+        else:
+            mod.do_coop(ts, writer=collector)
+    except Exception:
+        return "%s %s" % (ts, traceback.format_exc())
+    return res
+
+
+def get_times(mode, sts, ets):
+    """Generate the timestamps to process, inclusive of the end date"""
+    res = []
+    now = sts
+    while now <= ets:
+        if mode == 'daily':
+            res.append(now)
+        elif mode == 'rsds':
+            ts = datetime.datetime(now.year, now.month, now.day, 12)
+            res.append(ts.replace(tzinfo=pytz.timezone("America/Chicago")))
+        else:
+            for hr in range(24):
+                res.append(utc(now.year, now.month, now.day, hr))
+        now += datetime.timedelta(days=1)
+    return res
+
+
+def prepare_years(mode, years):
+    """Ensure yearly files exist and return their hasdata grids"""
+    _, ncname, _, initscript = MODES[mode]
+    domains = {}
+    for year in years:
+        ncfn = ncname(year)
+        if not os.path.isfile(ncfn):
+            print("will create %s" % (ncfn, ))
+            subprocess.call("python %s %s" % (initscript, year), shell=True)
+        nc = ncopen(ncfn, 'r', timeout=600)
+        domains[year] = nc.variables['hasdata'][:, :]
+        nc.close()
+    return domains
+
+
+def flush(mode, ncfn, pending):
+    """Write out the accumulated grids for one yearly file"""
+    if not pending:
+        return
+    offsetfunc = MODES[mode][2]
+    nc = ncopen(ncfn, 'a', timeout=600)
+    # vname -> (first, last) offsets of running totals needing an update
+    cumsums = {}
+    for (valid, vname, grid, cells) in pending:
+        offset = offsetfunc(valid)
+        if cells is not None:
+            data = nc.variables[vname][offset, :, :]
+            data[cells] = np.asarray(grid)[cells]
+            grid = data
+        nc.variables[vname][offset] = grid
+        if mode == 'daily' and vname in CUMSUM_VARNAMES:
+            (t0, t1) = cumsums.get(vname, (offset, offset))
+            cumsums[vname] = (min(t0, offset), max(t1, offset))
+    for vname, (t0, t1) in cumsums.items():
+        update_cumsum(nc, vname, t0, t1 + 1)
+    nc.close()
+    mark_rewritten(ncfn, min([offsetfunc(entry[0]) for entry in pending]))
+    print("wrote %s grids to %s" % (len(pending), ncfn))
+    del pending[:]
+
+
+def run(mode, sts, ets, workers):
+    """Do the backfill"""
+    ncname = MODES[mode][1]
+    times = get_times(mode, sts, ets)
+    domains = prepare_years(mode, sorted(set([t.year for t in times])))
+    pending = {}
+    failures = 0
+    pool = multiprocessing.Pool(workers, initializer=init_worker,
+                                initargs=(mode, domains))
+    for res in pool.imap_unordered(compute, times):
+        if not isinstance(res, list):
+            print(res)
+            failures += 1
+            continue
+        for entry in res:
+            ncfn = ncname(entry[0].year)
+            batch = pending.setdefault(ncfn, [])
+            batch.append(entry)
+            if len(batch) >= BATCHSIZE:
+                flush(mode, ncfn, batch)
+    pool.close()
+    pool.join()
+    for ncfn, batch in pending.items():
+        flush(mode, ncfn, batch)
+    print("processed %s timestamps, %s failures" % (len(times), failures))
+    return failures
+
+
+def main(argv):
+    """Go Main Go"""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument('mode', choices=sorted(MODES))
+    parser.add_argument('sdate', help='YYYY-mm-dd start date')
+    parser.add_argument('edate', help='YYYY-mm-dd end date, inclusive')
+    parser.add_argument('--workers', type=int,
+                        default=multiprocessing.cpu_count())
+    args = parser.parse_args(argv[1:])
+    sts = datetime.datetime.strptime(args.sdate, '%Y-%m-%d').date()
+    ets = datetime.datetime.strptime(args.edate, '%Y-%m-%d').date()
+    failures = run(args.mode, sts, ets, args.workers)
+    return 1 if failures else 0
+
+
+def test_get_times():
+    """Do we generate the right timestamps?"""
+    sts = datetime.date(2017, 12, 31)
+    ets = datetime.date(2018, 1, 1)
+    assert get_times('daily', sts, ets) == [sts, ets]
+    hours = get_times('hourly', sts, ets)
+    assert len(hours) == 48
+    assert hours[-1] == utc(2018, 1, 1, 23)
+    assert get_times('rsds', sts, ets)[0].hour == 12
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
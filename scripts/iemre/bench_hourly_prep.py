@@ -0,0 +1,93 @@
+"""Benchmark the hourly_analysis.py station data preparation.
+
+Compares the prior row by row (iterrows) computation of the u/v wind
+components and sky coverage against the array-wise versions now found within
+hourly_analysis.py, verifying that both produce identical values.
+
+Record an hour of station data to a CSV file:
+
+    python bench_hourly_prep.py record 2018 07 04 18 obs.csv
+
+Then benchmark against it:
+
+    python bench_hourly_prep.py run obs.csv [repeats]
+"""
+from __future__ import print_function
+import sys
+import timeit
+import datetime
+
+import numpy as np
+import pandas as pd
+import pytz
+from pyiem import meteorology
+import pyiem.datatypes as dt
+
+import hourly_analysis
+
+
+def legacy_wind(df):
+    """The prior row by row u and v computation"""
+    u = []
+    v = []
+    for _station, row in df.iterrows():
+        (_u, _v) = meteorology.uv(dt.speed(row['sknt'], 'KT'),
+                                  dt.direction(row['drct'], 'DEG'))
+        u.append(_u.value("MPS"))
+        v.append(_v.value("MPS"))
+    df['u'] = u
+    df['v'] = v
+
+
+def legacy_skyc(df):
+    """The prior row by row sky coverage computation"""
+    v = []
+    for _station, row in df.iterrows():
+        _v = max(row['max_skyc1'], row['max_skyc2'], row['max_skyc3'])
+        v.append(_v)
+    df['skyc'] = v
+
+
+def record(argv):
+    """Save an hour of station data"""
+    ts = datetime.datetime(int(argv[2]), int(argv[3]), int(argv[4]),
+                           int(argv[5])).replace(tzinfo=pytz.utc)
+    df = hourly_analysis.get_obs(ts)
+    df.to_csv(argv[6])
+    print("Saved %s rows to %s" % (len(df.index), argv[6]))
+
+
+def run(argv):
+    """Run the benchmark"""
+    obs = pd.read_csv(argv[2], index_col='station')
+    repeats = int(argv[3]) if len(argv) > 3 else 5
+    old = obs.copy()
+    new = obs.copy()
+    legacy_wind(old)
+    legacy_skyc(old)
+    hourly_analysis.compute_wind(new)
+    hourly_analysis.compute_skyc(new)
+    for col in ['u', 'v', 'skyc']:
+        np.testing.assert_array_equal(old[col].values.astype(float),
+                                      new[col].values)
+    print("%s stations, u/v/skyc identical" % (len(obs.index), ))
+    for label, funcs in [
+            ('iterrows', (legacy_wind, legacy_skyc)),
+            ('arraywise', (hourly_analysis.compute_wind,
+                           hourly_analysis.compute_skyc))]:
+        timing = min(timeit.repeat(
+            lambda: [func(obs.copy()) for func in funcs], number=1,
+            repeat=repeats))
+        print("%10s %8.4fs" % (label, timing))
+
+
+def main(argv):
+    """Go Main Go"""
+    if argv[1] == 'record':
+        record(argv)
+    else:
+        run(argv)
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -14,70 +14,85 @@ import datetime
 
 import numpy as np
 from pandas.io.sql import read_sql
-from scipy.stats import zscore
-from metpy.interpolate import inverse_distance_to_grid
 from pyiem import iemre, datatypes
 from pyiem.util import get_dbconn, utc, ncopen
 
+from idwgrid import IDWGridder
+from spatialqc import zscore_flags
+
+sys.path.insert(0, "../../include/python")
+from precipsum import VARNAMES as CUMSUM_VARNAMES, update_cumsum  # noqa
+from pointseries import mark_rewritten  # noqa
+
 PGCONN = get_dbconn('iem', user='nobody')
 COOP_PGCONN = get_dbconn('coop', user='nobody')
 
 
-def generic_gridder(df, idx, domain):
+def write_grid(valid, vname, grid):
+    """Write data to backend netcdf"""
+    offset = iemre.daily_offset(valid)
+    nc = ncopen(iemre.get_daily_ncname(valid.year), 'a', timeout=600)
+    if nc is None:
+        print("daily_analysis#write_grid first open attempt failed, try #2")
+        nc = ncopen(iemre.get_daily_ncname(valid.year), 'a', timeout=600)
+    print(("%13s [idx:%s] min: %6.2f max: %6.2f [%s]"
+           ) % (vname, offset, np.nanmin(grid), np.nanmax(grid),
+                nc.variables[vname].units))
+    nc.variables[vname][offset] = grid
+    if vname in CUMSUM_VARNAMES:
+        update_cumsum(nc, vname, offset)
+    nc.close()
+    mark_rewritten(iemre.get_daily_ncname(valid.year), offset)
+
+
+def qc_column(df, idx):
+    """Null out values that are spatial outliers within 2 degree boxes
+
+    Returns:
+      DataFrame of the flagged rows, for auditing
     """
-    Generic gridding algorithm for easy variables
+    # Compute where the standard dev is +/- 1.5std
+    bad = zscore_flags(df, idx, iemre.WEST, iemre.SOUTH, iemre.EAST,
+                       iemre.NORTH, window=2.0, threshold=1.5)
+    df.loc[bad.index, idx] = np.nan
+    # for _, row in bad.iterrows():
+    #    print _, idx, row['station'], row['name'], row[idx]
+    return bad
+
+
+def generic_gridder(df, columns, domain):
     """
-    # print(("Processing generic_gridder for column: %s min:%.2f max:%.2f"
-    #       ) % (idx, df[idx].min(), df[idx].max()))
-    if df[idx].max() == 0 and df[idx].max() == 0:
-        return 0
-    window = 2.0
-    f1 = df[df[idx].notnull()]
-    for lat in np.arange(iemre.SOUTH, iemre.NORTH, window):
-        for lon in np.arange(iemre.WEST, iemre.EAST, window):
-            (west, east, south, north) = (lon, lon + window, lat, lat + window)
-            box = f1[(f1['lat'] >= south) & (f1['lat'] < north) &
-                     (f1['lon'] >= west) & (f1['lon'] < east)]
-            # can't QC data that is all equal
-            if len(box.index) < 4 or box[idx].min() == box[idx].max():
-                continue
-            z = np.abs(zscore(box[idx]))
-            # Compute where the standard dev is +/- 2std
-            bad = box[z > 1.5]
-            df.loc[bad.index, idx] = np.nan
-            # for _, row in bad.iterrows():
-            #    print _, idx, row['station'], row['name'], row[idx]
-
-    df2 = df[df[idx].notnull()]
-    if len(df2.index) < 4:
-        print("Not enough data %s" % (idx,))
-        return
-    xi, yi = np.meshgrid(iemre.XAXIS, iemre.YAXIS)
-    res = np.ones(xi.shape) * np.nan
-    # set a sentinel of where we won't be estimating
-    res = np.where(domain > 0, res, -9999)
-    # do our gridding
-    grid = inverse_distance_to_grid(
-        df2['lon'].values, df2['lat'].values,
-        df2[idx].values, xi, yi, 1.5
-    )
-    # replace nan values in res with whatever now is in grid
-    res = np.where(np.isnan(res), grid, res)
-    # Do we still have missing values?
-    if np.isnan(res).any():
-        # very aggressive with search radius
-        grid = inverse_distance_to_grid(
-            df2['lon'].values, df2['lat'].values,
-            df2[idx].values, xi, yi, 5.5
-        )
-        # replace nan values in res with whatever now is in grid
-        res = np.where(np.isnan(res), grid, res)
-    # replace sentinel back to np.nan
-    res = np.where(res == -9999, np.nan, res)
-    return np.ma.array(res, mask=np.isnan(res))
+    Generic gridding algorithm for easy variables, all columns are gridded
+    at once sharing one set of station neighbor weights.
+
+    Returns:
+      dict of column -> masked array, or 0 when all values are zero, or None
+      when there was not enough data
+    """
+    res = {}
+    todo = []
+    for idx in columns:
+        # print(("Processing generic_gridder for column: %s min:%.2f max:%.2f"
+        #       ) % (idx, df[idx].min(), df[idx].max()))
+        if df[idx].max() == 0:
+            res[idx] = 0
+            continue
+        qc_column(df, idx)
+        if df[idx].notnull().sum() < 4:
+            print("Not enough data %s" % (idx,))
+            res[idx] = None
+            continue
+        todo.append(idx)
+    if not todo:
+        return res
+    gridder = IDWGridder(df['lon'].values, df['lat'].values, iemre.XAXIS,
+                         iemre.YAXIS, domain)
+    for idx, grid in zip(todo, gridder.grid(df[todo].values.astype(float))):
+        res[idx] = grid
+    return res
 
 
-def do_precip(ts):
+def do_precip(ts, writer=write_grid):
     """Compute the 6 UTC to 6 UTC precip
 
     We need to be careful here as the timestamp sent to this app is today,
@@ -112,10 +127,10 @@ def do_precip(ts):
         hnc = ncopen(ncfn, timeout=600)
         phour = np.sum(hnc.variables['p01m'][offset1:offset2, :, :], 0)
         hnc.close()
-    write_grid(ts, 'p01d', np.where(phour < 0, 0, phour))
+    writer(ts, 'p01d', np.where(phour < 0, 0, phour))
 
 
-def do_precip12(ts):
+def do_precip12(ts, writer=write_grid):
     """Compute the 24 Hour precip at 12 UTC, we do some more tricks though"""
     offset = iemre.daily_offset(ts)
     ets = utc(ts.year, ts.month, ts.day, 12)
@@ -145,7 +160,7 @@ def do_precip12(ts):
         hnc = ncopen(ncfn, timeout=600)
         phour = np.sum(hnc.variables['p01m'][offset1:offset2, :, :], 0)
         hnc.close()
-    write_grid(ts, 'p01d_12z', np.where(phour < 0, 0, phour))
+    writer(ts, 'p01d_12z', np.where(phour < 0, 0, phour))
 
 
 def plot(df):
@@ -158,7 +173,7 @@ def plot(df):
     m.close()
 
 
-def grid_day12(ts, domain):
+def grid_day12(ts, domain, writer=write_grid):
     """Use the COOP data for gridding"""
     print(('12z hi/lo for %s') % (ts, ))
     mybuf = 2.
@@ -211,41 +226,25 @@ def grid_day12(ts, domain):
     # plot(df)
 
     if len(df.index) > 4:
-        res = generic_gridder(df, 'highdata', domain)
-        write_grid(ts, 'high_tmpk_12z', datatypes.temperature(
-            res, 'F').value('K'))
+        res = generic_gridder(
+            df, ['highdata', 'lowdata', 'snowdata', 'snowddata'], domain)
+        writer(ts, 'high_tmpk_12z', datatypes.temperature(
+            res['highdata'], 'F').value('K'))
 
-        res = generic_gridder(df, 'lowdata', domain)
-        write_grid(ts, 'low_tmpk_12z', datatypes.temperature(
-            res, 'F').value('K'))
+        writer(ts, 'low_tmpk_12z', datatypes.temperature(
+            res['lowdata'], 'F').value('K'))
 
-        res = generic_gridder(df, 'snowdata', domain)
-        write_grid(ts, 'snow_12z', datatypes.distance(
-            res, 'IN').value('MM'))
+        writer(ts, 'snow_12z', datatypes.distance(
+            res['snowdata'], 'IN').value('MM'))
 
-        res = generic_gridder(df, 'snowddata', domain)
-        write_grid(ts, 'snowd_12z', datatypes.distance(
-            res, 'IN').value('MM'))
+        writer(ts, 'snowd_12z', datatypes.distance(
+            res['snowddata'], 'IN').value('MM'))
     else:
         print(("%s has %02i entries, FAIL"
                ) % (ts.strftime("%Y-%m-%d"), len(df.index)))
 
 
-def write_grid(valid, vname, grid):
-    """Write data to backend netcdf"""
-    offset = iemre.daily_offset(valid)
-    nc = ncopen(iemre.get_daily_ncname(valid.year), 'a', timeout=600)
-    if nc is None:
-        print("daily_analysis#write_grid first open attempt failed, try #2")
-        nc = ncopen(iemre.get_daily_ncname(valid.year), 'a', timeout=600)
-    print(("%13s [idx:%s] min: %6.2f max: %6.2f [%s]"
-           ) % (vname, offset, np.nanmin(grid), np.nanmax(grid),
-                nc.variables[vname].units))
-    nc.variables[vname][offset] = grid
-    nc.close()
-
-
-def grid_day(ts, domain):
+def grid_day(ts, domain, writer=write_grid):
     """Do our gridding"""
     mybuf = 2.
     if ts.year > 1927:
@@ -303,38 +302,49 @@ def grid_day(ts, domain):
         print(("%s has %02i entries, FAIL"
                ) % (ts.strftime("%Y-%m-%d"), len(df.index)))
         return
-    res = generic_gridder(df, 'highdata', domain)
-    write_grid(ts, 'high_tmpk', datatypes.temperature(res, 'F').value('K'))
-    res = generic_gridder(df, 'lowdata', domain)
-    write_grid(ts, 'low_tmpk', datatypes.temperature(res, 'F').value('K'))
-    hres = generic_gridder(df, 'highdwpf', domain)
-    lres = generic_gridder(df, 'lowdwpf', domain)
+    grids = generic_gridder(
+        df, ['highdata', 'lowdata', 'highdwpf', 'lowdwpf', 'avgsknt'],
+        domain)
+    writer(ts, 'high_tmpk',
+           datatypes.temperature(grids['highdata'], 'F').value('K'))
+    writer(ts, 'low_tmpk',
+           datatypes.temperature(grids['lowdata'], 'F').value('K'))
+    hres = grids['highdwpf']
+    lres = grids['lowdwpf']
     if hres is not None and lres is not None:
-        write_grid(ts, 'avg_dwpk', datatypes.temperature((hres + lres) / 2.,
-                                                         'F').value('K'))
-    res = generic_gridder(df, 'avgsknt', domain)
+        writer(ts, 'avg_dwpk', datatypes.temperature((hres + lres) / 2.,
+                                                     'F').value('K'))
+    res = grids['avgsknt']
     if res is not None:
         mask = ~np.isnan(res)
         mask[mask] &= res[mask] < 0
         res = np.where(mask, 0, res)
-        write_grid(ts, 'wind_speed', datatypes.speed(res, 'KT').value('MPS'))
+        writer(ts, 'wind_speed', datatypes.speed(res, 'KT').value('MPS'))
+
 
+def workflow(ts, irealtime, justprecip, domain=None, writer=write_grid):
+    """Do Work
 
-def workflow(ts, irealtime, justprecip):
-    """Do Work"""
+    Args:
+      domain (2d array, optional): the hasdata grid, read from the netcdf
+        file when not provided
+      writer (callable, optional): called as writer(valid, vname, grid) to
+        store each computed grid, defaults to writing the netcdf file
+    """
     # Load up our netcdf file!
     ncfn = iemre.get_daily_ncname(ts.year)
     if not os.path.isfile(ncfn):
         print("will create %s" % (ncfn, ))
         cmd = "python init_daily.py %s" % (ts.year,)
         subprocess.call(cmd, shell=True)
-    nc = ncopen(ncfn, 'a', timeout=600)
-    domain = nc.variables['hasdata'][:, :]
-    nc.close()
+    if domain is None:
+        nc = ncopen(ncfn, 'a', timeout=600)
+        domain = nc.variables['hasdata'][:, :]
+        nc.close()
     # For this date, the 12 UTC COOP obs will match the date
     if not justprecip:
-        grid_day12(ts, domain)
-    do_precip12(ts)
+        grid_day12(ts, domain, writer)
+    do_precip12(ts, writer)
     # This is actually yesterday!
     if irealtime:
         ts -= datetime.timedelta(days=1)
@@ -344,8 +354,8 @@ def workflow(ts, irealtime, justprecip):
         cmd = "python init_daily.py %s" % (ts.year,)
         subprocess.call(cmd, shell=True)
     if not justprecip:
-        grid_day(ts, domain)
-    do_precip(ts)
+        grid_day(ts, domain, writer)
+    do_precip(ts, writer)
 
 
 def main(argv):
@@ -9,6 +9,9 @@ from scipy.interpolate import NearestNDInterpolator
 from pyiem import iemre, datatypes
 from pyiem.util import get_dbconn, ncopen
 
+sys.path.insert(0, "../../include/python")
+from precipsum import update_cumsum  # noqa
+
 
 def generic_gridder(nc, df, idx):
     """
@@ -59,6 +62,7 @@ def grid_day(nc, ts):
         if res is not None:
             nc.variables['p01d'][offset] = datatypes.distance(
                 res, 'IN').value('MM')
+            update_cumsum(nc, 'p01d', offset)
     else:
         print(("%s has %02i entries, FAIL"
                ) % (ts.strftime("%Y-%m-%d"), len(df.index)))
@@ -11,6 +11,9 @@ from pyiem.network import Table as NetworkTable
 from pyiem.reference import state_names
 from pyiem.util import get_dbconn, ncopen
 
+sys.path.insert(0, "../../include/python")
+from precipsum import update_cumsum  # noqa
+
 NT = NetworkTable(["%sCLIMATE" % (abbr, ) for abbr in state_names])
 COOP = get_dbconn('coop', user='nobody')
 
@@ -73,6 +76,7 @@ def grid_day(nc, ts):
         if res is not None:
             nc.variables['ppt'][offset] = datatypes.distance(res,
                                                              'IN').value('MM')
+            update_cumsum(nc, 'ppt', offset)
     else:
         print(("%s has %02i entries, FAIL"
                ) % (ts.strftime("%Y-%m-%d"), cursor.rowcount))
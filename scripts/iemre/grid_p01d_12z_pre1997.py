@@ -11,6 +11,10 @@ from pandas.io.sql import read_sql
 from pyiem.iemre import get_daily_ncname, daily_offset
 from pyiem.util import ncopen, get_dbconn
 
+sys.path.insert(0, "../../include/python")
+from precipsum import update_cumsum  # noqa
+from pointseries import mark_rewritten  # noqa
+
 
 def generic_gridder(day, nc, df, idx):
     """
@@ -69,6 +73,8 @@ def main(argv):
     if res is not None:
         offset = daily_offset(day)
         nc.variables['p01d_12z'][offset] = res.to(mpunits('mm')).magnitude
+        update_cumsum(nc, 'p01d_12z', offset)
+        mark_rewritten(get_daily_ncname(day.year), offset)
     nc.close()
 
 
@@ -14,6 +14,8 @@ from scipy.interpolate import NearestNDInterpolator
 import pygrib
 from pyiem import iemre
 from pyiem.util import get_dbconn, utc, ncopen
+sys.path.insert(0, "../../include/python")
+from pointseries import mark_rewritten  # noqa
 
 
 P4326 = pyproj.Proj(init="epsg:4326")
@@ -23,7 +25,23 @@ LCC = pyproj.Proj(("+lon_0=-97.5 +y_0=0.0 +R=6367470. +proj=lcc +x_0=0.0"
 SWITCH_DATE = utc(2014, 10, 10, 20)
 
 
-def do_coop(ts):
+def write_grid(valid, vname, grid, cells=None):
+    """Write data to backend netcdf
+
+    @param cells boolean grid of which cells to update, None for all
+    """
+    nc = ncopen(iemre.get_daily_ncname(valid.year), 'a', timeout=300)
+    offset = iemre.daily_offset(valid)
+    if cells is not None:
+        data = nc.variables[vname][offset, :, :]
+        data[cells] = grid[cells]
+        grid = data
+    nc.variables[vname][offset] = grid
+    nc.close()
+    mark_rewritten(iemre.get_daily_ncname(valid.year), offset)
+
+
+def do_coop(ts, writer=write_grid):
     """Use COOP solar radiation data"""
     pgconn = get_dbconn('coop', user='nobody')
     cursor = pgconn.cursor()
@@ -48,15 +66,16 @@ def do_coop(ts):
                                np.array(vals))
     xi, yi = np.meshgrid(iemre.XAXIS, iemre.YAXIS)
 
-    nc = ncopen(iemre.get_daily_ncname(ts.year), 'a', timeout=300)
-    offset = iemre.daily_offset(ts)
     # Data above is MJ / d / m-2, we want W / m-2
-    nc.variables['rsds'][offset, :, :] = nn(xi, yi) * 1000000. / 86400.
-    nc.close()
+    writer(ts, 'rsds', nn(xi, yi) * 1000000. / 86400.)
+
 
+def do_hrrr(ts, domain=None, writer=write_grid):
+    """Convert the hourly HRRR data to IEMRE grid
 
-def do_hrrr(ts):
-    """Convert the hourly HRRR data to IEMRE grid"""
+    @param domain hasdata grid, read from the netcdf file when not provided
+    @param writer called as writer(valid, vname, grid, cells)
+    """
     total = None
     xaxis = None
     yaxis = None
@@ -102,21 +121,22 @@ def do_hrrr(ts):
     # We wanna store as W m-2, so we just average out the data by hour
     total = total / 24.0
 
-    nc = ncopen(iemre.get_daily_ncname(ts.year), 'a', timeout=300)
-    offset = iemre.daily_offset(ts)
-    hasdata = nc.variables['hasdata'][:, :]
-    data = nc.variables['rsds'][offset, :, :]
+    if domain is None:
+        nc = ncopen(iemre.get_daily_ncname(ts.year), 'a', timeout=300)
+        domain = nc.variables['hasdata'][:, :]
+        nc.close()
+    cells = np.asarray(domain) >= 1
+    data = np.zeros(cells.shape)
     for i, lon in enumerate(iemre.XAXIS):
         for j, lat in enumerate(iemre.YAXIS):
-            if hasdata[j, i] < 1:
+            if not cells[j, i]:
                 continue
             (x, y) = LCC(lon, lat)
             i2 = np.digitize([x], xaxis)[0]
             j2 = np.digitize([y], yaxis)[0]
             data[j, i] = total[j2, i2]
 
-    nc.variables['rsds'][offset] = data
-    nc.close()
+    writer(ts, 'rsds', data, cells)
 
 
 def main():
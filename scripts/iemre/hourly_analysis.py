@@ -5,14 +5,16 @@ import datetime
 
 import numpy as np
 import pytz
-import pandas as pd
 from pandas.io.sql import read_sql
 from metpy.units import masked_array
-from metpy.interpolate import inverse_distance
 from pyiem import iemre
 from pyiem import meteorology
 import pyiem.datatypes as dt
 from pyiem.util import get_dbconn, ncopen
+
+from idwgrid import IDWGridder
+sys.path.insert(0, "../../include/python")
+from pointseries import mark_rewritten  # noqa
 # stop RuntimeWarning: invalid value encountered in greater
 np.warnings.filterwarnings('ignore')
 
@@ -28,70 +30,54 @@ def pprint(msg):
     print("%6.3f %s" % (delta, msg))
 
 
-def grid_wind(df, domain):
-    """
-    Grid winds based on u and v components
-    @return uwnd, vwnd
+def write_grid(valid, vname, grid):
+    """Atomic write of data to our netcdf storage
+
+    This is isolated so that we don't 'lock' up our file while intensive
+    work is done
     """
-    # compute components
-    u = []
-    v = []
-    for _station, row in df.iterrows():
-        (_u, _v) = meteorology.uv(dt.speed(row['sknt'], 'KT'),
-                                  dt.direction(row['drct'], 'DEG'))
-        u.append(_u.value("MPS"))
-        v.append(_v.value("MPS"))
-    df['u'] = u
-    df['v'] = v
-    ugrid = generic_gridder(df, 'u', domain)
-    vgrid = generic_gridder(df, 'v', domain)
-    return ugrid, vgrid
-
-
-def grid_skyc(df, domain):
-    """Hmmmm"""
-    v = []
-    for _station, row in df.iterrows():
-        _v = max(row['max_skyc1'], row['max_skyc2'], row['max_skyc3'])
-        v.append(_v)
-    df['skyc'] = v
-    return generic_gridder(df, 'skyc', domain)
-
-
-def generic_gridder(df, idx, domain):
-    """Generic gridding algorithm for easy variables"""
-    df2 = df[pd.notnull(df[idx])]
-    xi, yi = np.meshgrid(iemre.XAXIS, iemre.YAXIS)
-    res = np.ones(xi.shape) * np.nan
-    # set a sentinel of where we won't be estimating
-    res = np.where(domain > 0, res, -9999)
-    # do our gridding
-    grid = inverse_distance(df2['lon'].values, df2['lat'].values,
-                            df2[idx].values, xi, yi, 1.5)
-    # replace nan values in res with whatever now is in grid
-    res = np.where(np.isnan(res), grid, res)
-    # Do we still have missing values?
-    if np.isnan(res).any():
-        # very aggressive with search radius
-        grid = inverse_distance(df2['lon'].values, df2['lat'].values,
-                                df2[idx].values, xi, yi, 5.5)
-        # replace nan values in res with whatever now is in grid
-        res = np.where(np.isnan(res), grid, res)
-    # replace sentinel back to np.nan
-    # replace sentinel back to np.nan
-    res = np.where(res == -9999, np.nan, res)
-    return np.ma.array(res, mask=np.isnan(res))
-
-
-def grid_hour(ts):
+    nc = ncopen(iemre.get_hourly_ncname(valid.year), 'a', timeout=300)
+    offset = iemre.hourly_offset(valid)
+    nc.variables[vname][offset] = grid
+    nc.close()
+    mark_rewritten(iemre.get_hourly_ncname(valid.year), offset)
+
+
+def compute_wind(df):
+    """Compute u and v wind components (MPS) for gridding"""
+    (u, v) = meteorology.uv(dt.speed(df['sknt'].values, 'KT'),
+                            dt.direction(df['drct'].values, 'DEG'))
+    df['u'] = u.value("MPS")
+    df['v'] = v.value("MPS")
+
+
+def compute_skyc(df):
+    """Maximum sky coverage of the three layers
+
+    This mirrors python's max(), which only replaces its running value when
+    the next one is greater, so a leading null stays null.
     """
-    I proctor the gridding of data on an hourly basis
+    res = df['max_skyc1'].values.astype(float)
+    for col in ['max_skyc2', 'max_skyc3']:
+        val = df[col].values.astype(float)
+        res = np.where(val > res, val, res)
+    df['skyc'] = res
+
+
+def generic_gridder(df, columns, domain):
+    """Generic gridding algorithm for easy variables, all columns are gridded
+    at once sharing one set of station neighbor weights"""
+    gridder = IDWGridder(df['lon'].values, df['lat'].values, iemre.XAXIS,
+                         iemre.YAXIS, domain)
+    return gridder.grid(df[columns].values.astype(float))
+
+
+def get_obs(ts):
+    """Fetch station observations for the analysis hour
+
     @param ts Timestamp of the analysis, we'll consider a 20 minute window
+    @return DataFrame indexed by station
     """
-    pprint("grid_hour called...")
-    nc = ncopen(iemre.get_hourly_ncname(ts.year), 'a', timeout=300)
-    domain = nc.variables['hasdata'][:, :]
-    nc.close()
     ts0 = ts - datetime.timedelta(minutes=10)
     ts1 = ts + datetime.timedelta(minutes=10)
     utcnow = datetime.datetime.utcnow()
@@ -143,53 +129,43 @@ def grid_hour(ts):
  valid >= %s and valid < %s GROUP by station, lon, lat"""
 
     df = read_sql(sql, dbconn, params=params, index_col='station')
+    return df
+
+
+def grid_hour(ts, domain=None, writer=write_grid):
+    """
+    I proctor the gridding of data on an hourly basis
+    @param ts Timestamp of the analysis, we'll consider a 20 minute window
+    @param domain hasdata grid, read from the netcdf file when not provided
+    @param writer called as writer(valid, vname, grid) to store each grid
+    """
+    pprint("grid_hour called...")
+    if domain is None:
+        nc = ncopen(iemre.get_hourly_ncname(ts.year), 'a', timeout=300)
+        domain = nc.variables['hasdata'][:, :]
+        nc.close()
+    df = get_obs(ts)
     pprint("got database results")
     if df.empty:
         print(("%s has no entries, FAIL"
                ) % (ts.strftime("%Y-%m-%d %H:%M"), ))
         return
-    ures, vres = grid_wind(df, domain)
-    pprint("grid_wind is done")
-    if ures is None:
-        print("iemre.hourly_analysis failure for uwnd at %s" % (ts, ))
-    else:
-        write_grid(ts, 'uwnd', ures)
-        write_grid(ts, 'vwnd', vres)
-
-    tmpf = generic_gridder(df, 'max_tmpf', domain)
-    pprint("grid tmpf is done")
-    if tmpf is None:
-        print("iemre.hourly_analysis failure for tmpk at %s" % (ts, ))
-    else:
-        dwpf = generic_gridder(df, 'max_dwpf', domain)
-        pprint("grid dwpf is done")
-        # require that dwpk <= tmpk
-        mask = ~np.isnan(dwpf)
-        mask[mask] &= dwpf[mask] > tmpf[mask]
-        dwpf = np.where(mask, tmpf, dwpf)
-        write_grid(ts, 'tmpk', masked_array(tmpf,
-                                            data_units='degF').to('degK'))
-        write_grid(ts, 'dwpk', masked_array(dwpf,
-                                            data_units='degF').to('degK'))
-
-    res = grid_skyc(df, domain)
-    pprint("grid skyc is done")
-    if res is None:
-        print("iemre.hourly_analysis failure for skyc at %s" % (ts, ))
-    else:
-        write_grid(ts, 'skyc', res)
-
-
-def write_grid(valid, vname, grid):
-    """Atomic write of data to our netcdf storage
-
-    This is isolated so that we don't 'lock' up our file while intensive
-    work is done
-    """
-    nc = ncopen(iemre.get_hourly_ncname(valid.year), 'a', timeout=300)
-    offset = iemre.hourly_offset(valid)
-    nc.variables[vname][offset] = grid
-    nc.close()
+    compute_wind(df)
+    compute_skyc(df)
+    ures, vres, tmpf, dwpf, res = generic_gridder(
+        df, ['u', 'v', 'max_tmpf', 'max_dwpf', 'skyc'], domain)
+    pprint("gridding is done")
+    writer(ts, 'uwnd', ures)
+    writer(ts, 'vwnd', vres)
+
+    # require that dwpk <= tmpk
+    mask = ~np.isnan(dwpf)
+    mask[mask] &= dwpf[mask] > tmpf[mask]
+    dwpf = np.where(mask, tmpf, dwpf)
+    writer(ts, 'tmpk', masked_array(tmpf, data_units='degF').to('degK'))
+    writer(ts, 'dwpk', masked_array(dwpf, data_units='degF').to('degK'))
+
+    writer(ts, 'skyc', res)
 
 
 def main(argv):
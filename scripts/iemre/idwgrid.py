@@ -0,0 +1,147 @@
+"""Reusable Cressman gridding of station data onto the IEMRE grid.
+
+This replicates metpy's `inverse_distance_to_grid` (kind='cressman',
+min_neighbors=3), which rebuilds its neighbor search and then loops over each
+grid point in python for every call.  Here the station KD-tree and the sparse
+grid point -> station weight matrices are built once for a given set of
+stations and then reused for every variable, with all variables solved at
+once as sparse matrix products.  Each radius is a pass that only fills grid
+points the previous (smaller) radius left missing.
+"""
+import itertools
+
+import numpy as np
+from scipy import sparse
+from scipy.spatial import cKDTree
+
+# Search radii (degrees) tried in order
+RADII = (1.5, 5.5)
+MIN_NEIGHBORS = 3
+
+
+class IDWGridder(object):
+    """Cressman gridding for one set of station locations."""
+
+    def __init__(self, lons, lats, xaxis, yaxis, domain=None, radii=RADII,
+                 min_neighbors=MIN_NEIGHBORS):
+        """Constructor
+
+        Args:
+          lons (array): station longitudes
+          lats (array): station latitudes
+          xaxis (array): grid x axis, ie iemre.XAXIS
+          yaxis (array): grid y axis, ie iemre.YAXIS
+          domain (2d array, optional): only grid points > 0 are estimated
+          radii (tuple): search radii to attempt in order
+          min_neighbors (int): stations required within the radius
+        """
+        self.tree = cKDTree(np.column_stack([np.asarray(lons, float),
+                                             np.asarray(lats, float)]))
+        xi, yi = np.meshgrid(xaxis, yaxis)
+        self.shape = xi.shape
+        self.gridpts = np.column_stack([xi.ravel(), yi.ravel()])
+        if domain is None:
+            domain = np.ones(self.shape)
+        self.rows = np.where(np.asarray(domain).ravel() > 0)[0]
+        self.radii = radii
+        self.min_neighbors = min_neighbors
+        # radius -> (grid rows, position lookup, weights, counts)
+        self._cache = {}
+
+    def _build(self, radius, rows):
+        """Compute sparse weights and neighbor indicators for grid rows."""
+        pts = self.gridpts[rows]
+        matches = self.tree.query_ball_point(pts, r=radius)
+        lens = np.array([len(m) for m in matches], dtype=int)
+        cols = np.fromiter(itertools.chain.from_iterable(matches), dtype=int,
+                           count=int(lens.sum()))
+        rr = np.repeat(np.arange(len(rows)), lens)
+        d2 = ((self.tree.data[cols] - pts[rr]) ** 2).sum(axis=1)
+        r2 = radius * radius
+        shape = (len(rows), self.tree.n)
+        weights = sparse.csr_matrix(((r2 - d2) / (r2 + d2), (rr, cols)),
+                                    shape=shape)
+        counts = sparse.csr_matrix((np.ones(len(cols)), (rr, cols)),
+                                   shape=shape)
+        return weights, counts
+
+    def _matrices(self, radius, rows):
+        """Return the (cached) matrices covering these grid rows."""
+        cached = self._cache.get(radius)
+        if cached is None or not np.isin(rows, cached[0]).all():
+            if cached is not None:
+                rows = np.union1d(rows, cached[0])
+            weights, counts = self._build(radius, rows)
+            pos = np.full(self.gridpts.shape[0], -1, dtype=int)
+            pos[rows] = np.arange(len(rows))
+            cached = (rows, pos, weights, counts)
+            self._cache[radius] = cached
+        pos = cached[1][rows]
+        return cached[2][pos], cached[3][pos]
+
+    def grid(self, values):
+        """Grid one or more variables.
+
+        Args:
+          values (array): (nstations, ) or (nstations, nvars) with np.nan
+            denoting missing data
+
+        Returns:
+          masked array (ny, nx) or list of them, one per variable
+        """
+        vals = np.asarray(values, dtype=float)
+        squeeze = vals.ndim == 1
+        if squeeze:
+            vals = vals[:, np.newaxis]
+        valid = (~np.isnan(vals)).astype(float)
+        filled = np.where(valid > 0, vals, 0.)
+        out = np.full((self.gridpts.shape[0], vals.shape[1]), np.nan)
+        rows = self.rows
+        for radius in self.radii:
+            if rows.size == 0:
+                break
+            weights, counts = self._matrices(radius, rows)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                est = weights.dot(filled) / weights.dot(valid)
+            est[counts.dot(valid) < self.min_neighbors] = np.nan
+            current = out[rows]
+            out[rows] = np.where(np.isnan(current), est, current)
+            rows = rows[np.isnan(out[rows]).any(axis=1)]
+        res = [np.ma.array(out[:, i].reshape(self.shape),
+                           mask=np.isnan(out[:, i].reshape(self.shape)))
+               for i in range(vals.shape[1])]
+        return res[0] if squeeze else res
+
+
+def _brute_force(lons, lats, vals, xi, yi, radius):
+    """Reference implementation, as metpy does it."""
+    res = np.full(xi.shape, np.nan)
+    for idx in np.ndindex(xi.shape):
+        d2 = (lons - xi[idx]) ** 2 + (lats - yi[idx]) ** 2
+        hits = d2 <= radius * radius
+        if hits.sum() < MIN_NEIGHBORS:
+            continue
+        w = (radius ** 2 - d2[hits]) / (radius ** 2 + d2[hits])
+        res[idx] = np.sum(vals[hits] * w) / np.sum(w)
+    return res
+
+
+def test_gridder():
+    """Do we match the brute force approach?"""
+    np.random.seed(0)
+    lons = np.random.uniform(-100, -90, 60)
+    lats = np.random.uniform(38, 46, 60)
+    vals = np.random.uniform(0, 100, (60, 2))
+    vals[::7, 0] = np.nan
+    xaxis = np.arange(-101, -89, 0.5)
+    yaxis = np.arange(37, 47, 0.5)
+    gridder = IDWGridder(lons, lats, xaxis, yaxis)
+    xi, yi = np.meshgrid(xaxis, yaxis)
+    for i, res in enumerate(gridder.grid(vals)):
+        good = ~np.isnan(vals[:, i])
+        expected = _brute_force(lons[good], lats[good], vals[good, i], xi,
+                                yi, 1.5)
+        missing = np.isnan(expected)
+        expected[missing] = _brute_force(
+            lons[good], lats[good], vals[good, i], xi, yi, 5.5)[missing]
+        np.testing.assert_allclose(res.filled(np.nan), expected)
@@ -10,6 +10,9 @@ import numpy as np
 from pyiem import iemre
 from pyiem.util import ncopen
 
+sys.path.insert(0, "../../include/python")
+from precipsum import update_cumsum  # noqa
+
 
 def run(ts):
     """Process this date's worth of data"""
@@ -47,6 +50,7 @@ def run(ts):
                 "a", timeout=300)
     idx = iemre.daily_offset(ts)
     nc.variables['p01d'][idx, :, :] = np.flipud(total)
+    update_cumsum(nc, 'p01d', idx)
     nc.close()
 
 
@@ -10,6 +10,10 @@ import pyiem.mrms as mrms
 from pyiem import iemre
 from pyiem.util import ncopen
 
+sys.path.insert(0, "../../include/python")
+from precipsum import update_cumsum  # noqa
+from pointseries import mark_rewritten  # noqa
+
 
 def findfile(ts):
     """See if we can find a file to use"""
@@ -49,7 +53,9 @@ def run(ts):
     x0 = int((iemre.WEST - mrms.WEST) * 100.0)
     x1 = int((iemre.EAST - mrms.WEST) * 100.0)
     ncprecip[offset, :, :] = res[y0:y1, x0:x1]
+    update_cumsum(nc, 'p01d', offset)
     nc.close()
+    mark_rewritten(iemre.get_daily_mrms_ncname(ts.year), offset)
 
 
 def main(argv):
@@ -14,6 +14,10 @@ import pyiem.mrms as mrms
 from pyiem import iemre
 from pyiem.util import ncopen
 
+sys.path.insert(0, "../../include/python")
+from precipsum import update_cumsum  # noqa
+from pointseries import mark_rewritten  # noqa
+
 TMP = "/mesonet/tmp"
 
 
@@ -91,7 +95,9 @@ def run(ts):
     # print(('y0:%s y1:%s x0:%s x1:%s lat0:%s offset:%s '
     #       ) % (y0, y1, x0, x1, lats[0, 0], offset))
     ncprecip[offset, :, :] = np.flipud(total[y0:y1, x0:x1])
+    update_cumsum(nc, 'p01d', offset)
     nc.close()
+    mark_rewritten(iemre.get_daily_mrms_ncname(ts.year), offset)
 
 
 def main(argv):
@@ -0,0 +1,70 @@
+"""Build the running total companions of our daily precipitation grids.
+
+The ingest scripts keep the running totals (ie p01d_cumsum) of the yearly and
+climatology files up to date as they write, see
+`include/python/precipsum.py`.  This builds them from scratch for files
+written prior to that, or when the daily grids were changed by other means.
+
+    python precip_cumsum.py <kind> [year]
+
+where kind is one of iemre, mrms, prism or climate.  The year defaults to
+the current one and is not used for the climatology files.
+"""
+from __future__ import print_function
+import os
+import sys
+import datetime
+
+from pyiem import iemre
+from pyiem.util import ncopen
+
+sys.path.insert(0, "../../include/python")
+from precipsum import VARNAMES, update_cumsum  # noqa
+
+# kind -> year -> list of filenames
+KINDS = {
+    'iemre': lambda year: [iemre.get_daily_ncname(year)],
+    'mrms': lambda year: [iemre.get_daily_mrms_ncname(year)],
+    'prism': lambda year: ["/mesonet/data/prism/%s_daily.nc" % (year, )],
+    'climate': lambda _year: [iemre.get_dailyc_ncname(),
+                              iemre.get_dailyc_mrms_ncname(),
+                              "/mesonet/data/prism/prism_dailyc.nc"],
+}
+
+
+def build(ncfn, t1=None):
+    """Compute the running totals of a file's precipitation variables
+
+    Args:
+      ncfn (str): the netCDF file
+      t1 (int, optional): one past the last time step with data, defaults to
+        all of them
+    """
+    nc = ncopen(ncfn, 'a', timeout=600)
+    for ncvar in VARNAMES:
+        if ncvar not in nc.variables:
+            continue
+        var = nc.variables[ncvar]
+        end = var.shape[0] if t1 is None else min(t1, var.shape[0])
+        update_cumsum(nc, ncvar, 0, end)
+        print("precip_cumsum %s %s through %s" % (ncfn, ncvar, end))
+    nc.close()
+
+
+def main(argv):
+    """Go Main Go"""
+    today = datetime.date.today()
+    year = int(argv[2]) if len(argv) > 2 else today.year
+    # the current year only has data through today
+    t1 = None
+    if argv[1] != 'climate' and year == today.year:
+        t1 = iemre.daily_offset(today) + 1
+    for ncfn in KINDS[argv[1]](year):
+        if not os.path.isfile(ncfn):
+            print("precip_cumsum missing %s" % (ncfn, ))
+            continue
+        build(ncfn, t1)
+
+
+if __name__ == '__main__':
+    main(sys.argv)
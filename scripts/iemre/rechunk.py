@@ -0,0 +1,170 @@
+"""Maintain time-major copies of our yearly netCDF files for point queries.
+
+The yearly IEMRE, Stage IV, MRMS and PRISM files are chunked for whole grid
+writes, so a point's time series touches every chunk of the file.  This
+script keeps a copy of each yearly file alongside it (ie
+2018_iemre_daily_tm.nc), chunked over a long run of time steps for a small
+spatial tile, which the point services read via `pointseries.open_series()`.
+Daily files are chunked by the whole year, hourly files by month so that an
+update does not need to rewrite the entire (large) copy.
+
+    python rechunk.py <kind> [YYYY mm dd] [days] [full]
+
+where kind is one of daily, hourly, stage4, mrms or prism.  Only the time
+steps for the `days` (default 5) prior to and including the date are copied
+into an existing copy, the copy is built from scratch when it does not exist
+or `full` is provided.  The date defaults to a lag behind today that covers
+the reprocessing each archive sees.  The copy's `valid_through` attribute
+records how many leading time steps are in sync with the yearly file, later
+time steps are read from the yearly file itself.  An update copies from the
+earlier of the date range and `valid_through`, so missed runs and time steps
+rewritten since (see `pointseries.mark_rewritten()`) are caught up on.
+"""
+from __future__ import print_function
+import os
+import sys
+import datetime
+
+import numpy as np
+from pyiem import iemre
+from pyiem.util import ncopen
+
+sys.path.insert(0, "../../include/python")
+from pointseries import get_mirror_ncname  # noqa
+
+# kind -> (yearly filename func, time steps per day, default lag days,
+#          time steps per chunk or None for the whole file)
+KINDS = {
+    'daily': (iemre.get_daily_ncname, 1, 1, None),
+    'hourly': (iemre.get_hourly_ncname, 24, 1, 31 * 24),
+    'stage4': (lambda year: ("/mesonet/data/stage4/%s_stage4_hourly.nc"
+                             ) % (year, ), 24, 4, 31 * 24),
+    'mrms': (iemre.get_daily_mrms_ncname, 1, 1, None),
+    'prism': (lambda year: "/mesonet/data/prism/%s_daily.nc" % (year, ), 1,
+              3, None),
+}
+# target size of a chunk in bytes
+CHUNKBYTES = 128 * 1024
+
+
+def is_timeseries(var):
+    """Is this a (time, y, x) variable"""
+    return len(var.dimensions) == 3 and var.dimensions[0] == 'time'
+
+
+def tile_size(var, steps):
+    """The spatial tile size giving about CHUNKBYTES per chunk"""
+    side = (CHUNKBYTES / float(steps * var.dtype.itemsize)) ** 0.5
+    return max(1, int(side))
+
+
+def build(ncfn, valid_through, timechunk=None):
+    """Create the time-major copy of a yearly file from scratch"""
+    mirror = get_mirror_ncname(ncfn)
+    tmpfn = mirror + ".tmp"
+    src = ncopen(ncfn, timeout=600)
+    dst = ncopen(tmpfn, 'w')
+    dst.setncatts(dict((k, src.getncattr(k)) for k in src.ncattrs()))
+    for name, dim in src.dimensions.items():
+        dst.createDimension(name, len(dim))
+    for name, svar in src.variables.items():
+        kwargs = {}
+        if '_FillValue' in svar.ncattrs():
+            kwargs['fill_value'] = svar.getncattr('_FillValue')
+        if is_timeseries(svar):
+            steps = min(timechunk or svar.shape[0], svar.shape[0])
+            side = tile_size(svar, steps)
+            kwargs['chunksizes'] = (steps, min(side, svar.shape[1]),
+                                    min(side, svar.shape[2]))
+        dvar = dst.createVariable(name, svar.dtype, svar.dimensions,
+                                  **kwargs)
+        dvar.setncatts(dict((k, svar.getncattr(k)) for k in svar.ncattrs()
+                            if k != '_FillValue'))
+        # copy the packed values as is
+        svar.set_auto_maskandscale(False)
+        dvar.set_auto_maskandscale(False)
+        if not is_timeseries(svar):
+            dvar[:] = svar[:]
+            continue
+        # write whole chunks, one band of rows at a time
+        side = kwargs['chunksizes'][1]
+        for y0 in range(0, svar.shape[1], side):
+            dvar[:, y0:y0 + side, :] = svar[:, y0:y0 + side, :]
+    dst.valid_through = valid_through
+    src.close()
+    dst.close()
+    os.rename(tmpfn, mirror)
+    print("rechunk built %s valid_through: %s" % (mirror, valid_through))
+
+
+def update(ncfn, t0, t1, timechunk=None):
+    """Bring the time-major copy of a yearly file up to date through t1
+
+    Time steps from the earlier of t0 and the copy's valid_through are
+    copied, so that a gap left by a missed run, or time steps rewritten
+    since they were copied, are caught up on.
+    """
+    src = ncopen(ncfn, timeout=600)
+    dst = ncopen(get_mirror_ncname(ncfn), 'a', timeout=600)
+    if any(name not in dst.variables for name in src.variables):
+        # a variable was added to the yearly file
+        src.close()
+        dst.close()
+        build(ncfn, t1, timechunk)
+        return
+    valid_through = int(getattr(dst, 'valid_through', 0))
+    start = min(t0, valid_through)
+    for name, svar in src.variables.items():
+        dvar = dst.variables[name]
+        svar.set_auto_maskandscale(False)
+        dvar.set_auto_maskandscale(False)
+        if svar.dimensions and svar.dimensions[0] == 'time':
+            dvar[start:t1] = svar[start:t1]
+        else:
+            dvar[:] = svar[:]
+    dst.valid_through = max(valid_through, t1)
+    src.close()
+    dst.close()
+    print("rechunk updated %s [%s, %s)" % (ncfn, start, t1))
+
+
+def sync(kind, valid, days, full):
+    """Sync the copies for the time steps spanning days prior to valid"""
+    ncname, perday, _lag, timechunk = KINDS[kind]
+    sts = valid - datetime.timedelta(days=days - 1)
+    for year in range(sts.year, valid.year + 1):
+        ncfn = ncname(year)
+        if not os.path.isfile(ncfn):
+            print("rechunk missing %s" % (ncfn, ))
+            continue
+        jan1 = datetime.date(year, 1, 1)
+        t0 = (max(sts, jan1) - jan1).days * perday
+        t1 = ((min(valid, datetime.date(year, 12, 31)) - jan1).days +
+              1) * perday
+        if full or not os.path.isfile(get_mirror_ncname(ncfn)):
+            build(ncfn, t1, timechunk)
+        else:
+            update(ncfn, t0, t1, timechunk)
+
+
+def main(argv):
+    """Go Main Go"""
+    full = 'full' in argv
+    argv = [arg for arg in argv if arg != 'full']
+    kind = argv[1]
+    valid = datetime.date.today() - datetime.timedelta(days=KINDS[kind][2])
+    if len(argv) >= 5:
+        valid = datetime.date(int(argv[2]), int(argv[3]), int(argv[4]))
+    days = int(argv[5]) if len(argv) >= 6 else 5
+    sync(kind, valid, days, full)
+
+
+def test_tile_size():
+    """Are our chunks about the right size?"""
+    var = np.zeros((8784, 1, 1), dtype=np.uint16)
+    assert tile_size(var, 31 * 24) == 9
+    assert tile_size(var, 366) == 13
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,77 @@
+"""Spatial z-score quality control of station data.
+
+Stations are assigned to fixed lon/lat boxes and any value whose absolute
+z-score within its box exceeds a threshold is flagged.  Box assignment and
+the per box statistics are computed in one vectorized pass, optionally
+grouped by other columns (ie day) so that many dates are done at once.
+"""
+import numpy as np
+
+
+def assign_boxes(df, west, south, east, north, window=2.0):
+    """Compute the box each station falls within.
+
+    The boxes start at the west/south bounds and step by window degrees,
+    a station is within a box when west <= lon < west + window and
+    south <= lat < south + window.
+
+    Returns:
+      numpy array of box ids, -1 for stations outside of all boxes
+    """
+    xedges = np.arange(west, east, window)
+    yedges = np.arange(south, north, window)
+    lons = df['lon'].values.astype(float)
+    lats = df['lat'].values.astype(float)
+    ix = np.searchsorted(xedges, lons, side='right') - 1
+    iy = np.searchsorted(yedges, lats, side='right') - 1
+    ok = (ix >= 0) & (iy >= 0)
+    ok[ok] &= ((lons[ok] < xedges[ix[ok]] + window) &
+               (lats[ok] < yedges[iy[ok]] + window))
+    return np.where(ok, iy * len(xedges) + ix, -1)
+
+
+def zscore_flags(df, column, west, south, east, north, window=2.0,
+                 threshold=1.5, minpoints=4, by=None):
+    """Find values that are spatial outliers.
+
+    Args:
+      df (DataFrame): with lon, lat and column
+      column (str): the column to QC
+      west, south, east, north (float): bounds of the boxes
+      window (float): box size in degrees
+      threshold (float): absolute z-score above which a value is flagged
+      minpoints (int): boxes with fewer values are not evaluated
+      by (list, optional): additional columns to group by, ie ['day']
+
+    Returns:
+      DataFrame of the flagged rows with `box` and `zscore` columns added
+    """
+    work = df[df[column].notnull()].copy()
+    work['box'] = assign_boxes(work, west, south, east, north, window)
+    work = work[work['box'] >= 0]
+    keys = ['box'] + (by or [])
+    grp = work.groupby(keys)[column]
+    stats = grp.transform('count')
+    # can't QC data that is all equal
+    usable = ((stats >= minpoints) &
+              (grp.transform('min') != grp.transform('max')))
+    # population standard deviation, as scipy.stats.zscore does
+    std = grp.transform('std', ddof=0)
+    work['zscore'] = ((work[column] - grp.transform('mean')) / std).abs()
+    return work[usable & (work['zscore'] > threshold)]
+
+
+def test_flags():
+    """Do we flag the obvious outlier only?"""
+    import pandas as pd
+    df = pd.DataFrame(dict(
+        lon=[-95.5, -95.4, -95.3, -95.2, -95.1, -90.5, -90.4, -90.3, -89.],
+        lat=[41.5, 41.6, 41.7, 41.8, 41.9, 41.5, 41.6, 41.7, 41.8],
+        high=[70, 71, 70, 71, 100, 50, 50, 50, 50]))
+    bad = zscore_flags(df, 'high', -96, 40, -88, 44)
+    assert list(bad.index) == [4]
+    # the last box may extend beyond the east bound, like the old loops
+    assert list(assign_boxes(df, -96, 40, -89, 44)) == [
+        0, 0, 0, 0, 0, 2, 2, 2, 3]
+    assert list(assign_boxes(df, -95, 40, -89, 44)) == [
+        -1, -1, -1, -1, -1, 2, 2, 2, -1]
@@ -11,6 +11,8 @@ from scipy.interpolate import NearestNDInterpolator
 import pygrib
 from pyiem import iemre
 from pyiem.util import ncopen
+sys.path.insert(0, "../../include/python")
+from pointseries import mark_rewritten  # noqa
 
 
 def merge(ts):
@@ -65,6 +67,7 @@ def merge(ts):
         ts = ts0 + datetime.timedelta(hours=offset-offset0)
     nc.sync()
     nc.close()
+    mark_rewritten(iemre.get_hourly_ncname(ts0.year), offset0)
 
 
 def main(argv):
@@ -12,6 +12,8 @@ from scipy.interpolate import NearestNDInterpolator
 import pygrib
 from pyiem import iemre
 from pyiem.util import utc, ncopen, logger
+sys.path.insert(0, "../../include/python")
+from pointseries import mark_rewritten  # noqa
 
 LOG = logger()
 
@@ -63,6 +65,8 @@ def ingest_hourly_grib(valid):
         np.min(val), np.mean(val), np.max(val)
     )
     nc.close()
+    mark_rewritten(("/mesonet/data/stage4/%s_stage4_hourly.nc"
+                    ) % (valid.year, ), tidx)
     return 1
 
 
@@ -97,6 +101,7 @@ def copy_to_iemre(valid):
         np.min(res), np.mean(res), np.max(res)
     )
     nc.close()
+    mark_rewritten(iemre.get_hourly_ncname(valid.year), tidx)
 
 
 def workflow(valid):
@@ -5,16 +5,19 @@ import os
 import sys
 import subprocess
 
+from io import StringIO
+
 import numpy as np
-import pytz
-import psycopg2.extras
+import pandas as pd
 import metpy.calc as mcalc
 from metpy.units import units
 from netCDF4 import chartostring
-from pyiem.observation import Observation
 from pyiem.datatypes import temperature, distance, speed
 from pyiem.util import get_dbconn, ncopen
 
+# the columns we save to current
+OBCOLS = ['tmpf', 'dwpf', 'relh', 'drct', 'sknt', 'gust', 'pres', 'tsf0',
+          'tsf1', 'tsf2', 'tsf3', 'rwis_subf', 'pday']
 MY_PROVIDERS = ["KYTC-RWIS",
                 "KYMN",
                 "NEDOR",
@@ -37,10 +40,10 @@ def find_file():
 
 
 def sanity_check(val, lower, upper):
-    """Simple bounds check"""
-    if val > lower and val < upper:
-        return float(val)
-    return None
+    """Bounds check an array, values outside or masked become NaN"""
+    val = np.ma.filled(np.ma.asarray(val, dtype=float), np.nan)
+    with np.errstate(invalid='ignore'):
+        return np.where((val > lower) & (val < upper), val, np.nan)
 
 
 def provider2network(provider):
@@ -57,52 +60,11 @@ def provider2network(provider):
     return None
 
 
-def main():
-    """Do Something"""
-    pgconn = get_dbconn('iem')
-    icursor = pgconn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-    fn = find_file()
-    nc = ncopen(fn, timeout=300)
-
-    stations = chartostring(nc.variables["stationId"][:])
-    providers = chartostring(nc.variables["dataProvider"][:])
-    names = chartostring(nc.variables["stationName"][:])
-
-    tmpk = nc.variables["temperature"][:]
-    dwpk = nc.variables["dewpoint"][:]
-
-    # Set some data bounds to keep mcalc from complaining
-    dwpk = np.ma.where(
-        np.ma.logical_or(
-            np.ma.less(dwpk, 200), np.ma.greater(dwpk, 320)
-        ), np.nan, dwpk)
-    tmpk = np.ma.where(
-        np.ma.logical_or(
-            np.ma.less(tmpk, 200), np.ma.greater(tmpk, 320)
-        ), np.nan, tmpk)
-    relh = mcalc.relative_humidity_from_dewpoint(tmpk * units.degK,
-                                                 dwpk * units.degK
-                                                 ).magnitude * 100.
-    obtime = nc.variables["observationTime"][:]
-    pressure = nc.variables["stationPressure"][:]
-    # altimeter = nc.variables["altimeter"][:]
-    # slp = nc.variables["seaLevelPressure"][:]
-    drct = nc.variables["windDir"][:]
-    smps = nc.variables["windSpeed"][:]
-    gmps = nc.variables["windGust"][:]
-    # gmps_drct = nc.variables["windDirMax"][:]
-    pcpn = nc.variables["precipAccum"][:]
-    rtk1 = nc.variables["roadTemperature1"][:]
-    rtk2 = nc.variables["roadTemperature2"][:]
-    rtk3 = nc.variables["roadTemperature3"][:]
-    rtk4 = nc.variables["roadTemperature4"][:]
-    subk1 = nc.variables["roadSubsurfaceTemp1"][:]
-    nc.close()
-
-    db = {}
-
+def get_networks(providers, names):
+    """Compute the IEM network for each record, None for ones we skip"""
+    res = np.full(len(providers), None, dtype=object)
+    cache = {}
     for recnum, provider in enumerate(providers):
-        this_station = stations[recnum]
         if (not provider.endswith('DOT') and
                 provider not in MY_PROVIDERS):
             continue
@@ -111,76 +73,171 @@ def main():
             continue
         if provider == 'MesoWest':
             # get the network from the last portion of the name
-            network = name.split()[-1]
-            if network != 'VTWAC':
-                continue
-        else:
-            network = provider2network(provider)
-        if network is None:
+            if name.split()[-1] == 'VTWAC':
+                res[recnum] = 'VTWAC'
             continue
-        db[this_station] = {}
-        ticks = obtime[recnum]
-        ts = datetime.datetime(1970, 1, 1) + datetime.timedelta(seconds=ticks)
-        db[this_station]['ts'] = ts.replace(tzinfo=pytz.utc)
-        db[this_station]['network'] = network
-        db[this_station]['pres'] = sanity_check(pressure[recnum], 0, 1000000)
-        db[this_station]['tmpk'] = sanity_check(tmpk[recnum], 200, 330)
-        db[this_station]['dwpk'] = sanity_check(dwpk[recnum], 200, 330)
-        db[this_station]['relh'] = relh[recnum]
-        db[this_station]['drct'] = sanity_check(drct[recnum], -1, 361)
-        db[this_station]['smps'] = sanity_check(smps[recnum], -1, 200)
-        db[this_station]['gmps'] = sanity_check(gmps[recnum], -1, 200)
-        db[this_station]['rtk1'] = sanity_check(rtk1[recnum], 0, 500)
-        db[this_station]['rtk2'] = sanity_check(rtk2[recnum], 0, 500)
-        db[this_station]['rtk3'] = sanity_check(rtk3[recnum], 0, 500)
-        db[this_station]['rtk4'] = sanity_check(rtk4[recnum], 0, 500)
-        db[this_station]['subk'] = sanity_check(subk1[recnum], 0, 500)
-        db[this_station]['pday'] = sanity_check(pcpn[recnum], -1, 5000)
-
-    for sid in db:
-        # print("Processing %s[%s]" % (sid, db[sid]['network']))
-        iem = Observation(sid, db[sid]['network'], db[sid]['ts'])
-        if db[sid]['tmpk'] is not None:
-            iem.data['tmpf'] = temperature(db[sid]['tmpk'], 'K').value('F')
-        if db[sid]['dwpk'] is not None:
-            iem.data['dwpf'] = temperature(db[sid]['dwpk'], 'K').value('F')
-        if db[sid]['relh'] is not None and db[sid]['relh'] is not np.ma.masked:
-            iem.data['relh'] = float(db[sid]['relh'])
-        if db[sid]['drct'] is not None:
-            iem.data['drct'] = db[sid]['drct']
-        if db[sid]['smps'] is not None:
-            iem.data['sknt'] = speed(db[sid]['smps'], 'MPS').value('KT')
-        if db[sid]['gmps'] is not None:
-            iem.data['gust'] = speed(db[sid]['gmps'], 'MPS').value('KT')
-        if db[sid]['pres'] is not None:
-            iem.data['pres'] = (float(db[sid]['pres']) / 100.00) * 0.02952
-        if db[sid]['rtk1'] is not None:
-            iem.data['tsf0'] = temperature(db[sid]['rtk1'], 'K').value('F')
-        if db[sid]['rtk2'] is not None:
-            iem.data['tsf1'] = temperature(db[sid]['rtk2'], 'K').value('F')
-        if db[sid]['rtk3'] is not None:
-            iem.data['tsf2'] = temperature(db[sid]['rtk3'], 'K').value('F')
-        if db[sid]['rtk4'] is not None:
-            iem.data['tsf3'] = temperature(db[sid]['rtk4'], 'K').value('F')
-        if db[sid]['subk'] is not None:
-            iem.data['rwis_subf'] = temperature(db[sid]['subk'],
-                                                'K').value('F')
-        if db[sid]['pday'] is not None:
-            iem.data['pday'] = round(distance(db[sid]['pday'],
-                                              'MM').value("IN"),
-                                     2)
-        if not iem.save(icursor):
-            print(("MADIS Extract: %s found new station: %s network: %s"
-                  "") % (fn.split("/")[-1], sid, db[sid]['network']))
-            subprocess.call("python sync_stations.py %s" % (fn,), shell=True)
-            os.chdir("../../dbutil")
-            subprocess.call("sh SYNC_STATIONS.sh", shell=True)
-            os.chdir("../ingestors/madis")
-            print("...done with sync.")
-        del iem
+        if provider not in cache:
+            cache[provider] = provider2network(provider)
+        res[recnum] = cache[provider]
+    return res
+
+
+def build_obs(nc):
+    """Build a DataFrame of observations to save, one per station"""
+    stations = chartostring(nc.variables["stationId"][:])
+    providers = chartostring(nc.variables["dataProvider"][:])
+    names = chartostring(nc.variables["stationName"][:])
+    networks = get_networks(providers, names)
+    keep = np.array([n is not None for n in networks], dtype=bool)
+
+    def read(vname, lower, upper):
+        """Read a variable for the records we keep, bounds checked"""
+        return sanity_check(nc.variables[vname][:][keep], lower, upper)
+
+    tmpk = read("temperature", 200, 320)
+    dwpk = read("dewpoint", 200, 320)
+    relh = mcalc.relative_humidity_from_dewpoint(tmpk * units.degK,
+                                                 dwpk * units.degK
+                                                 ).magnitude * 100.
+    obtime = nc.variables["observationTime"][:][keep]
+    df = pd.DataFrame({
+        'station': stations[keep],
+        'network': networks[keep],
+        'valid': pd.to_datetime(np.asarray(obtime, dtype=float), unit='s',
+                                utc=True),
+        'tmpf': temperature(tmpk, 'K').value('F'),
+        'dwpf': temperature(dwpk, 'K').value('F'),
+        'relh': relh,
+        'drct': read("windDir", -1, 361),
+        'sknt': speed(read("windSpeed", -1, 200), 'MPS').value('KT'),
+        'gust': speed(read("windGust", -1, 200), 'MPS').value('KT'),
+        'pres': read("stationPressure", 0, 1000000) / 100. * 0.02952,
+        'tsf0': temperature(read("roadTemperature1", 0, 500),
+                            'K').value('F'),
+        'tsf1': temperature(read("roadTemperature2", 0, 500),
+                            'K').value('F'),
+        'tsf2': temperature(read("roadTemperature3", 0, 500),
+                            'K').value('F'),
+        'tsf3': temperature(read("roadTemperature4", 0, 500),
+                            'K').value('F'),
+        'rwis_subf': temperature(read("roadSubsurfaceTemp1", 0, 500),
+                                 'K').value('F'),
+        'pday': np.round(distance(read("precipAccum", -1, 5000),
+                                  'MM').value("IN"), 2),
+    }, columns=['station', 'network', 'valid'] + OBCOLS)
+    # the last record for a station within the file wins
+    return df.drop_duplicates('station', keep='last')
+
+
+def save_obs(icursor, df):
+    """Bulk upsert the observations into current and summary
+
+    Returns:
+      list of (station, network) not known to the database
+    """
+    icursor.execute("""
+        CREATE TEMP TABLE madis_obs (station varchar(20),
+        network varchar(10), valid timestamptz, """ +
+                    ", ".join(["%s real" % (c, ) for c in OBCOLS]) + """)
+        ON COMMIT DROP
+    """)
+    sio = StringIO()
+    df.to_csv(sio, sep='\t', header=False, index=False, na_rep='\\N',
+              date_format='%Y-%m-%d %H:%M:%S+00')
+    sio.seek(0)
+    icursor.copy_from(sio, 'madis_obs',
+                      columns=['station', 'network', 'valid'] + OBCOLS)
+    icursor.execute("""
+        SELECT o.station, o.network from madis_obs o LEFT JOIN stations t
+        ON (o.station = t.id and o.network = t.network)
+        WHERE t.iemid is null
+    """)
+    newstations = [(row[0], row[1]) for row in icursor]
+    # current, the trigger on current takes care of current_log
+    icursor.execute("""
+        UPDATE current c SET """ +
+                    ", ".join(["%s = o.%s" % (c, c) for c in OBCOLS]) + """,
+        valid = o.valid FROM madis_obs o, stations t
+        WHERE o.station = t.id and o.network = t.network
+        and c.iemid = t.iemid and o.valid >= c.valid
+    """)
+    # summary, by the local calendar day of the observation
+    icursor.execute("""
+        SELECT distinct extract(year from o.valid at time zone t.tzname)
+        from madis_obs o JOIN stations t ON (o.station = t.id and
+        o.network = t.network)
+    """)
+    for row in icursor.fetchall():
+        table = "summary_%i" % (row[0], )
+        icursor.execute("""
+            INSERT into """ + table + """ (iemid, day)
+            SELECT distinct t.iemid, date(o.valid at time zone t.tzname)
+            from madis_obs o JOIN stations t ON (o.station = t.id and
+            o.network = t.network)
+            WHERE extract(year from o.valid at time zone t.tzname) = %s
+            and not exists (SELECT 1 from """ + table + """ s WHERE
+            s.iemid = t.iemid and s.day = date(o.valid at time zone t.tzname))
+        """, (row[0], ))
+        icursor.execute("""
+            UPDATE """ + table + """ s SET
+            max_tmpf = greatest(s.max_tmpf, o.tmpf),
+            min_tmpf = least(s.min_tmpf, o.tmpf),
+            max_dwpf = greatest(s.max_dwpf, o.dwpf),
+            min_dwpf = least(s.min_dwpf, o.dwpf),
+            max_rh = greatest(s.max_rh, o.relh),
+            min_rh = least(s.min_rh, o.relh),
+            max_sknt_ts = (CASE WHEN o.sknt > coalesce(s.max_sknt, 0)
+                           THEN o.valid
+                           ELSE s.max_sknt_ts END),
+            max_sknt = greatest(s.max_sknt, o.sknt),
+            max_gust_ts = (CASE WHEN o.gust > coalesce(s.max_gust, 0)
+                           THEN o.valid
+                           ELSE s.max_gust_ts END),
+            max_gust = greatest(s.max_gust, o.gust),
+            pday = coalesce(o.pday, s.pday)
+            FROM madis_obs o, stations t
+            WHERE o.station = t.id and o.network = t.network
+            and s.iemid = t.iemid
+            and s.day = date(o.valid at time zone t.tzname)
+        """)
+    return newstations
+
+
+def sync_stations(fn, newstations):
+    """Deferred sync of any new stations found, done once per file"""
+    for (sid, network) in newstations:
+        print(("MADIS Extract: %s found new station: %s network: %s"
+               "") % (fn.split("/")[-1], sid, network))
+    subprocess.call("python sync_stations.py %s" % (fn,), shell=True)
+    os.chdir("../../dbutil")
+    subprocess.call("sh SYNC_STATIONS.sh", shell=True)
+    os.chdir("../ingestors/madis")
+    print("...done with sync.")
+
+
+def main():
+    """Do Something"""
+    pgconn = get_dbconn('iem')
+    icursor = pgconn.cursor()
+    fn = find_file()
+    nc = ncopen(fn, timeout=300)
+    df = build_obs(nc)
+    nc.close()
+
+    newstations = save_obs(icursor, df)
     icursor.close()
     pgconn.commit()
     pgconn.close()
+    if newstations:
+        sync_stations(fn, newstations)
+
+
+def test_sanity_check():
+    """Are bounds and missing values handled?"""
+    res = sanity_check(np.ma.array([1., 5., 10.], mask=[False, True, False]),
+                       0, 9)
+    assert res[0] == 1
+    assert np.isnan(res[1:]).all()
 
 
 if __name__ == '__main__':
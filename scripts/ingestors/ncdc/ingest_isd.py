@@ -1,72 +1,266 @@
-"""HMMMM
+"""Ingest NCEI Integrated Surface Database (DS3505) files into asos.alldata
+
+    python ingest_isd.py <airforce> <wban> <faa> <year> <year2> [workers]
+
+Each station-year is a job: the gzipped file is streamed from NCEI (or read
+from a local uncompressed copy), parsed and then loaded with one COPY per
+table after the existing data for the year is deleted.  Jobs run within a
+process pool, see `ingest()`, which `run_network_isd_ingest.py` also uses to
+spread a network's worth of stations over the pool.
 """
 from __future__ import print_function
-import sys
-import subprocess
+import io
+import re
 import os
+import sys
+import csv
+import gzip
+import multiprocessing
+from urllib.request import urlopen
 
 import tqdm
 from pyiem.ncei import ds3505
 from pyiem.util import get_dbconn, utc
 
+BASEURL = "ftp://ftp.ncdc.noaa.gov/pub/data/noaa"
+# The columns of the asos.tYYYY tables we load, as pyiem's ds3505.sql()
+COLUMNS = ['station', 'valid', 'tmpf', 'dwpf', 'vsby', 'drct', 'sknt',
+           'gust', 'p01i', 'alti', 'skyc1', 'skyc2', 'skyc3', 'skyc4',
+           'skyl1', 'skyl2', 'skyl3', 'skyl4', 'metar', 'mslp', 'wxcodes',
+           'p03i', 'p06i', 'p24i', 'max_tmpf_6hr', 'max_tmpf_24hr',
+           'min_tmpf_6hr', 'min_tmpf_24hr', 'report_type']
+# report_type of the ISD observations
+REPORT_TYPE = 2
+NULL = r"\N"
+# Per worker process database connection
+CONN = {}
+
+
+def get_metar(stid, data):
+    """Which METAR to use for a parsed ob, as ds3505.sql() does
+
+    In general, the IEM database's atomic data is based on the parsing of the
+    METAR product, so the original METAR is used for US sites when we have it
+    and otherwise the one ds3505 generated.
+    """
+    metar = data['extra'].get('REM', {}).get('MET', '')
+    if len(metar) > 20 and (len(stid) == 3 or stid[0] == 'P'):
+        # Split off the cruft
+        metar = metar.strip().replace(";", " ").replace(
+            "METAR ", "").replace("COR ", "").rstrip("=")
+    else:
+        metar = data['metar']
+    return metar
+
+
+def to_row(stid, data):
+    """Convert a parsed ob into the table and values of its COPY row
+
+    Returns:
+      (table, list of values in the order of COLUMNS) or None when the
+      METAR could not be processed
+    """
+    metar = get_metar(stid, data)
+    ob = ds3505.process_metar(metar, data['valid'])
+    if ob is None:
+        return None
+    dbid = stid if len(stid) == 4 and stid[0] != 'K' else stid[-3:]
+    row = [dbid, ob.valid]
+    for col in COLUMNS[2:-1]:
+        row.append(metar if col == 'metar' else getattr(ob, col))
+    row.append(REPORT_TYPE)
+    return "t%s" % (data['valid'].year, ), row
+
+
+def open_isd(airforce, wban, year):
+    """Open the ISD file for a station-year, streaming it if need be
+
+    Returns:
+      text file object or None when it is unavailable
+    """
+    lfn = "%s-%05i-%s" % (str(airforce).zfill(6), wban, year)
+    # ignore any bad bytes, sigh
+    if os.path.isfile(lfn):
+        return open(lfn, errors='ignore')
+    try:
+        resp = urlopen("%s/%s/%s.gz" % (BASEURL, year, lfn), timeout=300)
+    except Exception:
+        return None
+    return io.TextIOWrapper(gzip.GzipFile(fileobj=resp), errors='ignore')
+
+
+def parse(fh, faa):
+    """Parse the lines of an ISD file
+
+    Returns:
+      (dict of table -> list of rows, added, bad, skipped)
+    """
+    rows = {}
+    added = 0
+    bad = 0
+    skipped = 0
+    for line in fh:
+        data = ds3505.parser(line.strip(), faa, add_metar=True)
+        if data is None:
+            bad += 1
+            continue
+        res = to_row(faa, data)
+        if res is None:
+            skipped += 1
+            continue
+        rows.setdefault(res[0], []).append(res[1])
+        added += 1
+    return rows, added, bad, skipped
+
+
+def to_pgarray(values):
+    """Convert a list into a Postgres array literal"""
+    return "{%s}" % (",".join([
+        '"%s"' % (str(val).replace("\\", "\\\\").replace('"', '\\"'), )
+        for val in values]), )
+
+
+def to_csv(rows):
+    """Convert rows of values to a COPY CSV payload"""
+    sio = io.StringIO()
+    writer = csv.writer(sio)
+    for row in rows:
+        writer.writerow([
+            NULL if val is None else
+            (to_pgarray(val) if isinstance(val, (list, tuple)) else val)
+            for val in row])
+    sio.seek(0)
+    return sio
+
+
+def load(pgconn, faa, year, rows):
+    """Replace the data for a station-year
+
+    Returns:
+      int number of rows removed
+    """
+    sts = utc(year, 1, 1)
+    ets = sts.replace(year=year+1)
+    dbid = faa if len(faa) == 4 and faa[0] != 'K' else faa[1:]
+    dbcursor = pgconn.cursor()
+    dbcursor.execute("""
+        DELETE from alldata where station = %s
+        and valid >= %s and valid < %s
+    """, (dbid, sts, ets))
+    removed = dbcursor.rowcount
+    for table, tablerows in rows.items():
+        dbcursor.copy_expert(
+            "COPY %s (%s) FROM STDIN WITH (FORMAT csv, NULL '%s')" % (
+                table, ",".join(COLUMNS), NULL), to_csv(tablerows))
+    dbcursor.close()
+    pgconn.commit()
+    return removed
+
+
+def process(job):
+    """Ingest one station-year within a worker
+
+    A failure (ie a bad gzip stream or a database error) fails the job and
+    not the others of the pool.
+
+    Returns:
+      (job, bool success, message)
+    """
+    (airforce, wban, faa, year) = job
+    try:
+        fh = open_isd(airforce, wban, year)
+        if fh is None:
+            return job, False, "file not found"
+        try:
+            rows, added, bad, skipped = parse(fh, faa)
+        finally:
+            fh.close()
+        removed = 0
+        if added > 0:
+            if 'asos' not in CONN:
+                CONN['asos'] = get_dbconn('asos')
+            removed = load(CONN['asos'], faa, year, rows)
+    except Exception as exp:
+        if 'asos' in CONN:
+            try:
+                CONN['asos'].rollback()
+            except Exception:
+                # the connection is likely gone, get a new one next time
+                del CONN['asos']
+        return job, False, "%s: %s" % (exp.__class__.__name__, exp)
+    return job, True, ("  %s: %s added: %s removed: %s bad: %s"
+                       " skipped: %s") % (year, faa, added, removed, bad,
+                                          skipped)
+
+
+def ingest(jobs, workers=4):
+    """Process (airforce, wban, faa, year) jobs within a process pool
+
+    Returns:
+      (list of (failed job, error message), list of messages)
+    """
+    failed = []
+    msgs = []
+    pool = multiprocessing.Pool(workers)
+    progress = tqdm.tqdm(pool.imap_unordered(process, jobs), total=len(jobs),
+                         disable=not sys.stdout.isatty())
+    for job, ok, msg in progress:
+        if ok:
+            msgs.append(msg)
+        else:
+            failed.append((job, msg))
+    pool.close()
+    pool.join()
+    return failed, msgs
+
 
 def main(argv):
     """Go"""
-    pgconn = get_dbconn('asos')
-    airforce = int(argv[1])
+    airforce = argv[1]
     wban = int(argv[2])
     faa = argv[3]
     year = int(argv[4])
     year2 = int(argv[5])
-    failedyears = []
-    msgs = []
-    for year in tqdm.tqdm(range(year, year2)):
-        sts = utc(year, 1, 1)
-        ets = sts.replace(year=year+1)
-        cursor = pgconn.cursor()
-        lfn = "%06i-%05i-%s" % (airforce, wban, year)
-        if not os.path.isfile(lfn):
-            fn = "ftp://ftp.ncdc.noaa.gov/pub/data/noaa/%s/%s.gz" % (year, lfn)
-            subprocess.call("wget -q -O %s.gz %s" % (lfn, fn),
-                            shell=True)
-            if (not os.path.isfile(lfn+".gz") or
-                    os.path.getsize(lfn+".gz") == 0):
-                failedyears.append(year)
-                continue
-            subprocess.call("gunzip %s.gz" % (lfn, ), shell=True,
-                            stderr=subprocess.PIPE)
-        added = 0
-        bad = 0
-        removed = 0
-        skipped = 0
-        # ignore any bad bytes, sigh
-        for line in open(lfn, errors='ignore'):
-            data = ds3505.parser(line.strip(), faa, add_metar=True)
-            if data is None:
-                bad += 1
-                continue
-            if added == 0:
-                dbid = faa if len(faa) == 4 and faa[0] != 'K' else faa[1:]
-                cursor.execute("""
-                    DELETE from alldata where station = %s
-                    and valid >= %s and valid < %s
-                """, (dbid, sts, ets))
-                if cursor.rowcount > 0:
-                    print("deleted %s rows for %s" % (cursor.rowcount, dbid))
-                removed = cursor.rowcount
-            res = ds3505.sql(cursor, faa, data)
-            if res is None:
-                skipped += 1
-            else:
-                added += 1
-        msgs.append(("  %s: %s added: %s removed: %s bad: %s"
-                     " skipped: %s") % (year, faa, added, removed, bad,
-                                        skipped))
-        cursor.close()
-        pgconn.commit()
-        year += 1
-    print(" failed years: %s" % (failedyears, ))
-    print("\n".join(msgs))
+    workers = int(argv[6]) if len(argv) > 6 else 4
+    jobs = [(airforce, wban, faa, yr) for yr in range(year, year2)]
+    failed, msgs = ingest(jobs, workers)
+    for job, msg in sorted(failed):
+        print(" failed year: %s %s" % (job[3], msg))
+    print("\n".join(sorted(msgs)))
+
+
+def test_to_row():
+    """Do our COPY rows match what ds3505.sql() would INSERT?"""
+
+    class FakeCursor(object):
+        """Keeps the statement executed"""
+        rowcount = 1
+
+        def execute(self, sql, args):
+            """Keep it"""
+            self.sql = sql
+            self.args = args
+
+    msg = ("0232725472949892016010107137+41991-093619FM-16+0291KAMW "
+           "V0302905N00675005185MN0160935N5-00505-00835999999ADDGA1075+"
+           "005185999GA2085+010065999GD13991+0051859GD24991+0100659"
+           "GE19MSL   +99999+99999GF199999999999005181999999MA1102545"
+           "099065REMMET09501/01/16 01:13:02 SPECI KAMW 010713Z "
+           "29013KT 10SM BKN017 OVC033 M05/M08 A3028 RMK AO2 T10501083")
+    data = ds3505.parser(msg, 'KAMW', add_metar=True)
+    cursor = FakeCursor()
+    ds3505.sql(cursor, 'KAMW', data)
+    tokens = re.search(r"INSERT\s+into\s+(\w+)\s*\(([^)]+)\)", cursor.sql,
+                       re.IGNORECASE)
+    assert [c.strip() for c in tokens.group(2).split(",")] == COLUMNS
+    (table, row) = to_row('KAMW', data)
+    assert table == tokens.group(1)
+    # report_type is a literal within the INSERT
+    assert row == list(cursor.args) + [REPORT_TYPE]
+    row[COLUMNS.index('wxcodes')] = ['-RA', 'BR']
+    payload = to_csv([row]).read()
+    assert '"{""-RA"",""BR""}"' in payload
+    assert NULL in payload
 
 
 if __name__ == '__main__':
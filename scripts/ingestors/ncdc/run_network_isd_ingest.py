@@ -1,14 +1,14 @@
 """Process a network's worth of ISD data, please
 
-    python run_network_isd_ingest.py <network>
+    python run_network_isd_ingest.py <network> [workers]
     ftp://ftp.ncdc.noaa.gov/pub/data/noaa
 """
 from __future__ import print_function
 import sys
 import datetime
-import subprocess
 
 from pyiem.network import Table as NetworkTable
+from ingest_isd import ingest
 
 
 def build_xref():
@@ -34,7 +34,9 @@ def build_xref():
 def main(argv):
     """Go Main Go"""
     network = argv[1]
+    workers = int(argv[2]) if len(argv) > 2 else 8
     xref = build_xref()
+    jobs = []
     nt = NetworkTable(network)
     for station in nt.sts:
         if nt.sts[station]['archive_begin'] is None:
@@ -49,10 +51,15 @@ def main(argv):
             if option[2].year == eyear:
                 continue
             stid = station if len(station) == 4 else 'K'+station
-            cmd = ("python ingest_isd.py %s %s %s %s %s"
-                   ) % (option[0], option[1], stid, option[2].year, eyear)
-            print(cmd)
-            subprocess.call(cmd, shell=True)
+            print(("    %s %s %s %s-%s"
+                   ) % (option[0], option[1], stid, option[2].year, eyear))
+            # airforce ids are not always numeric, ie A00023
+            jobs.extend([(option[0], option[1], stid, year)
+                         for year in range(option[2].year, eyear)])
+    failed, msgs = ingest(jobs, workers)
+    for job, msg in sorted(failed):
+        print(" failed: %s %s" % (job, msg))
+    print("\n".join(sorted(msgs)))
 
 
 if __name__ == '__main__':
@@ -17,11 +17,16 @@ import requests
 import pytz
 import numpy as np
 import pandas as pd
-from pyiem.observation import Observation
 from pyiem.datatypes import temperature, humidity, distance, speed
+from pyiem.network import Table as NetworkTable
 import pyiem.meteorology as met
 from pyiem.util import get_dbconn
 
+sys.path.insert(0, "../isuag")
+import fix_precip  # noqa
+import fix_solar  # noqa
+import fix_temps  # noqa
+
 ISUAG = get_dbconn('isuag')
 
 ACCESS = get_dbconn('iem')
@@ -54,6 +59,16 @@ VARCONV = {'timestamp': 'valid',
            "bp_mmhg_avg": "bpres_avg",
            }
 
+# IEMAccess current columns we may set
+CURRENT_COLS = ['tmpf', 'relh', 'dwpf', 'srad', 'pcounter', 'phour', 'sknt',
+                'gust', 'drct', 'c1tmpf', 'c2tmpf', 'c3tmpf', 'c4tmpf',
+                'c2smv', 'c3smv', 'c4smv']
+# IEMAccess summary columns we may set
+SUMMARY_COLS = ['max_tmpf', 'min_tmpf', 'max_dwpf', 'min_dwpf', 'max_rh',
+                'min_rh', 'max_sknt', 'max_sknt_ts', 'max_gust',
+                'max_gust_ts', 'pday', 'et_inch', 'srad_mj', 'avg_sknt',
+                'vector_avg_drct']
+TZNAME = 'America/Chicago'
 TSOIL_COLS = ['tsoil_c_avg', 't06_c_avg', 't12_c_avg', 't24_c_avg',
               't50_c_avg']
 BASE = '/mnt/home/loggernet'
@@ -88,27 +103,33 @@ STATIONS = {'CAMI4': 'Calumet',
             }
 
 
-def qcval(df, colname, floor, ceiling):
-    """Make sure the value falls within some bounds"""
-    df.loc[df[colname] < floor, colname] = floor
-    df.loc[df[colname] > ceiling, colname] = ceiling
-    return np.where(np.logical_or(df[colname] == floor,
-                                  df[colname] == ceiling),
-                    'B', None)
+def qcval(values, floor, ceiling):
+    """Make sure the values fall within some bounds
+
+    Returns:
+      (values clipped to the bounds, flags)
+    """
+    values = values.clip(floor, ceiling)
+    return values, np.where(np.logical_or(values == floor,
+                                          values == ceiling), 'B', None)
 
 
-def qcval2(df, colname, floor, ceiling):
-    """Make sure the value falls within some bounds, Null if not"""
-    df.loc[df[colname] < floor, colname] = np.nan
-    df.loc[df[colname] > ceiling, colname] = np.nan
-    return np.where(pd.isnull(df[colname]), 'B', None)
+def qcval2(values, floor, ceiling):
+    """Make sure the values fall within some bounds, Null if not
 
+    Returns:
+      (values, flags)
+    """
+    values = values.where((values >= floor) & (values <= ceiling))
+    return values, np.where(pd.isnull(values), 'B', None)
 
-def make_time(string):
-    """Convert a time in the file to a datetime"""
-    tstamp = datetime.datetime.strptime(string, '%Y-%m-%d %H:%M:%S')
-    tstamp = tstamp.replace(tzinfo=pytz.FixedOffset(-360))
-    return tstamp
+
+def make_time(values):
+    """Convert a time or a Series of times in the file to datetimes"""
+    tstamp = pd.to_datetime(values, format='%Y-%m-%d %H:%M:%S')
+    if isinstance(tstamp, pd.Series):
+        return tstamp.dt.tz_localize(pytz.FixedOffset(-360))
+    return tstamp.tz_localize(pytz.FixedOffset(-360))
 
 
 def common_df_logic(filename, maxts, nwsli, tablename):
@@ -121,32 +142,33 @@ def common_df_logic(filename, maxts, nwsli, tablename):
     df.columns = map(str.lower, df.columns)
     # rename columns to rectify differences
     df.rename(columns=VARCONV, inplace=True)
-    df['valid'] = df['valid'].apply(make_time)
+    df['valid'] = make_time(df['valid'])
     if tablename == 'sm_daily':
         # Rework the valid column into the appropriate date
         df['valid'] = df['valid'].dt.date - datetime.timedelta(days=1)
-    df = df[df['valid'] > maxts].copy()
+    df = df[df['valid'] > maxts]
     if df.empty:
         return
 
-    df.drop('record', axis=1, inplace=True)
-    # Create _qc and _f columns
+    df = df.drop('record', axis=1)
+    # Create _qc and _f columns, all added to the frame at once
+    qc = {}
     for colname in df.columns:
         if colname == 'valid':
             continue
-        df['%s_qc' % (colname, )] = df[colname]
+        values, flags = df[colname], None
         if colname.startswith('calc_vwc'):
-            df['%s_f' % (colname, )] = qcval(df, '%s_qc' % (colname, ),
-                                             0.01, 0.7)
+            values, flags = qcval(values, 0.01, 0.7)
         elif colname in TSOIL_COLS:
-            df['%s_f' % (colname, )] = qcval2(df, '%s_qc' % (colname, ),
-                                              -20., 37.)
-        else:
-            df['%s_f' % (colname, )] = None
+            values, flags = qcval2(values, -20., 37.)
+        qc['%s_qc' % (colname, )] = values
+        qc['%s_f' % (colname, )] = pd.Series(flags, index=df.index,
+                                             dtype=object)
+    df = pd.concat([df, pd.DataFrame(qc, index=df.index)], axis=1)
 
     df['station'] = nwsli
     if 'ws_mph_tmx' in df.columns:
-        df['ws_mph_tmx'] = df['ws_mph_tmx'].apply(make_time)
+        df['ws_mph_tmx'] = make_time(df['ws_mph_tmx'])
     output = io.StringIO()
     df.to_csv(output, sep="\t", header=False, index=False)
     output.seek(0)
@@ -158,163 +180,243 @@ def common_df_logic(filename, maxts, nwsli, tablename):
     return df
 
 
+def access_obs(df, precipcol):
+    """Compute the IEMAccess obs for 15 minute or hourly data"""
+    obs = pd.DataFrame({'station': df['station'], 'valid': df['valid']})
+    tmpc = temperature(df['tair_c_avg_qc'].values, 'C')
+    relh = humidity(df['rh_qc'].values, '%')
+    with np.errstate(invalid='ignore', divide='ignore'):
+        tmpf = tmpc.value('F')
+        ok = (tmpf > -50) & (tmpf < 140)
+        obs['tmpf'] = np.where(ok, tmpf, np.nan)
+        obs['relh'] = np.where(ok, relh.value('%'), np.nan)
+        obs['dwpf'] = np.where(ok, met.dewpoint(tmpc, relh).value('F'),
+                               np.nan)
+    obs['srad'] = df['slrkw_avg_qc']
+    obs[precipcol] = np.round(distance(df['rain_mm_tot_qc'].values,
+                                       'MM').value('IN'), 2)
+    obs['sknt'] = speed(df['ws_mps_s_wvt_qc'].values, 'MPS').value('KT')
+    if 'ws_mph_max' in df.columns:
+        obs['gust'] = speed(df['ws_mph_max_qc'].values, 'MPH').value('KT')
+        obs['max_gust_ts'] = df['ws_mph_tmx']
+    obs['drct'] = df['winddir_d1_wvt_qc']
+    for col, tcol in [('c1tmpf', 'tsoil_c_avg'), ('c2tmpf', 't12_c_avg'),
+                      ('c3tmpf', 't24_c_avg'), ('c4tmpf', 't50_c_avg')]:
+        if tcol in df.columns:
+            obs[col] = temperature(df['%s_qc' % (tcol, )].values,
+                                   'C').value('F')
+    for col, vcol in [('c2smv', 'calc_vwc_12_avg'),
+                      ('c3smv', 'calc_vwc_24_avg'),
+                      ('c4smv', 'calc_vwc_50_avg')]:
+        if vcol in df.columns:
+            obs[col] = df['%s_qc' % (vcol, )] * 100.0
+    return obs
+
+
 def m15_process(nwsli, maxts):
-    """ Process the 15minute file """
-    acursor = ACCESS.cursor()
+    """ Process the 15minute file
+
+    Returns:
+      DataFrame of IEMAccess obs
+    """
     fn = "%s/%s_Min15SI.dat" % (BASE, STATIONS[nwsli])
     df = common_df_logic(fn, maxts, nwsli, "sm_15minute")
     if df is None:
-        return 0
-
-    # Update IEMAccess
-    processed = 0
-    for _i, row in df.iterrows():
-        ob = Observation(nwsli, 'ISUSM', row['valid'])
-        tmpc = temperature(row['tair_c_avg_qc'], 'C')
-        if tmpc.value('F') > -50 and tmpc.value('F') < 140:
-            ob.data['tmpf'] = tmpc.value('F')
-            relh = humidity(row['rh_qc'], '%')
-            ob.data['relh'] = relh.value('%')
-            ob.data['dwpf'] = met.dewpoint(tmpc, relh).value('F')
-        ob.data['srad'] = row['slrkw_avg_qc']
-        ob.data['pcounter'] = round(
-            distance(row['rain_mm_tot_qc'], 'MM').value('IN'), 2)
-        ob.data['sknt'] = speed(row['ws_mps_s_wvt_qc'], 'MPS').value('KT')
-        ob.data['gust'] = speed(row['ws_mph_max_qc'], 'MPH').value('KT')
-        ob.data['max_gust_ts'] = row['ws_mph_tmx']
-        ob.data['drct'] = row['winddir_d1_wvt_qc']
-        if 'tsoil_c_avg' in df.columns:
-            ob.data['c1tmpf'] = temperature(row['tsoil_c_avg_qc'],
-                                            'C').value('F')
-        ob.data['c2tmpf'] = temperature(row['t12_c_avg_qc'], 'C').value('F')
-        ob.data['c3tmpf'] = temperature(row['t24_c_avg_qc'], 'C').value('F')
-        if 't50_c_avg' in df.columns:
-            ob.data['c4tmpf'] = temperature(row['t50_c_avg_qc'],
-                                            'C').value('F')
-        if 'calc_vwc_12_avg' in df.columns:
-            ob.data['c2smv'] = row['calc_vwc_12_avg_qc'] * 100.0
-        if 'calc_vwc_24_avg' in df.columns:
-            ob.data['c3smv'] = row['calc_vwc_24_avg_qc'] * 100.0
-        if 'calc_vwc_50_avg' in df.columns:
-            ob.data['c4smv'] = row['calc_vwc_50_avg_qc'] * 100.0
-        ob.save(acursor, force_current_log=True)
-        # print 'soilm_ingest.py station: %s ts: %s hrly updated no data?' % (
-        #                                        nwsli, valid)
-        processed += 1
-    acursor.close()
-    ACCESS.commit()
-    return processed
+        return pd.DataFrame()
+    return access_obs(df, 'pcounter')
 
 
 def hourly_process(nwsli, maxts):
-    """ Process the hourly file """
-    # print '-------------- HOURLY PROCESS ---------------'
-    acursor = ACCESS.cursor()
+    """ Process the hourly file
+
+    Returns:
+      DataFrame of IEMAccess obs
+    """
     fn = "%s/%s_HrlySI.dat" % (BASE, STATIONS[nwsli])
     df = common_df_logic(fn, maxts, nwsli, "sm_hourly")
     if df is None:
-        return 0
-    processed = 0
-    for _i, row in df.iterrows():
-        # Update IEMAccess
-        # print nwsli, valid
-        ob = Observation(nwsli, 'ISUSM', row['valid'])
-        tmpc = temperature(row['tair_c_avg_qc'], 'C')
-        if tmpc.value('F') > -50 and tmpc.value('F') < 140:
-            ob.data['tmpf'] = tmpc.value('F')
-            relh = humidity(row['rh_qc'], '%')
-            ob.data['relh'] = relh.value('%')
-            ob.data['dwpf'] = met.dewpoint(tmpc, relh).value('F')
-        ob.data['srad'] = row['slrkw_avg_qc']
-        ob.data['phour'] = round(distance(row['rain_mm_tot_qc'],
-                                          'MM').value('IN'), 2)
-        ob.data['sknt'] = speed(row['ws_mps_s_wvt_qc'], 'MPS').value("KT")
-        if 'ws_mph_max' in df.columns:
-            ob.data['gust'] = speed(row['ws_mph_max_qc'], 'MPH').value('KT')
-            ob.data['max_gust_ts'] = row['ws_mph_tmx']
-        ob.data['drct'] = row['winddir_d1_wvt_qc']
-        if 'tsoil_c_avg' in df.columns:
-            ob.data['c1tmpf'] = temperature(row['tsoil_c_avg_qc'],
-                                            'C').value('F')
-        ob.data['c2tmpf'] = temperature(row['t12_c_avg_qc'], 'C').value('F')
-        ob.data['c3tmpf'] = temperature(row['t24_c_avg_qc'], 'C').value('F')
-        if 't50_c_avg' in df.columns:
-            ob.data['c4tmpf'] = temperature(row['t50_c_avg_qc'],
-                                            'C').value('F')
-        if 'calc_vwc_12_avg' in df.columns:
-            ob.data['c2smv'] = row['calc_vwc_12_avg_qc'] * 100.0
-        if 'calc_vwc_24_avg' in df.columns:
-            ob.data['c3smv'] = row['calc_vwc_24_avg_qc'] * 100.0
-        if 'calc_vwc_50_avg' in df.columns:
-            ob.data['c4smv'] = row['calc_vwc_50_avg_qc'] * 100.0
-        ob.save(acursor)
-        # print 'soilm_ingest.py station: %s ts: %s hrly updated no data?' % (
-        #                                        nwsli, valid)
-        processed += 1
-    acursor.close()
-    ACCESS.commit()
-    return processed
+        return pd.DataFrame()
+    return access_obs(df, 'phour')
 
 
 def daily_process(nwsli, maxts):
-    """ Process the daily file """
-    acursor = ACCESS.cursor()
-    # print '-------------- DAILY PROCESS ----------------'
+    """ Process the daily file
+
+    Returns:
+      DataFrame of IEMAccess summary rows
+    """
     fn = "%s/%s_DailySI.dat" % (BASE, STATIONS[nwsli])
     df = common_df_logic(fn, maxts, nwsli, "sm_daily")
     if df is None:
-        return 0
-
-    processed = 0
-    for _i, row in df.iterrows():
-        # Need a timezone
-        valid = datetime.datetime(row['valid'].year, row['valid'].month,
-                                  row['valid'].day, 12, 0)
-        valid = valid.replace(tzinfo=pytz.timezone("America/Chicago"))
-        ob = Observation(nwsli, 'ISUSM', valid)
-        ob.data['max_tmpf'] = temperature(row['tair_c_max_qc'], 'C').value('F')
-        ob.data['min_tmpf'] = temperature(row['tair_c_min_qc'], 'C').value('F')
-        ob.data['pday'] = round(distance(row['rain_mm_tot_qc'],
-                                         'MM').value('IN'), 2)
-        if valid not in EVENTS['days']:
-            EVENTS['days'].append(valid)
-        ob.data['et_inch'] = distance(row['dailyet_qc'], 'MM').value('IN')
-        ob.data['srad_mj'] = row['slrmj_tot_qc']
-        # Someday check if this is apples to apples here
-        ob.data['vector_avg_drct'] = row['winddir_d1_wvt_qc']
-        if ob.data['max_tmpf'] is None:
-            EVENTS['reprocess_temps'] = True
-        if ob.data['srad_mj'] == 0 or np.isnan(ob.data['srad_mj']):
-            print(("soilm_ingest.py station: %s ts: %s has 0 solar"
-                   ) % (nwsli, valid.strftime("%Y-%m-%d")))
-            EVENTS['reprocess_solar'] = True
-        if 'ws_mps_max' in df.columns:
-            ob.data['max_sknt'] = speed(row['ws_mps_max_qc'],
-                                        'MPS').value('KT')
-        ob.data['avg_sknt'] = speed(row['ws_mps_s_wvt_qc'], 'MPS').value('KT')
-        ob.save(acursor)
-
-        processed += 1
+        return pd.DataFrame()
+
+    sdf = pd.DataFrame({'station': df['station'], 'day': df['valid']})
+    sdf['max_tmpf'] = temperature(df['tair_c_max_qc'].values,
+                                  'C').value('F')
+    sdf['min_tmpf'] = temperature(df['tair_c_min_qc'].values,
+                                  'C').value('F')
+    sdf['pday'] = np.round(distance(df['rain_mm_tot_qc'].values,
+                                    'MM').value('IN'), 2)
+    sdf['et_inch'] = distance(df['dailyet_qc'].values, 'MM').value('IN')
+    sdf['srad_mj'] = df['slrmj_tot_qc']
+    # Someday check if this is apples to apples here
+    sdf['vector_avg_drct'] = df['winddir_d1_wvt_qc']
+    if 'ws_mps_max' in df.columns:
+        sdf['max_sknt'] = speed(df['ws_mps_max_qc'].values,
+                                'MPS').value('KT')
+    sdf['avg_sknt'] = speed(df['ws_mps_s_wvt_qc'].values, 'MPS').value('KT')
+
+    for day in sdf['day']:
+        if day not in EVENTS['days']:
+            EVENTS['days'].append(day)
+    if sdf['max_tmpf'].isnull().any():
+        EVENTS['reprocess_temps'] = True
+    for day in sdf.loc[(sdf['srad_mj'] == 0) | sdf['srad_mj'].isnull(),
+                       'day']:
+        print(("soilm_ingest.py station: %s ts: %s has 0 solar"
+               ) % (nwsli, day.strftime("%Y-%m-%d")))
+        EVENTS['reprocess_solar'] = True
+    return sdf
+
+
+def copy_temp(acursor, table, df):
+    """COPY a DataFrame into a temp table dropped at commit"""
+    types = {'station': 'varchar(20)', 'day': 'date',
+             'valid': 'timestamptz', 'max_sknt_ts': 'timestamptz',
+             'max_gust_ts': 'timestamptz'}
+    acursor.execute("CREATE TEMP TABLE " + table + " (" +
+                    ", ".join(["%s %s" % (col, types.get(col, 'real'))
+                               for col in df.columns]) +
+                    ") ON COMMIT DROP")
+    output = io.StringIO()
+    df.to_csv(output, sep="\t", header=False, index=False, na_rep='\\N')
+    output.seek(0)
+    acursor.copy_from(output, table, columns=df.columns)
+
+
+def save_current(acursor, obs, force_current_log=False):
+    """Update current with the newest ob for each station
+
+    The other obs newer than current, which saving the obs one at a time
+    would have run through current, go straight to current_log, as do the
+    older obs when force_current_log is set.
+    """
+    cols = [c for c in CURRENT_COLS if c in obs.columns]
+    copy_temp(acursor, 'isusm_obs', obs[['station', 'valid'] + cols])
+    acursor.execute("""
+        INSERT into current_log (iemid, valid, """ + ", ".join(cols) + """)
+        SELECT t.iemid, o.valid, """ +
+                    ", ".join(["o.%s" % (c, ) for c in cols]) + """
+        from isusm_obs o JOIN stations t ON (o.station = t.id and
+        t.network = 'ISUSM') JOIN current c ON (c.iemid = t.iemid),
+        (SELECT station, max(valid) as valid from isusm_obs
+         GROUP by station) m
+        WHERE m.station = o.station and
+        ((o.valid >= c.valid and o.valid < m.valid) or
+         (o.valid < c.valid and %s))
+    """, (force_current_log, ))
+    acursor.execute("""
+        UPDATE current c SET """ +
+                    ", ".join(["%s = o.%s" % (c, c) for c in cols]) + """,
+        valid = o.valid FROM
+        (SELECT DISTINCT ON (station) * from isusm_obs
+         ORDER by station, valid DESC) o, stations t
+        WHERE o.station = t.id and t.network = 'ISUSM'
+        and c.iemid = t.iemid and o.valid >= c.valid
+    """)
+
+
+def summarize(obs):
+    """Aggregate obs to one summary row per station and local day"""
+    obs = obs.assign(day=obs['valid'].dt.tz_convert(TZNAME).dt.date)
+    gb = obs.groupby(['station', 'day'])
+    sdf = pd.DataFrame({'max_tmpf': gb['tmpf'].max(),
+                        'min_tmpf': gb['tmpf'].min(),
+                        'max_dwpf': gb['dwpf'].max(),
+                        'min_dwpf': gb['dwpf'].min(),
+                        'max_rh': gb['relh'].max(),
+                        'min_rh': gb['relh'].min()})
+    for col in ['sknt', 'gust']:
+        if col not in obs.columns:
+            continue
+        # the ob with the largest value for each day
+        top = obs.sort_values(col, na_position='first').drop_duplicates(
+            ['station', 'day'], keep='last').set_index(['station', 'day'])
+        sdf['max_%s' % (col, )] = top[col]
+        tscol = 'max_%s_ts' % (col, )
+        sdf[tscol] = (top[tscol].fillna(top['valid'])
+                      if tscol in top.columns else top['valid'])
+    return sdf.reset_index()
+
+
+def save_summary(acursor, sdf):
+    """Merge per station and day summary rows into IEMAccess"""
+    sdf = sdf.reindex(columns=['station', 'day'] + SUMMARY_COLS)
+    copy_temp(acursor, 'isusm_summary', sdf)
+    for year in sorted(set([day.year for day in sdf['day']])):
+        table = "summary_%s" % (year, )
+        args = (datetime.date(year, 1, 1), datetime.date(year + 1, 1, 1))
+        acursor.execute("""
+            INSERT into """ + table + """ (iemid, day)
+            SELECT t.iemid, o.day from isusm_summary o JOIN stations t
+            ON (o.station = t.id and t.network = 'ISUSM')
+            WHERE o.day >= %s and o.day < %s and not exists (
+                SELECT 1 from """ + table + """ s WHERE
+                s.iemid = t.iemid and s.day = o.day)
+        """, args)
+        acursor.execute("""
+            UPDATE """ + table + """ s SET
+            max_tmpf = greatest(s.max_tmpf, o.max_tmpf),
+            min_tmpf = least(s.min_tmpf, o.min_tmpf),
+            max_dwpf = greatest(s.max_dwpf, o.max_dwpf),
+            min_dwpf = least(s.min_dwpf, o.min_dwpf),
+            max_rh = greatest(s.max_rh, o.max_rh),
+            min_rh = least(s.min_rh, o.min_rh),
+            max_sknt_ts = (CASE WHEN o.max_sknt > coalesce(s.max_sknt, -1)
+                           THEN coalesce(o.max_sknt_ts, s.max_sknt_ts)
+                           ELSE s.max_sknt_ts END),
+            max_sknt = greatest(s.max_sknt, o.max_sknt),
+            max_gust_ts = (CASE WHEN o.max_gust > coalesce(s.max_gust, -1)
+                           THEN coalesce(o.max_gust_ts, s.max_gust_ts)
+                           ELSE s.max_gust_ts END),
+            max_gust = greatest(s.max_gust, o.max_gust),
+            pday = coalesce(o.pday, s.pday),
+            et_inch = coalesce(o.et_inch, s.et_inch),
+            srad_mj = coalesce(o.srad_mj, s.srad_mj),
+            avg_sknt = coalesce(o.avg_sknt, s.avg_sknt),
+            vector_avg_drct = coalesce(o.vector_avg_drct, s.vector_avg_drct)
+            FROM isusm_summary o, stations t
+            WHERE o.station = t.id and t.network = 'ISUSM'
+            and s.iemid = t.iemid and s.day = o.day
+            and o.day >= %s and o.day < %s
+        """, args)
+
+
+def save_access(frames, force_current_log=False):
+    """Save the obs (or daily summary rows) for all stations at once"""
+    frames = [df for df in frames if not df.empty]
+    if not frames:
+        return
+    df = pd.concat(frames, ignore_index=True)
+    acursor = ACCESS.cursor()
+    if 'valid' in df.columns:
+        save_current(acursor, df, force_current_log)
+        df = summarize(df)
+    save_summary(acursor, df)
     acursor.close()
     ACCESS.commit()
-    return processed
 
 
 def update_pday():
     ''' Compute today's precip from the current_log archive of data '''
     acursor = ACCESS.cursor()
     acursor.execute("""
-    SELECT s.iemid, sum(case when phour > 0 then phour else 0 end) from
-    current_log s JOIN stations t on (t.iemid = s.iemid)
-    WHERE t.network = 'ISUSM' and valid > 'TODAY' GROUP by s.iemid
+    UPDATE summary s SET pday = d.pday FROM (
+        SELECT s.iemid, sum(case when phour > 0 then phour else 0 end)
+        as pday from current_log s JOIN stations t on (t.iemid = s.iemid)
+        WHERE t.network = 'ISUSM' and valid > 'TODAY' GROUP by s.iemid) d
+    WHERE s.iemid = d.iemid and s.day = 'TODAY'
     """)
-    data = {}
-    for row in acursor:
-        data[row[0]] = row[1]
-
-    for iemid in data:
-        acursor.execute("""UPDATE summary SET pday = %s
-        WHERE iemid = %s and day = 'TODAY'""", (data[iemid], iemid))
     acursor.close()
     ACCESS.commit()
 
@@ -419,33 +521,52 @@ def dump_madis_csv():
 def main(argv):
     """ Go main Go """
     stations = STATIONS if len(argv) == 1 else [argv[1], ]
+    m15obs = []
+    hrobs = []
+    dyobs = []
     for nwsli in stations:
         maxobs = get_max_timestamps(nwsli)
-        m15processed = m15_process(nwsli, maxobs['15minute'])
-        hrprocessed = hourly_process(nwsli, maxobs['hourly'])
-        dyprocessed = daily_process(nwsli, maxobs['daily'])
+        m15obs.append(m15_process(nwsli, maxobs['15minute']))
+        hrobs.append(hourly_process(nwsli, maxobs['hourly']))
+        dyobs.append(daily_process(nwsli, maxobs['daily']))
+        hrprocessed = len(hrobs[-1].index)
+        dyprocessed = len(dyobs[-1].index)
         if hrprocessed > 0:
             dump_raw_to_ldm(nwsli, dyprocessed, hrprocessed)
         if len(argv) > 1:
-            print("%s 15min:%s hr:%s daily:%s" % (nwsli, m15processed,
-                                                  hrprocessed, dyprocessed))
+            print("%s 15min:%s hr:%s daily:%s" % (
+                nwsli, len(m15obs[-1].index), hrprocessed, dyprocessed))
+    save_access(m15obs, force_current_log=True)
+    save_access(hrobs)
+    save_access(dyobs)
     update_pday()
 
-    if EVENTS['reprocess_solar']:
-        print("Calling fix_solar.py")
-        subprocess.call("python ../isuag/fix_solar.py", shell=True)
+    # The fixups run in process, once for all of the affected days
+    if EVENTS['reprocess_solar'] or EVENTS['days']:
+        print("Calling fix_solar.fix_nulls()")
+        fix_solar.fix_nulls()
     if EVENTS['reprocess_temps']:
-        print("Calling fix_temps.py")
-        subprocess.call("python ../isuag/fix_temps.py", shell=True)
-    for day in EVENTS['days']:
-        subprocess.call(("python ../isuag/fix_precip.py %s %s %s"
-                         ) % (day.year, day.month, day.day), shell=True)
-        subprocess.call(("python ../isuag/fix_solar.py %s %s %s"
-                         ) % (day.year, day.month, day.day), shell=True)
+        print("Calling fix_temps.main()")
+        fix_temps.main()
+    if EVENTS['days']:
+        nt = NetworkTable("ISUSM")
+        for day in EVENTS['days']:
+            fix_precip.process(day, nt)
+            fix_solar.check_date(day)
 
     dump_madis_csv()
 
 
+def test_qcval():
+    """Are our bounds and flags done column wise?"""
+    values, flags = qcval(pd.Series([0., 0.3, 0.9]), 0.01, 0.7)
+    assert list(values) == [0.01, 0.3, 0.7]
+    assert list(flags) == ['B', None, 'B']
+    values, flags = qcval2(pd.Series([-30., 10., np.nan]), -20., 37.)
+    assert np.isnan(values[0]) and values[1] == 10.
+    assert list(flags) == ['B', None, 'B']
+
+
 def test_make_tstamp():
     """Do we do the right thing with timestamps"""
     res = make_time("2017-08-31 19:00:00")
@@ -16,11 +16,15 @@ import sys
 import pytz
 import requests
 import pandas as pd
+import psycopg2.extras
 from pandas.io.sql import read_sql
 from pyiem.network import Table as NetworkTable
 from pyiem.datatypes import distance
 from pyiem.util import get_dbconn
 
+# points per request to the stage IV service, its MAXPOINTS
+STAGE4_MAXPOINTS = 20
+
 
 def print_debugging(station):
     """Add some more details to the output messages to help with ticket res"""
@@ -39,17 +43,23 @@ def print_debugging(station):
 
 def get_hdf(nt, date):
     """Fetch the hourly dataframe for this network"""
-    # Get our stage IV hourly totals
+    # Get our stage IV hourly totals, the service takes many points at once
+    # and provides UTC dates, so we need to request two days
+    stations = sorted(nt.sts.keys())
     rows = []
-    for station in nt.sts:
-        # service provides UTC dates, so we need to request two days
-        for ldate in [date, date + datetime.timedelta(days=1)]:
-            uri = ("http://iem.local/json/stage4/%.2f/%.2f/%s"
-                   ) % (nt.sts[station]['lon'],
-                        nt.sts[station]['lat'], ldate.strftime("%Y-%m-%d"))
-            res = requests.get(uri)
-            j = json.loads(res.content)
-            for entry in j['data']:
+    for i in range(0, len(stations), STAGE4_MAXPOINTS):
+        chunk = stations[i:i + STAGE4_MAXPOINTS]
+        uri = ("http://iem.local/json/stage4.py?lon=%s&lat=%s&valid=%s"
+               "&valid2=%s") % (
+                   ",".join(["%.2f" % (nt.sts[s]['lon'], ) for s in chunk]),
+                   ",".join(["%.2f" % (nt.sts[s]['lat'], ) for s in chunk]),
+                   date.strftime("%Y-%m-%d"),
+                   (date + datetime.timedelta(days=1)).strftime("%Y-%m-%d"))
+        res = requests.get(uri)
+        j = json.loads(res.content)
+        points = j['points'] if 'points' in j else [j, ]
+        for station, point in zip(chunk, points):
+            for entry in point['data']:
                 rows.append(dict(station=station,
                                  valid=datetime.datetime.strptime(
                                      entry['end_valid'],
@@ -61,15 +71,18 @@ def get_hdf(nt, date):
     return df
 
 
-def update_precip(date, station, hdf):
-    """Do the update work"""
+def get_window(date, hdf):
+    """Get the hourly data for the 7z to 7z window ending on date + 1"""
+    # the daily total is 12 CST to 12 CST, so that is always 6z
+    # so we want the 7z total
     sts = datetime.datetime(date.year, date.month, date.day, 7)
     sts = sts.replace(tzinfo=pytz.utc)
     ets = sts + datetime.timedelta(hours=24)
-    ldf = hdf[(hdf['station'] == station) &
-              (hdf['valid'] >= sts) &
-              (hdf['valid'] < ets)]
+    return hdf[(hdf['valid'] >= sts) & (hdf['valid'] < ets)]
+
 
+def update_precip(date, station, ldf):
+    """Do the update work"""
     newpday = distance(ldf['precip_in'].sum(), 'IN')
     # update iemaccess
     pgconn = get_dbconn('iem')
@@ -92,31 +105,33 @@ def update_precip(date, station, hdf):
     SET rain_mm_tot_qc = %s, rain_mm_tot_f = 'E'
     WHERE valid = %s and station = %s
     """, (newpday.value('MM'), date, station))
-    for _, row in ldf.iterrows():
+    rows = [(station, row.valid, distance(row.precip_in, 'IN').value('MM'))
+            for row in ldf.itertuples()]
+    if rows:
         # hourly
-        total = distance(row['precip_in'], 'IN').value('MM')
-        cursor.execute("""
-        UPDATE sm_hourly
-        SET rain_mm_tot_qc = %s, rain_mm_tot_f = 'E'
-        WHERE valid = %s and station = %s
-        """, (total, row['valid'], station))
-        # 15minute
-        for minute in [45, 30, 15, 0]:
-            cursor.execute("""
-            UPDATE sm_15minute
-            SET rain_mm_tot_qc = %s, rain_mm_tot_f = 'E'
-            WHERE valid = %s and station = %s
-            """, (total / 4.,
-                  row['valid'] - datetime.timedelta(minutes=minute), station))
+        psycopg2.extras.execute_values(cursor, """
+        UPDATE sm_hourly h
+        SET rain_mm_tot_qc = d.total, rain_mm_tot_f = 'E'
+        FROM (VALUES %s) as d(station, valid, total)
+        WHERE h.station = d.station and h.valid = d.valid
+        """, rows)
+        # 15minute, a quarter of the hour's total for each
+        psycopg2.extras.execute_values(cursor, """
+        UPDATE sm_15minute m
+        SET rain_mm_tot_qc = d.total / 4., rain_mm_tot_f = 'E'
+        FROM (VALUES %s) as d(station, valid, total)
+        WHERE m.station = d.station and m.valid <= d.valid
+        and m.valid > (d.valid - '1 hour'::interval)
+        """, rows)
     cursor.close()
     pgconn.commit()
 
 
-def main(argv):
-    """ Go main go """
-    date = datetime.date(int(argv[1]), int(argv[2]), int(argv[3]))
+def process(date, nt=None):
+    """QC the precipitation for a date"""
     pgconn = get_dbconn('isuag')
-    nt = NetworkTable("ISUSM")
+    if nt is None:
+        nt = NetworkTable("ISUSM")
 
     # Get our obs
     df = read_sql("""
@@ -129,17 +144,9 @@ def main(argv):
         return
 
     # lets try some QC
-    for station in df.index.values:
-        # the daily total is 12 CST to 12 CST, so that is always 6z
-        # so we want the 7z total
-        sts = datetime.datetime(date.year, date.month, date.day, 7)
-        sts = sts.replace(tzinfo=pytz.utc)
-        ets = sts + datetime.timedelta(hours=24)
-        # OK, get our data
-        ldf = hdf[(hdf['station'] == station) &
-                  (hdf['valid'] >= sts) &
-                  (hdf['valid'] < ets)]
-        df.at[station, 'stage4'] = ldf['precip_in'].sum()
+    hdf = get_window(date, hdf)
+    df['stage4'] = hdf.groupby('station')['precip_in'].sum()
+    df['stage4'] = df['stage4'].fillna(0)
 
     df['diff'] = df['obs'] - df['stage4']
     # We want to QC the case of having too low of precip, how low is too low?
@@ -149,7 +156,12 @@ def main(argv):
         print(("ISUSM fix_precip %s %s stageIV: %.2f obs: %.2f"
                ) % (date, station, row['stage4'], row['obs']))
         print_debugging(station)
-        update_precip(date, station, hdf)
+        update_precip(date, station, hdf[hdf['station'] == station])
+
+
+def main(argv):
+    """ Go main go """
+    process(datetime.date(int(argv[1]), int(argv[2]), int(argv[3])))
 
 
 if __name__ == '__main__':
@@ -16,9 +16,10 @@ def check_date(date):
     cursor2 = pgconn.cursor()
 
     nt = NetworkTable("ISUSM")
+    # only low values are candidates, see the checks below
     cursor.execute("""
         SELECT station, slrmj_tot_qc from sm_daily where
-        valid = %s ORDER by station ASC
+        valid = %s and slrmj_tot_qc <= 5 ORDER by station ASC
     """, (date, ))
     for row in cursor:
         station = row[0]
@@ -58,19 +59,20 @@ def fix_nulls():
     cursor2 = pgconn.cursor()
 
     nt = NetworkTable("ISUSM")
+    # sum the hourly data for each of the days in one pass
     cursor.execute("""
-     SELECT station, valid from sm_daily where (slrmj_tot_qc is null or
-     slrmj_tot_qc = 0) and valid > '2015-04-14' ORDER by valid ASC
+     SELECT d.station, d.valid, sum(h.slrmj_tot_qc), count(h.valid)
+     from sm_daily d LEFT JOIN sm_hourly h ON (h.station = d.station
+     and h.valid >= d.valid
+     and h.valid < d.valid + '23 hours 59 minutes'::interval)
+     WHERE (d.slrmj_tot_qc is null or d.slrmj_tot_qc = 0)
+     and d.valid > '2015-04-14' GROUP by d.station, d.valid
+     ORDER by d.valid ASC
     """)
     for row in cursor:
         station = row[0]
         v1 = datetime.datetime(row[1].year, row[1].month, row[1].day)
-        v2 = v1.replace(hour=23, minute=59)
-        cursor2.execute("""
-        SELECT sum(slrmj_tot_qc), count(*) from sm_hourly WHERE
-        station = %s and valid >= %s and valid < %s
-        """, (station, v1, v2))
-        row2 = cursor2.fetchone()
+        row2 = row[2:]
         if row2[0] is None or row2[0] < 0.01:
             print('Double Failure %s %s' % (station, v1.strftime("%d %b %Y")))
             # Go fetch me the IEMRE value!
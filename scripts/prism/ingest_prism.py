@@ -18,6 +18,10 @@ import numpy as np
 from pyiem.iemre import daily_offset
 from pyiem.util import ncopen
 
+sys.path.insert(0, "../../include/python")
+from precipsum import VARNAMES as CUMSUM_VARNAMES, update_cumsum  # noqa
+from pointseries import mark_rewritten  # noqa
+
 
 def do_process(valid, fn):
     """Process this file, please """
@@ -27,7 +31,10 @@ def do_process(valid, fn):
     nc = ncopen("/mesonet/data/prism/%s_daily.nc" % (valid.year,), 'a')
     idx = daily_offset(valid)
     nc.variables[varname][idx] = np.flipud(data[0])
+    if varname in CUMSUM_VARNAMES:
+        update_cumsum(nc, varname, idx)
     nc.close()
+    mark_rewritten("/mesonet/data/prism/%s_daily.nc" % (valid.year,), idx)
 
 
 def do_download(valid):
@@ -2,61 +2,62 @@
 
     1) Ingest data into per station per day text files
     2) Send wind alerts
+
+The feed socket is waited upon with select, each line is handled as it
+arrives by one combined parser and the station state is kept within a numpy
+structured array (see `StationStore`), which is also what is saved to disk
+between restarts.  Once a minute the winds are averaged, alerts sent and the
+archive rows buffered, the buffered rows are appended to the archive files
+every `_FLUSH_INTERVAL` seconds.  A dropped connection is retried right away
+with a backoff, a feed without data for three minutes is dropped and
+reconnected.  The state saved as a pickle (`db.p`) by prior versions is
+converted on the first start.
 """
 from __future__ import print_function
 # Python Imports
 import re
-import time
-import datetime
-import telnetlib
 import os
+import time
 import shutil
+import pickle
+import select
+import socket
+import datetime
 import traceback
 import logging
 import smtplib
 from io import StringIO
 from email.mime.text import MIMEText
 
+import numpy as np
 import psycopg2.extras
-from pyiem.util import get_dbconn
+from pyiem.util import get_dbconn, drct2text
 
 # Local stuff
-import nwnob  # @UnresolvedImport
 import secret  # @UnresolvedImport
 
-MESOSITE = get_dbconn('mesosite')
-mcursor = MESOSITE.cursor(cursor_factory=psycopg2.extras.DictCursor)
-
 logging.basicConfig(filename='/mesonet/data/logs/nwn.log', filemode='a')
 logger = logging.getLogger()
 logger.addHandler(logging.StreamHandler())
 logger.setLevel(logging.INFO)
 
-# Load up locs
-locs = {}
-mcursor.execute("""
-    SELECT nwn_id, id, ST_x(geom) as lon, ST_y(geom) as lat, name,
-    network, wfo, county from stations
-    WHERE network in ('KCCI', 'KELO', 'KIMT') and nwn_id is not null
-    """)
-for row in mcursor:
-    locs[int(row['nwn_id'])] = {
-        'nwsli': row['id'],
-        'lat': row['lat'],
-        'lon': row['lon'],
-        'name': row['name'],
-        'tv': row['network'],
-        'routes': [row['network'], row['wfo'], 'EMAIL'],
-        'county': row['county'],
-    }
-MESOSITE.close()
-
-rejects = open("/mesonet/data/logs/rejects.log", 'w')
-
-db = {}
 _WIND_THRESHOLD = 58
 _ARCHIVE_BASE = "/mesonet/ARCHIVE/raw/snet/"
 _CURRENT_BASE = "/mesonet/data/current/"
+_STATEFN = "db.npy"
+# the pickled nwnob.nwnOB state of prior versions
+_OLDSTATEFN = "db.p"
+# seconds between processing cycles
+_CYCLE = 58
+# seconds between appends to the archive files
+_FLUSH_INTERVAL = 300
+# cycles between saves of the station state
+_SAVE_CYCLES = 15
+# seconds to wait for a prompt or data from the server
+_TIMEOUT = 10
+# reconnect backoff seconds, doubled on each failure up to the max
+_BACKOFF = 1
+_MAX_BACKOFF = 60
 
 txt2drct = {
  'N': 360, 'NNE': 25, 'NE': 45, 'ENE': 70,
@@ -64,145 +65,322 @@ txt2drct = {
  'S': 180, 'SSW': 205, 'SW': 225, 'WSW': 250,
  'W': 270, 'WNW': 295, 'NW': 315, 'NNW': 335}
 
-_CURRENT_RE = ("[A-Z] ([0-9]?[0-9][0-9])\s+([0-2][0-9]:[0-9][0-9]) "
-               "([0-1][0-9]/[0-3][0-9]/[0-9][0-9])\s+([A-Z]{1,3})\s+"
-               "([0-9][0-9])(MPH|KTS) ([0-9][0-9][0-9])[F,K] ...F "
-               "([0-9\-]{3})F ([0-9][0-9][0-9])% ([0-9]+.[0-9][0-9])"
-               "([\"RFS]) ([0-9]+.[0-9][0-9])\"D ([0-9]+.[0-9][0-9])\"M")
-_MAX_RE = ("[A-Z] ([0-9]?[0-9][0-9])\s+(Max)\s+([0-1][0-9]/[0-3][0-9]/"
-           "[0-9][0-9])\s+([A-Z]{1,3})\s+([0-9][0-9])(MPH|KTS) "
-           "([0-9][0-9][0-9])[F,K] ...F (...)F ([0-9][0-9][0-9])% "
-           "([0-9]+.[0-9][0-9])([\"RFS]) ([0-9]+.[0-9][0-9])\"D "
-           "([0-9]+.[0-9][0-9])\"M")
-_MIN_RE = ("[A-Z] ([0-9]?[0-9][0-9])\s+(Min)\s+([0-1][0-9]/"
-           "[0-3][0-9]/[0-9][0-9])\s+([A-Z]{1,3})\s+([0-9][0-9])(MPH|KTS) "
-           "([0-9][0-9][0-9])[F,K] ...F (...)F ([0-9][0-9][0-9])% "
-           "([0-9]+.[0-9][0-9])([\"RFS]) ([0-9]+.[0-9][0-9])\"D "
-           "([0-9]+.[0-9][0-9])\"M")
-
-
-def makeConnect():
-    logger.info("\n ------ BEGIN makeConnect ------ \n")
-    notConnected = True
-    while notConnected:
-        try:
-            tn = telnetlib.Telnet('iem-nwnserver', 14996)
-            tn.read_until(b"login> ", 10)
-            tn.write(("%s\r\n" % (secret.cfg['hubuser'],)).encode('utf-8'))
-            tn.read_until(b"password> ", 10)
-            tn.write(("%s\r\n" % (secret.cfg['hubpass'],)).encode('utf-8'))
-            notConnected = False
-        except Exception as _exp:
-            logger.exception("Error in makeConnect()")
-            time.sleep(58)
-
-    logger.info("\n -------END makeConnect ------ \n")
-    return tn
-
-
-def process(dataStr):
+# One pattern for the current, Max and Min lines, which only differ by the
+# time (current) or kind (Max, Min) following the station identifier
+_LINE_RE = re.compile(
+    r"[A-Z] (?P<sid>[0-9]?[0-9][0-9])\s+"
+    r"(?:(?P<time>[0-2][0-9]:[0-9][0-9]) |(?P<kind>Max|Min)\s+)"
+    r"(?P<date>[0-1][0-9]/[0-3][0-9]/[0-9][0-9])\s+"
+    r"(?P<drct>[A-Z]{1,3})\s+(?P<sped>[0-9][0-9])(?P<units>MPH|KTS) "
+    r"(?P<srad>[0-9][0-9][0-9])[F,K] ...F (?P<tmpf>...)F "
+    r"(?P<relh>[0-9][0-9][0-9])% (?P<alti>[0-9]+.[0-9][0-9])"
+    r"(?P<ptend>[\"RFS]) (?P<pday>[0-9]+.[0-9][0-9])\"D "
+    r"(?P<pmonth>[0-9]+.[0-9][0-9])\"M")
+
+STATE_DTYPE = np.dtype([
+    ('sid', 'i4'), ('valid', 'f8'), ('lvalid', 'f8'),
+    ('tmpf', 'f4'), ('max_tmpf', 'f4'), ('min_tmpf', 'f4'),
+    ('relh', 'f4'), ('max_relh', 'f4'), ('min_relh', 'f4'),
+    ('srad', 'f4'), ('max_srad', 'f4'),
+    ('alti', 'f4'), ('max_alti', 'f4'), ('min_alti', 'f4'),
+    ('ptend', 'U1'), ('pday', 'f4'), ('pmonth', 'f4'), ('prate', 'f4'),
+    ('sped', 'f4'), ('drct', 'f4'), ('drcttxt', 'U3'),
+    ('spedsum', 'f8'), ('usum', 'f8'), ('vsum', 'f8'), ('count', 'i4'),
+    ('max_sped', 'f4'), ('max_sped_ts', 'f8'), ('max_drcttxt', 'U3'),
+    ('alert_sped', 'f4'),
+])
+
+
+class StationStore(object):
+    """Station state kept as rows of a numpy structured array.
+
+    Times are seconds since the epoch and missing values are NaN.
+    """
+
+    def __init__(self, capacity=256):
+        """Constructor"""
+        self.data = self.empty(capacity)
+        self.size = 0
+        # station id -> row
+        self.index = {}
+        # row -> list of (sped, drcttxt) wind samples this cycle
+        self.winds = {}
+
+    @staticmethod
+    def empty(capacity):
+        """Create missing rows"""
+        data = np.zeros(capacity, STATE_DTYPE)
+        for name in STATE_DTYPE.names:
+            if STATE_DTYPE[name].kind == 'f' and not name.endswith('sum'):
+                data[name] = np.nan
+        return data
+
+    def row(self, sid):
+        """Get the row for a station, adding it if need be"""
+        if sid in self.index:
+            return self.index[sid]
+        if self.size == len(self.data):
+            self.data = np.concatenate([self.data,
+                                        self.empty(len(self.data))])
+        row = self.size
+        self.data['sid'][row] = sid
+        self.index[sid] = row
+        self.size += 1
+        return row
+
+    def active(self):
+        """The rows with a current observation this cycle"""
+        return np.nonzero(np.isfinite(self.data['valid'][:self.size]))[0]
+
+    def add_wind(self, row, sped, drcttxt):
+        """Add a wind sample for this cycle"""
+        rad = np.radians(txt2drct[drcttxt])
+        rec = self.data[row]
+        rec['spedsum'] += sped
+        rec['usum'] += -sped * np.sin(rad)
+        rec['vsum'] += -sped * np.cos(rad)
+        rec['count'] += 1
+        self.winds.setdefault(row, []).append((sped, drcttxt))
+
+    def average_winds(self):
+        """Compute the average wind for each station this cycle"""
+        data = self.data[:self.size]
+        count = data['count'].astype('f8')
+        with np.errstate(invalid='ignore', divide='ignore'):
+            data['sped'] = data['spedsum'] / count
+        # direction the vector mean wind is blowing from
+        data['drct'] = np.degrees(np.arctan2(-data['usum'],
+                                             -data['vsum'])) % 360.
+        for row in np.nonzero(count > 0)[0]:
+            data['drcttxt'][row] = drct2text(data['drct'][row])
+
+    def clear(self):
+        """Reset the stations with obs this cycle for the next one"""
+        data = self.data[:self.size]
+        rows = self.active()
+        data['lvalid'][rows] = data['valid'][rows]
+        data['valid'][rows] = np.nan
+        for name in ['spedsum', 'usum', 'vsum', 'count']:
+            data[name][rows] = 0
+        self.winds = {}
+
+    def save(self, fn):
+        """Save the state to a file"""
+        tmpfn = fn + ".tmp"
+        with open(tmpfn, 'wb') as fh:
+            np.save(fh, self.data[:self.size], allow_pickle=False)
+        os.rename(tmpfn, fn)
+
+    def load(self, fn):
+        """Load the state from a file, if it exists"""
+        if not os.path.isfile(fn):
+            return
+        data = np.load(fn, allow_pickle=False)
+        self.data = self.empty(max(256, len(data) * 2))
+        self.data[:len(data)] = data
+        self.size = len(data)
+        self.index = dict((int(sid), row)
+                          for row, sid in enumerate(data['sid']))
+
+    def load_pickle(self, fn):
+        """Convert the pickled state of prior versions, if it exists"""
+        if not os.path.isfile(fn):
+            return
+        with open(fn, 'rb') as fh:
+            db = OldStateUnpickler(fh).load()
+        for sid, ob in db.items():
+            rec = self.data[self.row(int(sid))]
+            attrs = ob.__dict__
+            for old, name in OLDSTATE_NAMES.items():
+                val = attrs.get(old)
+                if val is None:
+                    continue
+                if isinstance(val, datetime.datetime):
+                    val = time.mktime(val.timetuple())
+                rec[name] = val
+
+
+# nwnob.nwnOB attribute -> STATE_DTYPE field
+OLDSTATE_NAMES = {
+    'valid': 'valid', 'lvalid': 'lvalid', 'tmpf': 'tmpf',
+    'maxTMPF': 'max_tmpf', 'minTMPF': 'min_tmpf', 'relh': 'relh',
+    'maxRELH': 'max_relh', 'minRELH': 'min_relh', 'srad': 'srad',
+    'maxSRAD': 'max_srad', 'alti': 'alti', 'maxALTI': 'max_alti',
+    'minALTI': 'min_alti', 'ptend': 'ptend', 'pDay': 'pday',
+    'pMonth': 'pmonth', 'pRate': 'prate', 'sped': 'sped', 'drct': 'drct',
+    'drctTxt': 'drcttxt', 'maxSPED': 'max_sped',
+    'maxSPED_ts': 'max_sped_ts', 'maxDrctTxt': 'max_drcttxt',
+    'windGustAlert': 'alert_sped'}
+
+
+class OldState(object):
+    """Stand in for the removed nwnob.nwnOB class"""
+
+
+class OldStateUnpickler(pickle.Unpickler):
+    """Unpickle the prior state without the nwnob module"""
+
+    def find_class(self, module, name):
+        if module == 'nwnob':
+            return OldState
+        if module in ['datetime', 'copy_reg', 'copyreg', '__builtin__',
+                      'builtins']:
+            return pickle.Unpickler.find_class(self, module, name)
+        raise pickle.UnpicklingError("%s.%s not allowed" % (module, name))
+
+
+def load_locs():
+    """Load the station metadata, keyed by NWN id"""
+    pgconn = get_dbconn('mesosite')
+    mcursor = pgconn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+    mcursor.execute("""
+        SELECT nwn_id, id, ST_x(geom) as lon, ST_y(geom) as lat, name,
+        network, wfo, county from stations
+        WHERE network in ('KCCI', 'KELO', 'KIMT') and nwn_id is not null
+        """)
+    res = {}
+    for row in mcursor:
+        res[int(row['nwn_id'])] = {
+            'nwsli': row['id'],
+            'lat': row['lat'],
+            'lon': row['lon'],
+            'name': row['name'],
+            'tv': row['network'],
+            'routes': [row['network'], row['wfo'], 'EMAIL'],
+            'county': row['county'],
+        }
+    pgconn.close()
+    return res
+
+
+def parse_line(line):
+    """Parse a line from the feed
+
+    Returns:
+      (kind, dict) where kind is None for a current ob, or None for a
+      line that does not parse
+    """
+    tokens = list(_LINE_RE.finditer(line))
+    if len(tokens) != 1:
+        return None
+    res = tokens[0].groupdict()
+    tmpf = res['tmpf']
+    try:
+        res['tmpf'] = int(tmpf[1:] if tmpf[:2] == "0-" else tmpf)
+    except ValueError:
+        return None
+    if res['drct'] not in txt2drct:
+        return None
+    res['sped'] = int(res['sped'])
+    if res['units'] == 'KTS':
+        res['sped'] = res['sped'] / .868976
+    return res['kind'], res
+
+
+def update(store, kind, ob, now):
+    """Apply a parsed line to the station state"""
+    row = store.row(int(ob['sid']))
+    rec = store.data[row]
+    if kind is None:
+        rec['valid'] = now
+        store.add_wind(row, ob['sped'], ob['drct'])
+        rec['tmpf'] = ob['tmpf']
+        rec['srad'] = int(ob['srad'])
+        rec['relh'] = int(ob['relh'])
+        rec['alti'] = float(ob['alti'])
+        rec['ptend'] = ob['ptend']
+        rec['pday'] = float(ob['pday'])
+        rec['pmonth'] = float(ob['pmonth'])
+        rec['prate'] = 0.
+    elif kind == 'Max':
+        rec['max_tmpf'] = ob['tmpf']
+        set_gust(rec, ob['sped'])
+        rec['max_drcttxt'] = ob['drct']
+        rec['max_srad'] = int(ob['srad'])
+        rec['max_alti'] = float(ob['alti'])
+        rec['max_relh'] = int(ob['relh'])
+    else:
+        rec['min_tmpf'] = ob['tmpf']
+        rec['min_alti'] = float(ob['alti'])
+        rec['min_relh'] = int(ob['relh'])
+
+
+def set_gust(rec, gust):
+    """Set the maximum wind speed from a Max line.
+
+    A couple of things to note.
+    1. Sometimes the peak gust will come as an ob and then the MAX
+       Line will not make it in yet in time for the minute processing
+    2. The ob that generates the MAX is not gaurenteed to be in the feed
+    """
+    if np.isnan(rec['valid']) or np.isnan(rec['max_sped']):
+        return
+    if gust > rec['max_sped']:
+        rec['max_sped'] = gust
+        rec['max_sped_ts'] = rec['valid']
+    # Value is RESET for the next day!
+    elif gust < rec['max_sped']:
+        rec['max_sped'] = gust
+        rec['max_sped_ts'] = rec['valid']
+        rec['alert_sped'] = 0
+
+
+def process(store, data, now, rejects):
+    """Process a chunk of lines from the feed
+
+    Returns:
+      str of the lines that parsed
+    """
     goodLines = ""
-    lines = re.split("\015\012", dataStr)
-
-    for line in lines:
-        tokens = re.findall(_CURRENT_RE, line)
-        if len(tokens) == 1:
-            stationID = int(tokens[0][0])
-            if stationID not in db:
-                db[stationID] = nwnob.nwnOB(stationID)
-            db[stationID].valid = datetime.datetime.now()
-            db[stationID].aDrctTxt.append(tokens[0][3].strip())
-            db[stationID].aDrct.append(txt2drct[tokens[0][3].strip()])
-            if tokens[0][5] == "KTS":
-                db[stationID].aSPED.append(int(tokens[0][4]) / .868976)
-            else:
-                db[stationID].aSPED.append(int(tokens[0][4]))
-            if tokens[0][7][:2] == "0-":
-                db[stationID].tmpf = int(tokens[0][7][1:])
-            else:
-                db[stationID].tmpf = int(tokens[0][7])
-            db[stationID].srad = int(tokens[0][6])
-            db[stationID].relh = int(tokens[0][8])
-            db[stationID].alti = float(tokens[0][9])
-            db[stationID].ptend = tokens[0][10]
-            db[stationID].pDay = float(tokens[0][11])
-            db[stationID].pMonth = float(tokens[0][12])
-            db[stationID].pRate = 0.00
-#            db[stationID].valid = mx.DateTime.strptime( \
-#                tokens[0][1] +" "+ tokens[0][2], "%H:%M %m/%d/%y")
-            goodLines += line + "\n"
-            continue
-
-        tokens = re.findall(_MAX_RE, line)
-        if len(tokens) == 1:
-            stationID = int(tokens[0][0])
-            if stationID not in db:
-                db[stationID] = nwnob.nwnOB(stationID)
-            if (tokens[0][7][:2] == "0-"):
-                db[stationID].maxTMPF = int(tokens[0][7][1:])
-            else:
-                db[stationID].maxTMPF = int(tokens[0][7])
-
-            if (tokens[0][5] == "KTS"):
-                db[stationID].setGust(int(tokens[0][4]) / .868976)
-            else:
-                db[stationID].setGust(int(tokens[0][4]))
-            db[stationID].maxDrctTxt = tokens[0][3]
-            db[stationID].maxSRAD = int(tokens[0][6])
-            db[stationID].maxALTI = float(tokens[0][9])
-            db[stationID].maxRELH = int(tokens[0][8])
-            db[stationID].maxLine = line
-            goodLines += line + "\n"
-            continue
-
-        tokens = re.findall(_MIN_RE, line)
-        if len(tokens) == 1:
-            stationID = int(tokens[0][0])
-            if stationID not in db:
-                db[stationID] = nwnob.nwnOB(stationID)
-            if (tokens[0][7][:2] == "0-"):
-                db[stationID].minTMPF = int(tokens[0][7][1:])
-            else:
-                db[stationID].minTMPF = int(tokens[0][7])
-            db[stationID].minALTI = float(tokens[0][9])
-            db[stationID].minRELH = int(tokens[0][8])
-            goodLines += line + "\n"
-            db[stationID].minLine = line
+    for line in data.split("\015\012"):
+        res = parse_line(line)
+        if res is None:
+            rejects.write("%s\n" % (line,))
             continue
-
-        rejects.write("%s\n" % (line,))
+        update(store, res[0], res[1], now)
+        goodLines += line + "\n"
     return goodLines
 
 
-def archiveWriter():
-    """archive writer"""
-    for sid in db.keys():
-        # No obs during this period
-        if db[sid].valid is None:
-            continue
-
-        if db[sid].maxSPED is None:
-            db[sid].maxSPED = 0
-        mydir = "%s/%s" % (_ARCHIVE_BASE, db[sid].valid.strftime("%Y_%m/%d"))
+def localtime(ts):
+    """Convert epoch seconds to a local datetime"""
+    return datetime.datetime.fromtimestamp(ts)
+
+
+def archiveWriter(store, buf):
+    """Buffer the archive rows for the stations with obs this cycle"""
+    data = store.data
+    for row in store.active():
+        rec = data[row]
+        if np.isnan(rec['max_sped']):
+            rec['max_sped'] = 0
+        valid = localtime(rec['valid'])
+        fp = "%s/%s/%s.dat" % (_ARCHIVE_BASE, valid.strftime("%Y_%m/%d"),
+                               rec['sid'])
+        buf.setdefault(fp, []).append(
+            ("%s,%s,%02iMPH,%03iK,460F,%03iF,%03i%s,%5.2f"
+             "%s,%05.2f\"D,%05.2f\"M,%05.2f\"R,%s,\n") % (
+                valid.strftime("%H:%M,%m/%d/%y"), rec['drcttxt'],
+                rec['sped'], rec['srad'], rec['tmpf'], rec['relh'], "%",
+                rec['alti'], rec['ptend'], rec['pday'], rec['pmonth'],
+                rec['prate'], rec['max_sped']))
+
+
+def flushArchive(buf):
+    """Append the buffered archive rows, one open per file"""
+    for fp, lines in buf.items():
+        mydir = os.path.dirname(fp)
         if not os.path.isdir(mydir):
             os.makedirs(mydir, 0o775)
-        fp = "%s/%s.dat" % (mydir, sid)
-        out = open(fp, 'a')
-        out.write(("%s,%s,%02iMPH,%03iK,460F,%03iF,%03i%s,%5.2f"
-                   "%s,%05.2f\"D,%05.2f\"M,%05.2f\"R,%s,\n") % (
-            db[sid].valid.strftime("%H:%M,%m/%d/%y"), db[sid].drctTxt,
-            db[sid].sped, db[sid].srad,
-            db[sid].tmpf, db[sid].relh, "%", db[sid].alti, db[sid].ptend,
-            db[sid].pDay, db[sid].pMonth, db[sid].pRate, db[sid].maxSPED))
-        out.close()
-
-
-def averageWinds():
-    for sid in db.keys():
-        db[sid].avgWinds()
+        with open(fp, 'a') as out:
+            out.writelines(lines)
+    buf.clear()
 
 
-def sendWindAlert(sid, alertSPED, alertDrctTxt, myThreshold):
+def sendWindAlert(store, locs, row, alertSPED, alertDrctTxt, myThreshold):
+    """Generate the wind alert for a station"""
+    rec = store.data[row]
+    sid = int(rec['sid'])
     if sid in [904, 75, 907, 918, 9, 913, 924, 610, 619, 60]:
         return
     if sid not in locs:
@@ -211,6 +389,7 @@ def sendWindAlert(sid, alertSPED, alertDrctTxt, myThreshold):
     # Unreliable....
     if locs[sid]['tv'] == 'KIMT':
         return
+    valid = localtime(rec['valid'])
     form = {}
     form["threshold"] = myThreshold
     form["sname"] = locs[sid]["name"]
@@ -218,30 +397,30 @@ def sendWindAlert(sid, alertSPED, alertDrctTxt, myThreshold):
     form["lon"] = locs[sid]["lon"]
     form["nwsli"] = locs[sid]["nwsli"]
     form["county"] = locs[sid]["county"]
-    form["obts"] = db[sid].valid.strftime("%Y-%m-%d %I:%M %p")
-    form["shortts"] = db[sid].valid.strftime("%I:%M %p")
-    form["shefdate"] = db[sid].valid.strftime("%m%d")
-    form["sheftime"] = db[sid].valid.strftime("%H%M")
-    try:
-        form["gustts"] = db[sid].maxSPED_ts.strftime("%I:%M %p")
-    except Exception as _exp:
-        form["gustts"] = "Unknown"
-    form["tmpf"] = db[sid].tmpf
+    form["obts"] = valid.strftime("%Y-%m-%d %I:%M %p")
+    form["shortts"] = valid.strftime("%I:%M %p")
+    form["shefdate"] = valid.strftime("%m%d")
+    form["sheftime"] = valid.strftime("%H%M")
+    form["gustts"] = "Unknown"
+    if np.isfinite(rec['max_sped_ts']):
+        form["gustts"] = localtime(rec['max_sped_ts']).strftime("%I:%M %p")
+    form["tmpf"] = rec['tmpf']
     form["dwpf"] = "None"
-    form["pDay"] = db[sid].pDay
-    form["gust"] = db[sid].maxSPED
-    form["drct"] = db[sid].maxDrctTxt
+    form["pDay"] = rec['pday']
+    form["gust"] = rec['max_sped']
+    form["drct"] = rec['max_drcttxt']
     form["alertSPED"] = alertSPED
     form["alertDrctTxt"] = alertDrctTxt
     form["lastts"] = "Undefined"
-    if db[sid].lvalid is None:
-        form["lastts"] = db[sid].lvalid.strftime("%d %b %Y %I:%M %p")
     form["warning"] = ""
-    if db[sid].sinceLastObInMinutes() > 10:
-        form["warning"] = ("\n: WARNING: First ob since %s [ %s minutes ]. "
-                           "Perhaps Offline?"
-                           ) % (form["lastts"],
-                                db[sid].sinceLastObInMinutes())
+    if np.isfinite(rec['lvalid']):
+        form["lastts"] = localtime(rec['lvalid']).strftime(
+            "%d %b %Y %I:%M %p")
+        minutes = int(rec['valid'] - rec['lvalid']) // 60
+        if minutes > 10:
+            form["warning"] = ("\n: WARNING: First ob since %s [ %s minutes"
+                               " ]. Perhaps Offline?"
+                               ) % (form["lastts"], minutes)
 
     # Need three blank lines for the SHEF header to be printed if needed
     report = """
@@ -259,9 +438,8 @@ def sendWindAlert(sid, alertSPED, alertDrctTxt, myThreshold):
 : All Wind Obs since last ob at: %(lastts)s
 """
 
-    for i in range(len(db[sid].aSPED)):
-        report += ":    %s MPH from the %s\n" % (db[sid].aSPED[i],
-                                                 db[sid].aDrctTxt[i])
+    for (sped, drcttxt) in store.winds.get(row, []):
+        report += ":    %s MPH from the %s\n" % (sped, drcttxt)
 
     for route in locs[sid]["routes"]:
         form["route"] = route
@@ -279,7 +457,6 @@ def fireLDM(report, route, sid):
     fp.close()
     logger.info(report)
     try:
-        # if (route != "KELO" and route != "KCCI"):
         os.system("/home/ldm/bin/pqinsert -p '%s' /tmp/%s" % (
                                         fname.replace('DMX', 'DSM'), fname))
     except Exception as _exp:
@@ -290,103 +467,43 @@ def fireLDM(report, route, sid):
         datetime.datetime.now().strftime("%Y%m%d%H%M%S"), sid, fname))
 
 
-def windGustAlert():
-    for sid in db.keys():
+def windGustAlert(store, locs):
+    """Send alerts for stations with gusts over their threshold"""
+    for row in store.active():
+        rec = store.data[row]
+        sid = int(rec['sid'])
         myThreshold = _WIND_THRESHOLD
         if sid in [84, 40, 9, 78, 49]:
             myThreshold += 7
         if sid in [49, 618, 1]:
             myThreshold += 40
-        # If no obs during this period, no alerts
-        # If no obs during this period, no alerts
-        if db[sid].valid is None:
-            continue
 
         # If the max gust is greater than the threshold, we consider
-        if db[sid].maxSPED is not None and db[sid].maxSPED >= myThreshold:
-            # We also need this maxGust to be greater than previously warned
-            if (db[sid].windGustAlert is not None and
-                    db[sid].maxSPED > db[sid].windGustAlert):
+        if rec['max_sped'] >= myThreshold:
+            # We also need this maxGust to be greater than previously warned,
+            # or not have been warned at all
+            if (np.isnan(rec['alert_sped']) or
+                    rec['max_sped'] > rec['alert_sped']):
                 # Set the value for the last alert generated!
-                db[sid].windGustAlert = db[sid].maxSPED
-                sendWindAlert(sid, db[sid].maxSPED, db[sid].maxDrctTxt,
-                              myThreshold)
-                continue
-            # If the windGustAlert is None, then we should alert too
-            if db[sid].windGustAlert is None:
-                # Set the value for the last alert generated!
-                db[sid].windGustAlert = db[sid].maxSPED
-                sendWindAlert(sid, db[sid].maxSPED, db[sid].maxDrctTxt,
-                              myThreshold)
+                rec['alert_sped'] = rec['max_sped']
+                sendWindAlert(store, locs, row, rec['max_sped'],
+                              rec['max_drcttxt'], myThreshold)
                 continue
 
         # We will always alert in this situation
-        if (len(db[sid].aSPED) > 0) and (max(db[sid].aSPED) >= myThreshold):
-            # We need to find the max wind speed direction
-            for pos in range(len(db[sid].aSPED)):
-                if (max(db[sid].aSPED) == db[sid].aSPED[pos]):
-                    alertDrctTxt = db[sid].aDrctTxt[pos]
-                    db[sid].maxDrctTxt = alertDrctTxt
-                    db[sid].maxSPED_ts = db[sid].valid
-            sendWindAlert(sid, max(db[sid].aSPED), alertDrctTxt, myThreshold)
-
-
-def clearObs():
-    for sid in db.keys():
-        if db[sid].valid is not None:  # We got obs!
-            db[sid].lvalid = db[sid].valid
-            db[sid].valid = None
-            db[sid].aSPED = []
-            db[sid].aDrctTxt = []
-            db[sid].aDrct = []
-
-
-def main():
-    """Go Main Go"""
-    tn = makeConnect()
-    counter = 1
-    dryRun = 0
-    dataStr = ""
-
-    while counter > 0:
-        if counter % 15 == 0:
-            saveDB()
-        dataStr = tn.read_very_eager()
-        goodLines = process(dataStr.decode('utf-8'))
-        if len(goodLines) < 100:
-            dryRun += 1
-            logger.info("dryRun Set to: %s" % (dryRun,))
-        else:
-            dryRun = 0
-        if dryRun > 2:
-            logger.info(" ABORT ABORT")
-            raise Exception("ZZZZZZZ")
-        averageWinds()
-        windGustAlert()
-        logData(goodLines)
-        archiveWriter()
-        counter += 1
-        time.sleep(58)
-        # Run me last!
-        clearObs()
-
-
-def loadDB():
-    """load db"""
-    if not os.path.isfile("db.p"):
-        return
-    import pickle
-    global db
-    db = pickle.load(open('db.p', 'rb'))
-
-
-def saveDB():
-    """save db"""
-    import pickle
-    pickle.dump(db, open('db.p', 'wb'))
+        winds = store.winds.get(row, [])
+        if winds and max(winds)[0] >= myThreshold:
+            # We need the direction of the last max wind speed
+            maxsped = max(winds)[0]
+            alertDrctTxt = [w[1] for w in winds if w[0] == maxsped][-1]
+            rec['max_drcttxt'] = alertDrctTxt
+            rec['max_sped_ts'] = rec['valid']
+            sendWindAlert(store, locs, row, maxsped, alertDrctTxt,
+                          myThreshold)
 
 
 def logData(goodLines):
+    """Append the good lines to our log"""
     try:
         now = datetime.datetime.now()
         f = open("/mesonet/data/logs/snet.log", 'a')
@@ -397,17 +514,219 @@ def logData(goodLines):
         logger.exception("\nCould not write Log\n")
 
 
+class Ingest(object):
+    """The feed reader and the once a cycle processing."""
+
+    def __init__(self, store, locs, rejects):
+        """Constructor"""
+        self.store = store
+        self.locs = locs
+        self.rejects = rejects
+        self.goodLines = ""
+        self.archive = {}
+        self.sock = None
+        self.buf = b""
+        self.dryRun = 0
+
+    def connect(self):
+        """Connect and login to the NWN server"""
+        sock = socket.create_connection(('iem-nwnserver', 14996), _TIMEOUT)
+        try:
+            buf = read_until(sock, b"login> ", b"")
+            sock.sendall(("%s\r\n" % (secret.cfg['hubuser'],)
+                          ).encode('utf-8'))
+            buf = read_until(sock, b"password> ", buf)
+            sock.sendall(("%s\r\n" % (secret.cfg['hubpass'],)
+                          ).encode('utf-8'))
+        except (IOError, OSError):
+            sock.close()
+            raise
+        self.sock = sock
+        self.buf = b""
+        self.dryRun = 0
+
+    def disconnect(self):
+        """Drop the connection"""
+        if self.sock is not None:
+            self.sock.close()
+        self.sock = None
+        self.buf = b""
+
+    def read_feed(self):
+        """Read what the feed has, dropping the connection should it end"""
+        try:
+            data = self.sock.recv(65536)
+        except (IOError, OSError):
+            logger.exception("Error reading the feed")
+            data = b""
+        if not data:
+            self.disconnect()
+            return
+        lines = (self.buf + data).split(b"\n")
+        # the last piece is an incomplete line
+        self.buf = lines.pop()
+        for line in lines:
+            self.goodLines += process(self.store,
+                                      line.decode('utf-8', 'ignore'
+                                                  ).rstrip("\r\n"),
+                                      time.time(), self.rejects)
+
+    def cycle(self):
+        """Process the obs received this cycle"""
+        if len(self.goodLines) < 100:
+            self.dryRun += 1
+            logger.info("dryRun Set to: %s" % (self.dryRun,))
+        else:
+            self.dryRun = 0
+        if self.dryRun > 2 and self.sock is not None:
+            logger.info(" ABORT ABORT, reconnecting")
+            self.disconnect()
+        self.store.average_winds()
+        windGustAlert(self.store, self.locs)
+        logData(self.goodLines)
+        self.goodLines = ""
+        archiveWriter(self.store, self.archive)
+        # Run me last!
+        self.store.clear()
+
+    def run(self):
+        """Go Main Go"""
+        counter = 1
+        now = time.time()
+        nextcycle = now + _CYCLE
+        lastflush = now
+        nextconnect = now
+        backoff = _BACKOFF
+        try:
+            while True:
+                now = time.time()
+                if self.sock is None and now >= nextconnect:
+                    logger.info("\n ------ BEGIN makeConnect ------ \n")
+                    try:
+                        self.connect()
+                        backoff = _BACKOFF
+                        logger.info("\n -------END makeConnect ------ \n")
+                    except (IOError, OSError):
+                        logger.exception("Error in makeConnect(), retry in "
+                                         "%ss", backoff)
+                        nextconnect = time.time() + backoff
+                        backoff = min(backoff * 2, _MAX_BACKOFF)
+                    continue
+                wait = max(nextcycle - now, 0)
+                if self.sock is None:
+                    time.sleep(min(wait, max(nextconnect - now, 0)))
+                elif select.select([self.sock], [], [], wait)[0]:
+                    self.read_feed()
+                    continue
+                if time.time() < nextcycle:
+                    continue
+                self.cycle()
+                if time.time() - lastflush >= _FLUSH_INTERVAL:
+                    flushArchive(self.archive)
+                    lastflush = time.time()
+                if counter % _SAVE_CYCLES == 0:
+                    self.store.save(_STATEFN)
+                counter += 1
+                nextcycle = time.time() + _CYCLE
+        finally:
+            self.disconnect()
+            flushArchive(self.archive)
+
+
+def read_until(sock, token, buf):
+    """Read from a socket until token is seen
+
+    Returns:
+      bytes received after the token
+    """
+    while token not in buf:
+        data = sock.recv(4096)
+        if not data:
+            raise IOError("connection closed waiting for %s" % (token, ))
+        buf += data
+    return buf.split(token, 1)[1]
+
+
+def test_parse_line():
+    """Do we parse the three flavours of lines?"""
+    tail = " 08MPH 460K 460F 072F 045% 30.01R 00.00\"D 01.23\"M"
+    kind, ob = parse_line("A 123  14:02 06/01/18  NNE" + tail)
+    assert kind is None
+    assert ob['sid'] == '123'
+    assert ob['tmpf'] == 72
+    assert ob['sped'] == 8
+    assert parse_line("A 12  Max 06/01/18  SW" + tail)[0] == 'Max'
+    assert parse_line("A 12  Min 06/01/18  SW" + tail)[0] == 'Min'
+    assert parse_line("A 12  Max 06/01/18  XYZ" + tail) is None
+
+
+def test_store():
+    """Does the store grow and average winds?"""
+    store = StationStore(capacity=1)
+    for sid in [5, 6]:
+        row = store.row(sid)
+        store.data['valid'][row] = 1.
+        store.add_wind(row, 10, 'E')
+        store.add_wind(row, 10, 'S')
+    assert store.size == 2
+    store.average_winds()
+    assert abs(store.data['drct'][1] - 135.) < 0.01
+    store.clear()
+    assert len(store.active()) == 0
+
+
+def test_load_pickle(tmpdir):
+    """Can we convert the pickled state of prior versions?"""
+    import sys
+    import types
+
+    class nwnOB(object):
+        """As pickled by prior versions"""
+
+    module = types.ModuleType('nwnob')
+    nwnOB.__module__ = 'nwnob'
+    nwnOB.__qualname__ = 'nwnOB'
+    module.nwnOB = nwnOB
+    sys.modules['nwnob'] = module
+    try:
+        ob = nwnOB()
+        ob.maxSPED = 45
+        ob.maxSPED_ts = datetime.datetime(2018, 6, 1, 12)
+        ob.maxDrctTxt = 'SW'
+        ob.minTMPF = 55
+        ob.valid = None
+        fn = str(tmpdir.join("db.p"))
+        with open(fn, 'wb') as fh:
+            pickle.dump({12: ob}, fh)
+    finally:
+        del sys.modules['nwnob']
+    store = StationStore()
+    store.load_pickle(fn)
+    rec = store.data[store.index[12]]
+    assert rec['max_sped'] == 45
+    assert rec['max_drcttxt'] == 'SW'
+    assert rec['min_tmpf'] == 55
+    assert np.isnan(rec['valid'])
+    assert localtime(rec['max_sped_ts']).hour == 12
+
+
 MAXEMAILS = 10
 
 if __name__ == "__main__":
-    loadDB()
+    STORE = StationStore()
+    if os.path.isfile(_STATEFN):
+        STORE.load(_STATEFN)
+    else:
+        STORE.load_pickle(_OLDSTATEFN)
+    REJECTS = open("/mesonet/data/logs/rejects.log", 'w')
+    INGEST = Ingest(STORE, load_locs(), REJECTS)
     running = True
     while running:
         try:
             logger.info("GO MAIN GO!")
-            main()
+            INGEST.run()
         except KeyboardInterrupt:
-            saveDB()
+            STORE.save(_STATEFN)
             running = False
         except Exception as _exp:
             logger.exception("Uh oh!")
@@ -427,4 +746,4 @@ if __name__ == "__main__":
                 s.close()
             MAXEMAILS -= 1
 
-    rejects.close()
+    REJECTS.close()
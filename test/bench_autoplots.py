@@ -0,0 +1,328 @@
+"""Benchmark each autoplot in process and flag regressions between runs.
+
+`run_autoplots.py` requests each app over HTTP, which only tells us that it
+worked.  Here each app's `plotter()` (and `highcharts()`) is called directly,
+each case within a fresh forked process, recording the wall time, the time
+spent within database queries, the time spent rendering the result (PNG,
+javascript) and the peak RSS of the process.
+
+    python bench_autoplots.py [--apps 84,182] [--dbhost localhost]
+        [--cases default,heavy] [--baseline results.json]
+
+Cases are `default`, the app's default arguments, and any named argument sets
+for the app within `autoplot_bench.json` (ie the `heavy` ones, long periods
+and big domains).  The database is the recorded fixture restored to a local
+PostgreSQL (see `database/init`), `--dbhost` overrides the host our apps
+connect to.  Results are saved as JSON to `--outdir`, then compared against
+`--baseline` (default: the previous results file) and the slowest apps and
+any regressions are printed.
+"""
+from __future__ import print_function
+import os
+import sys
+import glob
+import json
+import time
+import argparse
+import datetime
+import resource
+import multiprocessing
+from io import BytesIO
+
+import psycopg2
+import psycopg2.extensions
+
+BASEDIR = os.path.dirname(os.path.abspath(__file__))
+APDIR = os.path.join(BASEDIR, "../htdocs/plotting/auto")
+CASEFILE = os.path.join(BASEDIR, "autoplot_bench.json")
+# seconds a case is given prior to being killed
+TIMEOUT = 600
+# a case is a regression when slower than the baseline by this factor, and
+# by at least MINSECS
+SLOWER = 1.25
+MINSECS = 0.5
+# or uses this factor more peak memory
+BIGGER = 1.25
+
+sys.path.insert(0, APDIR)
+import apregistry  # noqa: E402
+
+# Per worker process timing state
+STATE = {'sql': 0., 'queries': 0, 'dbhost': None}
+
+
+def timed_cursor(base):
+    """Create a cursor class timing its execute calls"""
+
+    class TimedCursor(base):
+        """A cursor keeping track of its time spent"""
+
+        def execute(self, query, args=None):
+            sts = time.time()
+            try:
+                return super(TimedCursor, self).execute(query, args)
+            finally:
+                STATE['sql'] += time.time() - sts
+                STATE['queries'] += 1
+
+        def executemany(self, query, args_list):
+            sts = time.time()
+            try:
+                return super(TimedCursor, self).executemany(query, args_list)
+            finally:
+                STATE['sql'] += time.time() - sts
+                STATE['queries'] += 1
+
+    return TimedCursor
+
+
+class TimedConnection(psycopg2.extensions.connection):
+    """A connection handing out timed cursors"""
+    _classes = {}
+
+    def cursor(self, *args, **kwargs):
+        base = kwargs.pop('cursor_factory',
+                          None) or psycopg2.extensions.cursor
+        if base not in self._classes:
+            self._classes[base] = timed_cursor(base)
+        kwargs['cursor_factory'] = self._classes[base]
+        return super(TimedConnection, self).cursor(*args, **kwargs)
+
+
+def instrument_psycopg2():
+    """Have all new database connections time their queries"""
+    _connect = psycopg2.connect
+
+    def connect(*args, **kwargs):
+        kwargs['connection_factory'] = TimedConnection
+        if STATE['dbhost'] is not None:
+            kwargs['host'] = STATE['dbhost']
+        return _connect(*args, **kwargs)
+
+    psycopg2.connect = connect
+
+
+def describe(apps, conn):
+    """Send back the formats of each app, or its import error"""
+    res = {}
+    for appid in apps:
+        try:
+            meta = apregistry.get_app(appid).get_description()
+            res[appid] = ['png', 'js'] if meta.get('highcharts') else ['png']
+        except Exception as exp:
+            res[appid] = "%s" % (exp, )
+    conn.send(res)
+    conn.close()
+
+
+def get_formats(apps):
+    """Get the formats of each app from a throwaway process
+
+    Importing the apps here would bloat this process, and so the peak RSS of
+    each case's process forked from it.
+    """
+    (recv, send) = multiprocessing.Pipe(False)
+    proc = multiprocessing.Process(target=describe, args=(apps, send))
+    proc.start()
+    send.close()
+    try:
+        res = recv.recv()
+    except EOFError:
+        res = {}
+    proc.join()
+    return res
+
+
+def load_cases(apps, names):
+    """Build the list of (appid, fmt, case name, fdict) to run"""
+    extra = {}
+    if os.path.isfile(CASEFILE):
+        with open(CASEFILE) as fh:
+            extra = json.load(fh)
+    formats = get_formats(apps)
+    cases = []
+    for appid in apps:
+        fmts = formats.get(appid, 'describe process died')
+        if not isinstance(fmts, list):
+            print("bench_autoplots %s import failed: %s" % (appid, fmts))
+            continue
+        sets = {'default': {}}
+        sets.update(extra.get(str(appid), {}))
+        for name in sorted(sets):
+            if names and name not in names:
+                continue
+            for fmt in fmts:
+                cases.append((appid, fmt, name, sets[name]))
+    return cases
+
+
+def render(res, fmt):
+    """Generate the output content as autoplot.wsgi does"""
+    from pyiem.plot.use_agg import plt
+    if not isinstance(res, tuple):
+        res = (res, )
+    mixedobj = res[0]
+    if fmt == 'js':
+        if isinstance(mixedobj, dict):
+            return len(json.dumps(mixedobj))
+        return len(mixedobj)
+    if isinstance(mixedobj, plt.Figure):
+        ram = BytesIO()
+        mixedobj.savefig(ram, format=fmt, dpi=100)
+        plt.close()
+        return len(ram.getvalue())
+    # data only apps, as they are requested as csv
+    if len(res) > 1 and res[1] is not None:
+        return len(res[1].to_csv())
+    return 0
+
+
+def run_case(case, conn):
+    """Run a case within this (forked) process, sending back the result"""
+    (appid, fmt, name, fdict) = case
+    res = dict(app=appid, fmt=fmt, case=name, status='ok', error=None)
+    res['import'] = None
+    STATE['sql'] = 0.
+    STATE['queries'] = 0
+    sts = time.time()
+    try:
+        app = apregistry.get_app(appid)
+        # recorded separately from the case's wall time
+        res['import'] = apregistry.get_import_timing(appid)
+        sts = time.time()
+        args = dict(fdict)
+        ret = app.highcharts(args) if fmt == 'js' else app.plotter(args)
+        rsts = time.time()
+        res['bytes'] = render(ret, fmt)
+        res['render'] = time.time() - rsts
+    except Exception as exp:
+        res['status'] = 'error'
+        res['error'] = "%s: %s" % (exp.__class__.__name__, exp)
+        res['render'] = 0.
+    res['wall'] = time.time() - sts
+    res['sql'] = STATE['sql']
+    res['queries'] = STATE['queries']
+    # kilobytes on linux
+    res['peak_rss_mb'] = resource.getrusage(
+        resource.RUSAGE_SELF).ru_maxrss / 1024.
+    conn.send(res)
+    conn.close()
+
+
+def run(cases):
+    """Run each case in its own process"""
+    results = []
+    for case in cases:
+        (recv, send) = multiprocessing.Pipe(False)
+        proc = multiprocessing.Process(target=run_case, args=(case, send))
+        proc.start()
+        # so that we see the pipe close should the process die
+        send.close()
+        res = None
+        status = 'timeout'
+        if recv.poll(TIMEOUT):
+            try:
+                res = recv.recv()
+            except EOFError:
+                status = 'crashed'
+        if res is None:
+            proc.terminate()
+            res = dict(app=case[0], fmt=case[1], case=case[2],
+                       status=status, error=None, wall=TIMEOUT, sql=0.,
+                       render=0., queries=0, peak_rss_mb=0.)
+            res['import'] = None
+        proc.join()
+        print(("%4s %-3s %-8s %-7s wall:%7.2fs sql:%7.2fs render:%6.2fs "
+               "rss:%7.1fMB %s") % (res['app'], res['fmt'], res['case'],
+                                    res['status'], res['wall'], res['sql'],
+                                    res['render'], res['peak_rss_mb'],
+                                    res['error'] or ''))
+        results.append(res)
+    return results
+
+
+def compare(results, baseline):
+    """Find the cases slower or bigger than the baseline
+
+    Returns:
+      list of message strings
+    """
+    old = dict(((r['app'], r['fmt'], r['case']), r) for r in baseline
+               if r['status'] == 'ok')
+    msgs = []
+    for res in results:
+        prev = old.get((res['app'], res['fmt'], res['case']))
+        if prev is None:
+            continue
+        if res['status'] != 'ok':
+            msgs.append("%s %s %s now %s" % (res['app'], res['fmt'],
+                                             res['case'], res['status']))
+            continue
+        if (res['wall'] > prev['wall'] * SLOWER and
+                res['wall'] - prev['wall'] > MINSECS):
+            msgs.append("%s %s %s wall %.2fs -> %.2fs" % (
+                res['app'], res['fmt'], res['case'], prev['wall'],
+                res['wall']))
+        if res['peak_rss_mb'] > prev['peak_rss_mb'] * BIGGER:
+            msgs.append("%s %s %s peak rss %.1fMB -> %.1fMB" % (
+                res['app'], res['fmt'], res['case'], prev['peak_rss_mb'],
+                res['peak_rss_mb']))
+    return msgs
+
+
+def main(argv):
+    """Go Main Go"""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument('--apps', help='comma delimited app numbers')
+    parser.add_argument('--cases', help='comma delimited case names')
+    parser.add_argument('--dbhost', help='database host to connect to')
+    parser.add_argument('--outdir', default=os.path.join(BASEDIR,
+                                                         'bench_results'))
+    parser.add_argument('--baseline', help='results file to compare with')
+    args = parser.parse_args(argv[1:])
+    STATE['dbhost'] = args.dbhost
+    instrument_psycopg2()
+
+    apps = apregistry.list_apps()
+    if args.apps:
+        apps = [int(a) for a in args.apps.split(",")]
+    names = args.cases.split(",") if args.cases else None
+    results = run(load_cases(apps, names))
+
+    if not os.path.isdir(args.outdir):
+        os.makedirs(args.outdir)
+    previous = sorted(glob.glob(os.path.join(args.outdir, "*.json")))
+    baseline = args.baseline or (previous[-1] if previous else None)
+    fn = os.path.join(args.outdir, "%s.json" % (
+        datetime.datetime.now().strftime("%Y%m%d%H%M%S"), ))
+    with open(fn, 'w') as fh:
+        json.dump(dict(argv=argv[1:], results=results), fh, indent=1)
+    print("bench_autoplots results saved to %s" % (fn, ))
+
+    print("Slowest cases:")
+    for res in sorted(results, key=lambda r: r['wall'], reverse=True)[:10]:
+        print("  %4s %-3s %-8s %7.2fs (sql %.2fs, render %.2fs)" % (
+            res['app'], res['fmt'], res['case'], res['wall'], res['sql'],
+            res['render']))
+    if baseline is None:
+        return 0
+    with open(baseline) as fh:
+        msgs = compare(results, json.load(fh)['results'])
+    print("%s regressions against %s" % (len(msgs), baseline))
+    for msg in msgs:
+        print("  REGRESSION %s" % (msg, ))
+    return 1 if msgs else 0
+
+
+def test_compare():
+    """Do we flag what we should?"""
+    base = dict(app=1, fmt='png', case='default', status='ok', wall=2.,
+                peak_rss_mb=100.)
+    assert not compare([dict(base, wall=2.4)], [base])
+    assert len(compare([dict(base, wall=3.)], [base])) == 1
+    assert len(compare([dict(base, peak_rss_mb=200.)], [base])) == 1
+    assert len(compare([dict(base, status='error')], [base])) == 1
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))